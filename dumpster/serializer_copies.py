@@ -0,0 +1,65 @@
+from edgine.src.transport.serializer import PickleSerializer, OutOfBandSerializer, SerializedQueue
+from multiprocessing import Process, Queue
+import numpy as np
+import tracemalloc
+import time
+
+MESSAGES = 200
+
+
+class HeadMeasurement:
+
+    def __init__(self, img: np.ndarray, temperature: float):
+        self.img: np.ndarray = img
+        self.temperature: float = temperature
+
+
+def make_payload():
+    frame = np.random.randint(255, size=(1080, 1920, 3), dtype=np.uint8)
+    heads = [HeadMeasurement(np.random.randint(255, size=(100, 100, 3), dtype=np.uint8), 36.6) for _ in range(4)]
+    return {"frame": frame, "heads": heads}
+
+
+def bytes_copied(serializer, payload):
+    """Bytes allocated while serializing and deserializing one message, this is what gets copied"""
+    tracemalloc.start()
+    frames = serializer.dumps(payload)
+    dumped = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # What arrives on the other side of the pipe always lands in fresh buffers, we only count what loads adds
+    frames = [bytearray(f) for f in frames]
+    tracemalloc.start()
+    serializer.loads(frames)
+    loaded = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dumped, loaded
+
+
+def consume(q, n):
+    for i in range(n):
+        q.get(timeout=5)
+
+
+def throughput(q, payload):
+    p = Process(target=consume, args=(q, MESSAGES))
+    p.start()
+    s = time.time()
+    for i in range(MESSAGES):
+        q.put(payload, timeout=5)
+    p.join()
+    return MESSAGES / (time.time() - s)
+
+
+if __name__ == "__main__":
+    payload = make_payload()
+    payload_size = payload["frame"].nbytes + sum(h.img.nbytes for h in payload["heads"])
+    print(f"Payload : {payload_size} bytes of arrays")
+
+    for serializer in [PickleSerializer(), OutOfBandSerializer()]:
+        dumped, loaded = bytes_copied(serializer, payload)
+        print(f"{type(serializer).__name__: >20} : {dumped: >10} bytes copied by dumps, "
+              f"{loaded: >10} bytes copied by loads")
+
+    print(f"{'Queue': >20} : {throughput(Queue(maxsize=2), payload):.1f} msg/s")
+    print(f"{'SerializedQueue': >20} : {throughput(SerializedQueue(maxsize=2), payload):.1f} msg/s")
@@ -1,17 +1,74 @@
 """Console script for edgine."""
 import argparse
+import json
 import sys
 
 
+def benchmark(args) -> int:
+    """Run the benchmark suite and print or save the results as JSON"""
+    from edgine.src.benchmark.runner import run_suite
+
+    results = run_suite(topologies=args.topology,
+                        payloads=args.payload,
+                        transports=args.transport,
+                        stages=args.stages,
+                        duration=args.duration)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    for r in results["results"]:
+        print(f"{r['topology']:>7} {r['payload']:>6} {r['transport']:>5} : "
+              f"{r['items_per_s']:8.1f} items/s, "
+              f"p50 {r['latency_ms']['p50']:7.2f}ms, p99 {r['latency_ms']['p99']:7.2f}ms, "
+              f"{(r['bytes_copied_per_item'] or 0) / 1e6:8.2f}MB copied/item")
+
+    return 0
+
+
+def decode_log(args) -> int:
+    """Print the records of binary log files as lines"""
+    from edgine.src.logger.sinks import decode, format_record
+
+    for path in args.files:
+        try:
+            for record in decode(path):
+                print(format_record(*record))
+        except (OSError, ValueError) as e:
+            print(f"{path} : {e}", file=sys.stderr)
+            return 1
+
+    return 0
+
+
 def main():
     """Console script for edgine."""
+    from edgine.src.benchmark.cte import PAYLOADS, TOPOLOGIES
+    from edgine.src.transport.cte import QUEUE, SHM
+
     parser = argparse.ArgumentParser()
-    parser.add_argument('_', nargs='*')
+    subparsers = parser.add_subparsers(dest="command")
+
+    bench = subparsers.add_parser("benchmark", help="Run headless synthetic pipelines and measure them")
+    bench.add_argument("--topology", nargs="+", choices=TOPOLOGIES, default=None)
+    bench.add_argument("--payload", nargs="+", choices=list(PAYLOADS.keys()), default=None)
+    bench.add_argument("--transport", nargs="+", choices=[QUEUE, SHM], default=None)
+    bench.add_argument("--stages", type=int, default=3, help="number of relays in a pipeline")
+    bench.add_argument("--duration", type=float, default=5.0, help="seconds to measure every pipeline")
+    bench.add_argument("--output", default=None, help="JSON file to write the results to")
+
+    decode = subparsers.add_parser("decode-log", help="Print binary log files as text")
+    decode.add_argument("files", nargs="+", help="binary log files, .gz ones are decompressed")
+
     args = parser.parse_args()
 
-    print("Arguments: " + str(args._))
-    print("Replace this message by putting your code into "
-          "edgine.cli.main")
+    if args.command == "benchmark":
+        return benchmark(args)
+    elif args.command == "decode-log":
+        return decode_log(args)
+
+    parser.print_help()
     return 0
 
 
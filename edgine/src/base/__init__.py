@@ -1,14 +1,29 @@
-from multiprocessing import Queue, Process, Event, Array
+from multiprocessing import Queue, Process, Event, Array, Value
 from multiprocessing.queues import Queue as Q
-from ctypes import c_int8
-from typing import Any, List
+from ctypes import c_int8, c_uint64
+from typing import Any, Dict, List, Optional, Tuple
 from abc import ABC, abstractmethod
 from datetime import datetime
 from edgine.src.config.config_server import ConfigServer
 from edgine.src.config.config import Config
-from edgine.src.logger.cte import ERROR, INFO, DEBUG, LOG
+from edgine.src.logger.cte import ERROR, INFO, DEBUG, LOG, TRACE, LOG_BATCH_SIZE, LOG_FLUSH_PERIOD
+from edgine.src.logger.edgine_logger import effective_level
+from edgine.src.logger.clock import log_time
+from edgine.src.transport.selectable_event import waitable, wait_any
+from edgine.src.transport.envelope import Envelope, payload, rewrap
+from edgine.src.transport.shm_queue import SharedMemoryQueue, SharedMemoryRing, BroadcastQueue
+from edgine.src.transport.mailbox import SharedMemoryMailbox
+from edgine.src.transport.connection import Connection
+from edgine.src.tracing.trace_buffer import complete_event, flow_event
+from edgine.src.tracing.flight_recorder import FlightRecorder
+from edgine.src.metrics.metrics_table import MetricsTable
+from edgine.src.metrics.histogram import LatencyHistogram
+from edgine.src.metrics.cte import PUBLISH_PERIOD, HISTOGRAM_WINDOW, PHASES, STATS, GET, SECOND_GET, BLOGIC, POST
 import time
 import queue
+import random
+import cProfile
+import os
 
 
 class EdgineBase(Process, ABC):
@@ -22,6 +37,15 @@ class EdgineBase(Process, ABC):
                  secondary_data_in_list: List[Queue] = None,
                  data_out_list: List[Queue] = None,
                  min_runtime: float = 0.001,
+                 event_driven: bool = False,
+                 ordered_replica: bool = False,
+                 batching: bool = False,
+                 batch_size: int = 8,
+                 batch_wait_ms: float = 10.0,
+                 max_age: float = None,
+                 metrics: MetricsTable = None,
+                 metrics_row: int = 0,
+                 flight_recorder: FlightRecorder = None,
                  **kwargs):
         Process.__init__(self, name=name)
         self._stop_event: Event = stop_event
@@ -29,18 +53,65 @@ class EdgineBase(Process, ABC):
         if data_out_list is None:
             data_out_list = []
 
+        # Batch size and max wait live in the config, so they can be changed while running
+        self._batching: bool = batching and data_in is not None
+        self._batch_size_key: str = f"{name}_batch_size"
+        self._batch_wait_key: str = f"{name}_batch_wait_ms"
+        if self._batching:
+            config_server.declare(self._batch_size_key, int, batch_size, min=1)
+            config_server.declare(self._batch_wait_key, float, float(batch_wait_ms), min=0.0)
+
+        # Setting profile_<name> to a number of seconds profiles this service for that long
+        self._profile_key: str = f"profile_{name}"
+        config_server.create_if_unknown(self._profile_key, 0)
+        config_server.create_if_unknown("profile_dir", "profiles")
+
         self.cfg: Config = config_server.get_config_copy()
         self._name: str = name
         self._logging_q: Queue = logging_q
         self._data_in: Queue = data_in
+        # Items of a shared memory input are views on its ring, only valid until the next get
+        channel = getattr(data_in, "channel", data_in)
+        self._input_ring: SharedMemoryRing = channel.ring if isinstance(channel, SharedMemoryQueue) else None
         self._secondary_data_in: List[Queue] = secondary_data_in_list
         self.secondary_data: List[Any] = [None] * len(self._secondary_data_in)
         self._data_out_list: List[Queue] = data_out_list
         self._min_runtime: float = min_runtime
-        self._blogic_time: float = 0.005
-        self._get_time: float = 0.005
-        self._second_get_time: float = 0.005
-        self._post_time: float = 0.005
+        self._event_driven: bool = event_driven
+        self._ordered_replica: bool = ordered_replica
+        self._input_envelope: Envelope = None
+        self._out_seq: int = 0
+        self._max_age: float = max_age
+        self._stale_drops = Value(c_uint64, 0)
+        self._trace_events: List[Dict[str, Any]] = []
+        self._trace_flushed: float = time.time()
+        self._metrics: MetricsTable = metrics
+        self._metrics_row: int = metrics_row
+        # Keeps the last log records and loop timings of this service, in the row of its metrics
+        self._recorder: FlightRecorder = flight_recorder
+        self._recorder_level: int = INFO
+        self._loops: int = 0
+        self._items_in: int = 0
+        self._items_out: int = 0
+        self._published: Tuple[float, int, int, int] = (time.time(), 0, 0, 0)
+        self._profiler: cProfile.Profile = None
+        self._profile_until: float = 0.0
+        self._profile_seen: Any = getattr(self.cfg, self._profile_key, 0)
+        # One latency histogram per phase of the loop, see edgine.src.metrics.cte.PHASES
+        self._latencies: List[LatencyHistogram] = [LatencyHistogram() for phase in PHASES]
+        self._window_start: float = time.time()
+        self._waitables: List = None
+        self._input_waitable = None
+        self._config_waitable = None
+        self._wait_timeout: float = None
+        # Messages above this level would be dropped by every logger output, so they aren't sent at all
+        self._log_level: int = DEBUG
+        self.cfg.subscribe("log_logging_lvl", self.update_log_level)
+        self.cfg.subscribe("log_rejection_list", self.update_log_level)
+        self.cfg.subscribe("flight_recorder_level", self.update_log_level)
+        # While running, messages are sent in batches, None sends them one by one
+        self._log_buffer: List[Dict[int, List[str]]] = None
+        self._log_buffered: float = 0.0
 
     @property
     def name(self) -> str:
@@ -50,23 +121,89 @@ class EdgineBase(Process, ABC):
     def name(self, value: str) -> None:
         self._name = value
 
+    @property
+    def stale_drops(self) -> int:
+        """Number of input items that were dropped because they were older than max_age"""
+        return self._stale_drops.value
+
     def update_secondary_data(self) -> None:
         """Update the secondary input data"""
         for i in range(len(self._secondary_data_in)):
             if not self._secondary_data_in[i].empty():
-                self.secondary_data[i] = self._secondary_data_in[i].get_nowait()
+                # The producer can take the item back (DROP_OLDEST) between empty() and get
+                try:
+                    self.secondary_data[i] = payload(self._secondary_data_in[i].get_nowait())
+                except queue.Empty:
+                    pass
 
-    def get_from_q(self) -> Any:
+    def wait_for_event(self, timeout: float = None) -> bool:
         """
-        Get data from input Q
+        Block until there is input data, secondary data, a config change or a stop.
+        Anything that can't be waited on (like a mailbox) is just picked up on the next wakeup,
+        if the stop event can't be waited on, we check it every 0.1s.
+        :param timeout: max time to block, None to block until something happens
+        :return: True if the input Q has data
+        """
+        if self._waitables is None:
+            self._waitables = [w for w in [waitable(self._data_in),
+                                           *[waitable(q) for q in self._secondary_data_in],
+                                           waitable(self.cfg),
+                                           waitable(self._stop_event)] if w is not None]
+            self._input_waitable = waitable(self._data_in)
+            self._config_waitable = waitable(self.cfg)
+            if waitable(self._stop_event) is None:
+                self._wait_timeout = 0.1
+
+        if timeout is None:
+            timeout = self._wait_timeout
+
+        # Don't hold buffered log messages back while idle
+        if self._log_buffer:
+            remaining = max(0.0, self._log_buffered + LOG_FLUSH_PERIOD - time.time())
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
+        # Items that came in out of order are already off the pipe, it won't wake us up for them
+        if getattr(self._data_in, "pending", 0) > 0:
+            if not self._data_in.empty():
+                return True
+            timeout = self._data_in.reorder_timeout if timeout is None else min(timeout, self._data_in.reorder_timeout)
+
+        ready = wait_any(self._waitables, timeout=timeout)
+        # Or a wakeup for a change we already read would keep waking us up
+        if self._config_waitable is not None and self._config_waitable in ready:
+            self.cfg.drain()
+        return self._input_waitable is not None and self._input_waitable in ready
+
+    def get_from_q(self, timeout: float = None) -> Any:
+        """
+        Get data from input Q, items older than max_age are dropped on the way
+        :param timeout: max time to wait for data, defaults to half of min_runtime
         :return: The data from the input Q
         """
         if self._data_in is None:
             return None
 
+        if timeout is None:
+            timeout = self._min_runtime / 2.0
+
+        deadline = time.time() + timeout
+        self._input_envelope = None
         try:
-            data = self._data_in.get(timeout=self._min_runtime / 2.0)
-            self.debug(f"Data found of type {type(data)}")
+            while True:
+                item = self._data_in.get(timeout=max(0.0, deadline - time.time()))
+                self._input_envelope = item if isinstance(item, Envelope) else getattr(self._data_in, "last_envelope", None)
+                if self._max_age is None or self._input_envelope is None or self._input_envelope.age <= self._max_age:
+                    break
+
+                self.trace_input(self._input_envelope)
+                with self._stale_drops.get_lock():
+                    self._stale_drops.value += 1
+                if self._ordered_replica:
+                    self.post_skip()
+
+            self.trace_input(self._input_envelope)
+            data = payload(item)
+            self.debug("Data found of type %s", type(data))
             return data
         except queue.Empty:
             return None
@@ -75,28 +212,207 @@ class EdgineBase(Process, ABC):
 
     def post_to_qs(self, data: Any) -> bool:
         """
-        Post data to each output Q
+        Post data to each output Q, in an Envelope for the Connections
         :param data: data to post
-        :return: True if no exception
+        :return: True if no output raised an exception, the others still got the data
         """
         if data is None:
             return True
 
+        # Outputs keep the capture time of their input, results of a replica also keep its sequence number,
+        # so they can be put back in order
+        env = self._input_envelope
+        data = Envelope(self._input_seq() if self._ordered_replica else self._out_seq,
+                        data,
+                        env.ts if env is not None else None,
+                        env.trace if env is not None else self.new_trace())
+        self._out_seq += 1
+
+        if data.trace is not None:
+            data.sent = time.time()
+            self._trace_events.append(flow_event(data.trace, data.sent, self.name, os.getpid(), start=True))
+
+        self.debug("Posting output to %d queue(s)", len(self._data_out_list))
+        # A queue pickles its items later, from its feeder thread, by then the slot of a view may be reused.
+        # Shared memory outputs and mailboxes copy the data right away, the others get a copy of the view
+        view = self._input_ring is not None and self._input_ring.holds(data.data)
+        copy = None
+
+        ok = True
+        for i, q in enumerate(self._data_out_list):
+            # Connections handle a full queue according to their backpressure policy
+            try:
+                item = data
+                if view and not isinstance(getattr(q, "channel", q),
+                                           (SharedMemoryQueue, BroadcastQueue, SharedMemoryMailbox)):
+                    if copy is None:
+                        copy = rewrap(data, data.data.copy())
+                    item = copy
+                # Only connections take the envelope off, a plain queue gets the data like it always did
+                q.put_nowait(item if isinstance(q, (Connection, BroadcastQueue)) else item.data)
+            except queue.Full:
+                pass
+            except Exception as e:
+                # One output failing doesn't keep the data from the others
+                ok = False
+                name = getattr(q, "name", f"#{i}")
+                channel = getattr(q, "channel", q)
+                if isinstance(e, ValueError) and isinstance(channel, SharedMemoryMailbox):
+                    self.error(f"Output {name} is a mailbox of {channel.size} bytes, too small for this data : {e}")
+                else:
+                    self.error(f"Unknown exception in post_to_qs, output {name} : {e}")
+
+        return ok
+
+    def get_batch(self, first: Any) -> Tuple[List[Any], List[Envelope]]:
+        """
+        Collect more input after the first item, until the batch is full or the max wait is over
+        :param first: first item of the batch
+        :return: the items, and the envelope each of them came in
+        """
+        batch = [first]
+        envelopes = [self._input_envelope]
+        size = int(getattr(self.cfg, self._batch_size_key, 1))
+        deadline = time.time() + float(getattr(self.cfg, self._batch_wait_key, 0.0)) / 1000.0
+
+        # Items in shared memory are views on their slot, the producer must not reuse the slots of the batch
+        # before it is processed : they are released by the get after the batch
+        hold = getattr(self._data_in, "hold", None)
+        if hold is not None:
+            hold(True)
         try:
-            self.debug(f"Posting output to {len(self._data_out_list)} queue{'s' if len(self._data_out_list) > 1 else ''}")
-            posted = False
-            for q in self._data_out_list:
-                if not q.full():
-                    q.put_nowait(data)
-                    posted = True
-
-            # if not posted:
-            #     self._stop_event.wait(timeout=0.01)
-        except Exception as e:
-            self.error(f"Unknown exception in post_to_qs : {e}")
-            return False
+            while len(batch) < size and not self._stop_event.is_set():
+                data = self.get_from_q(timeout=max(0.0, deadline - time.time()))
+                if data is None:
+                    if time.time() >= deadline:
+                        break
+                    continue
+                batch.append(data)
+                envelopes.append(self._input_envelope)
         finally:
-            return True
+            if hold is not None:
+                hold(False)
+
+        return batch, envelopes
+
+    def new_trace(self) -> Optional[int]:
+        """
+        Sample a new trace, only a source starts traces
+        :return: a new trace ID for a trace_sample_rate fraction of the items, None for the others
+        """
+        if self._data_in is not None:
+            return None
+
+        rate = getattr(self.cfg, "trace_sample_rate", 0.0)
+        return random.getrandbits(48) if rate > 0 and random.random() < rate else None
+
+    def trace_input(self, env: Envelope) -> None:
+        """Record how long a traced item waited in the input connection"""
+        if env is not None and env.trace is not None and env.sent is not None:
+            now = time.time()
+            self._trace_events.append(complete_event("wait", env.trace, env.sent, now, self.name, os.getpid()))
+            self._trace_events.append(flow_event(env.trace, now, self.name, os.getpid(), start=False))
+
+    def trace_blogic(self, envelopes: List[Envelope], start: float, end: float) -> None:
+        """Record the processing time of the traced items of a run"""
+        for env in envelopes:
+            if env is not None and env.trace is not None:
+                self._trace_events.append(complete_event("blogic", env.trace, start, end, self.name, os.getpid()))
+
+    def flush_traces(self, force: bool = False) -> None:
+        """Send the recorded trace events to the logger, at most once a second unless there are a lot of them"""
+        if len(self._trace_events) > 0 and \
+                (force or len(self._trace_events) >= 256 or time.time() - self._trace_flushed > 1.0):
+            self.print(TRACE, self._trace_events)
+            self._trace_events = []
+            self._trace_flushed = time.time()
+
+    def latency(self, phase: int) -> LatencyHistogram:
+        """
+        :param phase: GET, SECOND_GET, BLOGIC or POST from edgine.src.metrics.cte
+        :return: the latency histogram of that phase of the loop, for the current window
+        """
+        return self._latencies[phase]
+
+    def publish_metrics(self, force: bool = False) -> None:
+        """
+        Write the latencies and counters of this service to its row in the metrics table, once in a while.
+        The latency histograms start over every metrics_window seconds, so the quantiles follow the current load.
+        """
+        now = time.time()
+        last, loops, items_in, items_out = self._published
+        el = now - last
+        if self._metrics is None or (el < PUBLISH_PERIOD and not force) or el <= 0:
+            return
+
+        try:
+            in_qsize = self._data_in.qsize() if self._data_in is not None else 0
+        except NotImplementedError:
+            in_qsize = -1
+
+        latencies = [h.quantile(q) if q is not None else h.max for h in self._latencies for stat, q in STATS]
+        totals = [v for h in self._latencies for v in (h.total, h.total_count)]
+        self._metrics.publish(self._metrics_row, [*latencies,
+                                                  *totals,
+                                                  (self._loops - loops) / el,
+                                                  (self._items_in - items_in) / el,
+                                                  (self._items_out - items_out) / el,
+                                                  self._items_in,
+                                                  self._items_out,
+                                                  sum(getattr(q, "drops", 0) for q in self._data_out_list),
+                                                  self.stale_drops,
+                                                  in_qsize,
+                                                  now])
+        self._published = (now, self._loops, self._items_in, self._items_out)
+
+        if now - self._window_start > getattr(self.cfg, "metrics_window", HISTOGRAM_WINDOW):
+            for h in self._latencies:
+                h.reset()
+            self._window_start = now
+
+    def check_profiling(self) -> None:
+        """
+        Start or stop a profiling session when profile_<name> changed, only called after a config update.
+        Set it to a new number of seconds to start a session, to 0 to stop it early.
+        """
+        value = getattr(self.cfg, self._profile_key, 0)
+        if value == self._profile_seen:
+            return
+
+        self._profile_seen = value
+        if value and value > 0:
+            if self._profiler is None:
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+                self.info(f"Profiling for {value}s")
+            self._profile_until = time.time() + value
+        elif self._profiler is not None:
+            self.stop_profiling()
+
+    def stop_profiling(self) -> None:
+        """Stop the profiling session and write it to <profile_dir>/<name>_<pid>_<time>.prof"""
+        self._profiler.disable()
+        path = os.path.join(getattr(self.cfg, "profile_dir", "."),
+                            f"{self.name}_{os.getpid()}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof")
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._profiler.dump_stats(path)
+            self.info(f"Profile written to {path}")
+        except OSError as e:
+            self.error(f"Could not write profile {path} : {e}")
+        self._profiler = None
+
+    def _input_seq(self) -> int:
+        env = self._input_envelope
+        return env.seq if env is not None else -1
+
+    def post_skip(self) -> None:
+        """Tell downstream that the current input didn't produce any output, so they don't wait for it"""
+        for q in self._data_out_list:
+            try:
+                q.put_nowait(Envelope(self._input_seq(), None))
+            except queue.Full:
+                pass
 
     def run(self) -> None:
         """
@@ -107,57 +423,121 @@ class EdgineBase(Process, ABC):
         This default run function will automatically update the config at start, then run the 'prerun' function,
         then start the main loop consisting of :
         getting the input data (if applicable) -> update secondary data -> execute 'blogic' function -> post data
+
+        In batching mode, the input is collected until there are <name>_batch_size items
+        or <name>_batch_wait_ms have passed since the first one, then 'blogic_batch' gets the whole list.
+
+        In event driven mode, a service with an input blocks until something happens instead of polling,
+        so an idle service doesn't use any CPU.
         """
+        self.cfg.update()
+        self.update_log_level()
+        self._log_buffer = []
         self.info("Hello")
+        # A crash in blogic or postrun must not lose the messages that are still buffered
+        try:
+            self.prerun()
+
+            while not self._stop_event.is_set():
+                if self._event_driven and self._data_in is not None:
+                    has_input = self.wait_for_event()
+                    if self.cfg.update():
+                        self.check_profiling()
+                    s = time.time()
+                    data = self.get_from_q(timeout=0) if has_input else None
+                else:
+                    if self.cfg.update():
+                        self.check_profiling()
+                    s = time.time()
+                    data = self.get_from_q() if self._data_in is not None else None
+
+                batch, envelopes = [data], [self._input_envelope]
+                if self._batching and data is not None:
+                    batch, envelopes = self.get_batch(data)
+                e = time.time()
+                el1 = e-s
+                self._latencies[GET].record(el1)
+
+                s = time.time()
+                self.update_secondary_data()
+                e = time.time()
+                el2 = e-s
+                self._latencies[SECOND_GET].record(el2)
+
+                s = time.time()
+                if self._batching and data is not None:
+                    outs = self.blogic_batch(batch)
+                else:
+                    outs = [self.blogic(data_in=data) if data is not None or self._data_in is None else None]
+                e = time.time()
+                el3 = e-s
+                # Loops without input don't run blogic, they would hide the real latency
+                if data is not None or self._data_in is None:
+                    self._latencies[BLOGIC].record(el3)
+                self.trace_blogic(envelopes, s, e)
+
+                s = time.time()
+                if len(outs) != len(batch):
+                    self.error(f"blogic_batch returned {len(outs)} outputs for {len(batch)} inputs")
+
+                for out, envelope in zip(outs, envelopes):
+                    # Every output goes out tagged like the input it came from
+                    self._input_envelope = envelope
+                    if out is not None:
+                        self.post_to_qs(out)
+                        self._items_out += 1
+                    elif self._ordered_replica and data is not None:
+                        self.post_skip()
+                e = time.time()
+                el4 = e-s
+                if any(out is not None for out in outs):
+                    self._latencies[POST].record(el4)
+                if self._recorder is not None:
+                    self._recorder.record_timing(self._metrics_row, e, [el1, el2, el3, el4])
+                self.flush_traces()
+                self.flush_logs()
+
+                self._loops += 1
+                if data is not None:
+                    self._items_in += len(batch)
+                self.publish_metrics()
+
+                if self._profiler is not None and time.time() > self._profile_until:
+                    self.stop_profiling()
+
+                # Do we need to sleep?
+                sleep_time = self._min_runtime - (el1+el2+el3+el4)
+
+                if sleep_time > 0:
+                    self._stop_event.wait(timeout=sleep_time)
 
-        self.cfg.update()
+            for q in self._data_out_list:
+                q.close()
 
-        self.prerun()
-
-        while not self._stop_event.is_set():
-            self.cfg.update()
-            s = time.time()
-            data = self.get_from_q() if self._data_in is not None else None
-            e = time.time()
-            el1 = e-s
-            self._get_time = 0.8*self._get_time + 0.2*el1
-
-            s = time.time()
-            self.update_secondary_data()
-            e = time.time()
-            el2 = e-s
-            self._second_get_time = 0.8*self._second_get_time + 0.2*el2
-
-            s = time.time()
-            out = self.blogic(data_in=data) if data is not None or self._data_in is None else None
-            e = time.time()
-            el3 = e-s
-            self._blogic_time = 0.8*self._blogic_time + 0.2*el3
-
-            s = time.time()
-            if out is not None:
-                self.post_to_qs(out)
-            e = time.time()
-            el4 = e-s
-            self._post_time = 0.8*self._post_time + 0.2*el4
-
-            # Do we need to sleep?
-            sleep_time = self._min_runtime - (el1+el2+el3+el4)
-
-            if sleep_time > 0:
-                self._stop_event.wait(timeout=sleep_time)
+            if self._data_in is not None:
+                # Replicas drain the same input, another one can take the last item between empty() and get
+                while True:
+                    try:
+                        self._data_in.get_nowait()
+                    except queue.Empty:
+                        break
+                self._data_in.close()
 
-        for q in self._data_out_list:
-            q.close()
+            self.postrun()
 
-        if self._data_in is not None:
-            while not self._data_in.empty():
-                tmp = self._data_in.get_nowait()
-            self._data_in.close()
+            if self._profiler is not None:
+                self.stop_profiling()
 
-        self.postrun()
+            self.flush_traces(force=True)
+            self.publish_metrics(force=True)
+            self.cfg.close()
 
-        self.info(f"Quitting")
+            if self.stale_drops > 0:
+                self.info(f"Dropped {self.stale_drops} items older than {self._max_age}s")
+
+            self.info(f"Quitting")
+        finally:
+            self.flush_logs(force=True)
 
     def prerun(self) -> None:
         """This will be run before the main loop of the process, overwrite it to implement your own."""
@@ -172,22 +552,97 @@ class EdgineBase(Process, ABC):
         """Business logic, overwrite this method to implement your own logic"""
         return data_in+6 if type(data_in) == int else data_in
 
-    def print(self, level: int, msg: str):
+    def blogic_batch(self, batch: List[Any]) -> List[Any]:
+        """
+        Business logic for a batch of input, only used in batching mode.
+        Overwrite this method to process the whole batch at once (e.g. one inference on a stacked tensor),
+        by default it runs blogic on every item.
+        :param batch: list of input items, in the order they arrived
+        :return: list with one output per input item, None for an item without output
+        """
+        return [self.blogic(data_in=d) for d in batch]
+
+    def update_log_level(self, key: str = None, value: Any = None) -> None:
+        """
+        Get the highest level the logger outputs take from this service, from the config.
+        Called on every change of log_logging_lvl or log_rejection_list, the arguments are those of a subscriber.
+        """
+        levels = getattr(self.cfg, "log_logging_lvl", None)
+        if levels is None:
+            # No logger config, send everything
+            self._log_level = DEBUG
+        else:
+            self._log_level = effective_level(levels, getattr(self.cfg, "log_rejection_list", []), self._name)
+        self._recorder_level = getattr(self.cfg, "flight_recorder_level", INFO)
+
+    def print(self, level: int, msg: str, *args: Any):
+        """
+        Send a message to the logger, unless no logger output would print it.
+        With args, the message is formatted like msg % args, only if it is sent :
+
+        self.debug("Got %d items from %s", count, name)
+        """
+        # The flight recorder can keep messages that no logger output wants
+        record = self._recorder is not None and level <= self._recorder_level
+        # Trace events aren't log messages, they always go through
+        send = level <= self._log_level or level == TRACE
+        if not send and not record:
+            return
+
+        if len(args) > 0:
+            try:
+                msg = msg % args
+            except (TypeError, ValueError) as e:
+                msg = f"{msg} {args} (formatting failed : {e})"
+
+        ts = log_time()
+        if record:
+            self._recorder.record_log(self._metrics_row, level, msg, ts)
+        if not send:
+            return
+
+        if self._log_buffer is not None:
+            self._log_buffer.append({level: [self._name, msg, ts]})
+            if len(self._log_buffer) == 1:
+                self._log_buffered = time.time()
+            if level == ERROR or len(self._log_buffer) >= LOG_BATCH_SIZE:
+                self.flush_logs(force=True)
+            return
+
         try:
-            self._logging_q.put_nowait({level: [self._name, msg]})
+            self._logging_q.put_nowait({level: [self._name, msg, ts]})
         except Exception as e:
             timestr: str = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
             print(f"!!!({timestr}) [LOG_QUEUE_ERROR@{self.name}] {e} while "
                   f"sending msg : {msg}")
 
-    def error(self, msg: str):
-        self.print(ERROR, msg)
+    def flush_logs(self, force: bool = False) -> None:
+        """
+        Send the buffered log messages to the logger as one list
+        :param force: send them even if the first one waited less than LOG_FLUSH_PERIOD
+        :return: None
+        """
+        if not self._log_buffer:
+            return
+        if not force and time.time() - self._log_buffered < LOG_FLUSH_PERIOD:
+            return
+
+        batch, self._log_buffer = self._log_buffer, []
+        try:
+            self._logging_q.put_nowait(batch)
+        except Exception as e:
+            timestr: str = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
+            print(f"!!!({timestr}) [LOG_QUEUE_ERROR@{self.name}] {e} while "
+                  f"sending {len(batch)} msgs")
+
+    def error(self, msg: str, *args: Any):
+        self.print(ERROR, msg, *args)
 
-    def info(self, msg: str):
-        self.print(INFO, msg)
+    def info(self, msg: str, *args: Any):
+        self.print(INFO, msg, *args)
 
-    def debug(self, msg: str):
-        self.print(DEBUG, msg)
+    def debug(self, msg: str, *args: Any):
+        self.print(DEBUG, msg, *args)
 
-    def log(self, msg: str):
-        self.print(LOG, msg)
+    def log(self, msg: str, *args: Any):
+        self.print(LOG, msg, *args)
@@ -0,0 +1,17 @@
+# Payload shapes, None is a plain float
+PAYLOADS = {"scalar": None,
+            "small": (120, 160, 3),
+            "vga": (480, 640, 3),
+            "hd": (1080, 1920, 3),
+            "4k": (2160, 3840, 3)}
+
+# chain  : source -> relay -> ... -> relay -> sink
+# fanout : source -> n relays -> n sinks
+# fanin  : source -> merge -> sink, with n relays from the source to the secondary inputs of merge
+TOPOLOGIES = ["chain", "fanout", "fanin"]
+
+# Config key that tells the benchmark source what to send
+PAYLOAD_KEY = "bench_payload"
+
+# Items that arrive in the first WARMUP seconds are not counted
+WARMUP = 1.0
@@ -0,0 +1,256 @@
+from multiprocessing.reduction import ForkingPickler
+from contextlib import redirect_stdout
+from typing import Any, Dict, List, Optional, Tuple
+from edgine.src.starter import EdgineStarter
+from edgine.src.logger.cte import ERROR
+from edgine.src.metrics.histogram import LatencyHistogram
+from edgine.src.transport.envelope import Envelope
+from edgine.src.transport.selectable_event import waitable, wait_any
+from edgine.src.transport.cte import QUEUE, SHM, BLOCK, DROP_OLDEST
+from edgine.src.benchmark.services import BenchSource, BenchRelay, BenchMerge, make_payload
+from edgine.src.benchmark.cte import PAYLOADS, TOPOLOGIES, PAYLOAD_KEY, WARMUP
+import edgine
+import tempfile
+import tracemalloc
+import platform
+import shutil
+import queue
+import time
+import io
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """
+    CPU time (user + system) used by a process so far
+    :param pid: process ID
+    :return: seconds, None where /proc isn't available
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The process name can contain spaces, the fields we need come after the closing parenthesis
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def copy_bytes(data: Any, transport: str) -> int:
+    """
+    Bytes copied in user space to move one item through a connection
+    :param data: the payload
+    :param transport: QUEUE or SHM
+    :return: for SHM, the size of the array that is copied into the ring,
+             for QUEUE (or what doesn't fit in a ring), what is allocated to pickle and unpickle it
+    """
+    if transport == SHM and np is not None and isinstance(data, np.ndarray):
+        return data.nbytes
+
+    tracemalloc.start()
+    raw = ForkingPickler.dumps(Envelope(0, data))
+    dumped = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    ForkingPickler.loads(raw)
+    loaded = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dumped + loaded
+
+
+def _label(service_type: Any, service_id: int) -> str:
+    return f"{service_type.__name__}[{service_id}]"
+
+
+def build_pipeline(starter: EdgineStarter,
+                   topology: str,
+                   transport: str,
+                   stages: int,
+                   data: Any) -> Tuple[List[Any], List[Tuple[str, int]]]:
+    """
+    Register a synthetic pipeline
+    :param starter: the starter to register it in
+    :param topology: chain, fanout or fanin
+    :param transport: QUEUE or SHM, for the primary connections
+    :param stages: number of relays
+    :param data: the payload the source will send
+    :return: the sinks, and (producer, bytes copied per item) for every copy an item goes through
+    """
+    if topology not in TOPOLOGIES:
+        raise ValueError(f"Unknown topology {topology}, use one of {TOPOLOGIES}")
+
+    slot_size = max(getattr(data, "nbytes", 0), 64)
+    item_bytes = copy_bytes(data, transport)
+    queue_bytes = copy_bytes(data, QUEUE)
+    copies = []
+
+    src = starter.reg_service(BenchSource, min_runtime=0)
+    relays = [starter.reg_service(BenchRelay, min_runtime=0) for i in range(stages)]
+
+    if topology == "chain":
+        prev = src
+        for r in relays:
+            starter.reg_connection(prev, r, transport=transport, slot_size=slot_size, policy=BLOCK)
+            copies.append((_label(BenchRelay if prev != src else BenchSource, prev), item_bytes))
+            prev = r
+        sinks = [starter.reg_sink(prev, policy=BLOCK)]
+        copies.append((_label(BenchRelay if prev != src else BenchSource, prev), queue_bytes))
+
+    elif topology == "fanout":
+        if transport == SHM:
+            # One copy into the ring for all relays
+            starter.reg_broadcast(src, slot_size=slot_size, slots=2 * stages + 2)
+            copies.append((_label(BenchSource, src), item_bytes))
+        sinks = []
+        for r in relays:
+            starter.reg_connection(src, r, transport=transport, slot_size=slot_size, policy=BLOCK)
+            if transport != SHM:
+                copies.append((_label(BenchSource, src), item_bytes))
+            sinks.append(starter.reg_sink(r, policy=BLOCK))
+            copies.append((_label(BenchRelay, r), queue_bytes))
+
+    else:
+        merge = starter.reg_service(BenchMerge, min_runtime=0)
+        starter.reg_connection(src, merge, transport=transport, slot_size=slot_size, policy=BLOCK)
+        copies.append((_label(BenchSource, src), item_bytes))
+        for r in relays:
+            starter.reg_connection(src, r, transport=transport, slot_size=slot_size, policy=BLOCK)
+            copies.append((_label(BenchSource, src), item_bytes))
+            starter.reg_secondary_connection(r, merge, policy=DROP_OLDEST)
+            copies.append((_label(BenchRelay, r), queue_bytes))
+        sinks = [starter.reg_sink(merge, policy=BLOCK)]
+        copies.append((_label(BenchMerge, merge), queue_bytes))
+
+    return sinks, copies
+
+
+def run_benchmark(topology: str = "chain",
+                  payload: str = "vga",
+                  transport: str = QUEUE,
+                  stages: int = 3,
+                  duration: float = 5.0,
+                  quiet: bool = True) -> Dict[str, Any]:
+    """
+    Run one synthetic pipeline and measure it
+    :param topology: chain, fanout or fanin
+    :param payload: one of the keys of PAYLOADS
+    :param transport: QUEUE or SHM, for the primary connections
+    :param stages: number of relays
+    :param duration: time to measure, after a warmup of WARMUP seconds
+    :param quiet: hide the output of the starter
+    :return: dict with the results
+    """
+    if payload not in PAYLOADS:
+        raise ValueError(f"Unknown payload {payload}, use one of {list(PAYLOADS.keys())}")
+
+    tmp_dir = tempfile.mkdtemp(prefix="edgine_bench_")
+    out = io.StringIO() if quiet else None
+    latencies = LatencyHistogram()
+    items = 0
+
+    try:
+        with redirect_stdout(out) if quiet else _no_redirect():
+            starter = EdgineStarter(config_file=os.path.join(tmp_dir, "bench_cfg.json"))
+            starter.config_server.config.__setattr__(PAYLOAD_KEY, payload)
+            starter.config_server.config.log_logging_lvl = [ERROR]
+            sinks, copies = build_pipeline(starter, topology, transport, stages, make_payload(payload))
+            starter.init_services()
+            starter.start()
+
+        waitables = [waitable(s) for s in sinks]
+        start = time.time()
+        measure_from = start + WARMUP
+        end = measure_from + duration
+        cpu_from = None
+        while time.time() < end:
+            if cpu_from is None and time.time() >= measure_from:
+                cpu_from = {name: cpu_seconds(pid) for name, pid in starter.service_pids().items()}
+                items_from = {name: m["items_out"] for name, m in starter.metrics().items()}
+
+            wait_any(waitables, timeout=0.1)
+            for sink in sinks:
+                while True:
+                    try:
+                        sink.get_nowait()
+                    except queue.Empty:
+                        break
+                    if time.time() >= measure_from:
+                        items += 1
+                        latencies.record(time.time() - sink.last_envelope.ts)
+
+        cpu = {name: _diff(cpu_seconds(pid), cpu_from.get(name)) for name, pid in starter.service_pids().items()}
+        # Let every service publish its counters once more
+        time.sleep(0.6)
+        metrics = starter.metrics()
+        copied = sum((metrics[name]["items_out"] - items_from.get(name, 0.0)) * item_bytes for name, item_bytes in copies)
+
+        with redirect_stdout(out) if quiet else _no_redirect():
+            starter.stop()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {"topology": topology,
+            "payload": payload,
+            "transport": transport,
+            "stages": stages,
+            "duration": duration,
+            "items": items,
+            "items_per_s": items / duration,
+            "latency_ms": {"p50": latencies.quantile(0.5) * 1000.0,
+                           "p95": latencies.quantile(0.95) * 1000.0,
+                           "p99": latencies.quantile(0.99) * 1000.0,
+                           "max": latencies.max * 1000.0},
+            "cpu_s": cpu,
+            "bytes_copied": copied,
+            "bytes_copied_per_item": copied / items if items > 0 else None,
+            "drops": starter.drop_counts()}
+
+
+def run_suite(topologies: List[str] = None,
+              payloads: List[str] = None,
+              transports: List[str] = None,
+              stages: int = 3,
+              duration: float = 5.0,
+              quiet: bool = True) -> Dict[str, Any]:
+    """
+    Run every combination of topology, payload and transport
+    :return: dict with the environment and a list of results, ready to be dumped to JSON
+    """
+    results = []
+    for topology in topologies or TOPOLOGIES:
+        for payload in payloads or ["scalar", "vga", "hd"]:
+            for transport in transports or [QUEUE, SHM]:
+                if transport == SHM and PAYLOADS[payload] is None:
+                    # Scalars don't go through the ring anyway
+                    continue
+                results.append(run_benchmark(topology=topology,
+                                             payload=payload,
+                                             transport=transport,
+                                             stages=stages,
+                                             duration=duration,
+                                             quiet=quiet))
+
+    return {"edgine_version": edgine.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.time(),
+            "results": results}
+
+
+def _diff(now: Optional[float], before: Optional[float]) -> Optional[float]:
+    return now - before if now is not None and before is not None else None
+
+
+class _no_redirect:
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
@@ -0,0 +1,59 @@
+from typing import Any
+from edgine.src.base import EdgineBase
+from edgine.src.config.config_server import ConfigServer
+from edgine.src.benchmark.cte import PAYLOADS, PAYLOAD_KEY
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def make_payload(name: str) -> Any:
+    """
+    Create a benchmark payload
+    :param name: one of the keys of PAYLOADS
+    :return: a float for scalar, a random uint8 frame for the others
+    """
+    shape = PAYLOADS[name]
+    if shape is None:
+        return 1.0
+
+    if np is None:
+        raise RuntimeError(f"The {name} payload needs numpy")
+
+    return np.random.randint(255, size=shape, dtype=np.uint8)
+
+
+class BenchSource(EdgineBase):
+    """Posts the same payload as fast as it can, the envelope carries the time it was posted"""
+
+    def __init__(self, config_server: ConfigServer, **kwargs):
+        EdgineBase.__init__(self, name="BSRC", config_server=config_server, **kwargs)
+        self._payload = None
+
+    def prerun(self) -> None:
+        self._payload = make_payload(self.cfg.__dict__.get(PAYLOAD_KEY, "scalar"))
+
+    def blogic(self, data_in: Any = None) -> Any:
+        return self._payload
+
+
+class BenchRelay(EdgineBase):
+    """Passes its input on untouched"""
+
+    def __init__(self, **kwargs):
+        EdgineBase.__init__(self, name="BRELAY", **kwargs)
+
+    def blogic(self, data_in: Any = None) -> Any:
+        return data_in
+
+
+class BenchMerge(EdgineBase):
+    """Passes its input on once all secondary inputs have shown up"""
+
+    def __init__(self, **kwargs):
+        EdgineBase.__init__(self, name="BMERGE", **kwargs)
+
+    def blogic(self, data_in: Any = None) -> Any:
+        return data_in if all(d is not None for d in self.secondary_data) else None
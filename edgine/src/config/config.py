@@ -1,12 +1,20 @@
 from multiprocessing import Queue
 import queue
-from typing import List, Any
+from typing import Any, Callable, Dict, List, Tuple
+from contextlib import contextmanager
 import json
 from datetime import datetime
 import time
+import os
 from edgine.src.logger.cte import INFO, LOG, DEBUG, ERROR
+from edgine.src.logger.clock import log_time
+from edgine.src.transport.selectable_event import waitable
+from edgine.src.config.shared_config import SharedConfigLog
+from edgine.src.config.schema import ConfigField
 
-CONFIG_UNIQUE_NAMES = ["_logging_q", "changelist", "_initialized", "_master", "_name", "_in_q", "_version", "_unique_names"]
+CONFIG_UNIQUE_NAMES = ["_logging_q", "changelist", "_initialized", "_master", "_name", "_in_q", "_version",
+                       "_shared", "_shared_version", "_shared_generation", "_shared_offset", "_wakeup", "_hold",
+                       "_schema", "_subscribers", "_unique_names"]
 
 
 class Config:
@@ -15,6 +23,16 @@ class Config:
 
     This is fluid and contains all configurations of the application
 
+    A copy follows the master either through a SharedConfigLog (checking it is one integer comparison),
+    or through a queue of [key, value] updates.
+    A master with a SharedConfigLog publishes every change right away,
+    changes made inside 'with config.batch()' are published together, and copies apply them together.
+
+    Keys are plain instance attributes, reading one is as fast as reading any attribute :
+    __getattr__ only runs for unknown keys.
+    Keys can be declared with a ConfigField, the master then checks every value it gets for them.
+    A copy can subscribe to a key, to get a call when an update changes it.
+
     """
 
     def __init__(self,
@@ -22,7 +40,8 @@ class Config:
                  in_q: Queue = None,
                  start_version: int = 0,
                  name: str = "None",
-                 master: bool = False) -> None:
+                 master: bool = False,
+                 shared: SharedConfigLog = None) -> None:
         self._logging_q: Queue = logging_q
         self.changelist: List = []
         self._initialized: bool = False
@@ -30,8 +49,15 @@ class Config:
         self._name: str = name
         self._in_q: Queue = in_q
         self._version: int = start_version
-        self._unique_names: List[str] = list(self.__dict__.keys())
-        self._unique_names.append("_unique_names")
+        self._shared: SharedConfigLog = shared
+        self._shared_version: int = 0
+        self._shared_generation: int = 0
+        self._shared_offset: int = 0
+        self._wakeup: int = None
+        self._hold: int = 0
+        self._schema: Dict[str, ConfigField] = {}
+        self._subscribers: Dict[str, List[Callable[[str, Any], None]]] = {}
+        self._unique_names: frozenset = frozenset([*self.__dict__.keys(), "_unique_names"])
         self.changelist: List = []
         self._initialized = True
 
@@ -48,55 +74,207 @@ class Config:
         else:
             return False
 
+    def declare(self, key: str, field: ConfigField) -> bool:
+        """
+        Declare the type and allowed values of a key, and create it with its default if unknown.
+        A value that is already there (e.g. from the config file) and doesn't fit is replaced by the default.
+        :param key: key
+        :param field: the declaration
+        :return: True if created
+        """
+        if not self._master:
+            return False
+
+        self._schema[key] = field
+        if not self.has_key(key):
+            self.__setattr__(key, field.default)
+            return True
+
+        try:
+            value = field.validate(key, self.__dict__[key])
+        except (TypeError, ValueError) as e:
+            self.error(f"{e}, using the default {field.default!r}")
+            value = field.default
+
+        if value is not self.__dict__[key]:
+            self.__setattr__(key, value)
+        return False
+
+    def field(self, key: str) -> ConfigField:
+        """
+        :param key: key
+        :return: the declaration of the key, None if it wasn't declared
+        """
+        return self._schema.get(key)
+
+    def subscribe(self, key: str, callback: Callable[[str, Any], None]) -> None:
+        """
+        Get called with (key, new value) when an update changes a key, from 'update', once the whole update is applied
+        :param key: key to follow
+        :param callback: function to call
+        :return: None
+        """
+        self._subscribers.setdefault(key, []).append(callback)
+
     def has_key(self, key: str) -> bool:
         """
         Check if this config has a key
         :param key: Key to check
         :return: True/False
         """
-        if key in self.__dict__.keys():
+        return key in self.__dict__
+
+    def publish_to(self, shared: SharedConfigLog) -> None:
+        """
+        Make this master config publish its changes to a shared config log
+        :param shared: the log the copies follow
+        :return: None
+        """
+        self.__dict__["_shared"] = shared
+
+    def publish(self) -> None:
+        """Publish all pending changes of this master config as one delta"""
+        if self._shared is None or len(self.changelist) == 0:
+            return
+
+        changes = {k: v for k, v in self.changelist if k not in self._unique_names}
+        self.changelist.clear()
+        if len(changes) > 0:
+            self._shared.append(changes)
+
+    @contextmanager
+    def batch(self):
+        """Hold back the changes made in this block, and publish them together at the end"""
+        self.__dict__["_hold"] += 1
+        try:
+            yield self
+        finally:
+            self.__dict__["_hold"] -= 1
+            if self._hold == 0:
+                self.publish()
+
+    def follow(self, shared: SharedConfigLog, cursor: Tuple[int, int, int] = None) -> None:
+        """
+        Follow a shared config log, this config must already hold everything before the point it starts from
+        :param shared: the log of the master config
+        :param cursor: (version, generation, offset) to start from, the current end of the log if None
+        :return: None
+        """
+        self.__dict__["_shared"] = shared
+        self.__dict__["_wakeup"] = shared.subscribe()
+        self.__dict__["_shared_version"], self.__dict__["_shared_generation"], self.__dict__["_shared_offset"] = \
+            cursor if cursor is not None else shared.cursor()
+
+    def _apply(self, key: str, value: Any) -> bool:
+        if key not in self._unique_names:
+            self.__dict__[key] = value
+            self.info(f"updated : {key}: {value}")
             return True
         else:
+            self.debug(f"Trying to update unique value {key}. Skipping.")
             return False
 
+    def _notify(self, keys: List[str]) -> None:
+        for key in keys:
+            for callback in self._subscribers.get(key, ()):
+                try:
+                    callback(key, self.__dict__[key])
+                except Exception as e:
+                    self.error(f"Exception in the subscriber of {key} : {e}")
+
     def update(self) -> bool:
         """
-        This will check if there is an update in the pipe
+        This will check if there is an update in the shared log or the pipe
         :return: bool
         """
         updated = False
 
+        shared = self._shared
+        if shared is not None:
+            # The common case, nothing changed
+            if shared.version == self._shared_version:
+                return False
+
+            # Before reading the changes, see SharedConfigLog
+            self.drain()
+
+            try:
+                changes = shared.read(self._shared_generation, self._shared_offset)
+            except Exception as e:
+                self.error(f"Unknown exception in Config.update : {e}")
+                return False
+
+            # A write is in progress, we'll get it next time
+            if changes is None:
+                return False
+
+            deltas, self.__dict__["_shared_version"], self.__dict__["_shared_generation"], \
+                self.__dict__["_shared_offset"] = changes
+            keys = []
+            for delta in deltas:
+                for key, value in delta.items():
+                    if self._apply(key, value):
+                        keys.append(key)
+
+            if len(self._subscribers) > 0:
+                self._notify(list(dict.fromkeys(keys)))
+            return len(keys) > 0
+
         if self._in_q is not None:
 
+            keys = []
             c = 0
             while c < 1000:
                 try:
                     data: List[str, Any] = self._in_q.get_nowait()
-                    key = data[0]
-                    value = data[1]
-                    if key not in self._unique_names:
-                    # if key not in CONFIG_UNIQUE_NAMES:
-                        self.__dict__[key] = value
-                        self.info(f"updated : {key}: {value}")
-                        updated = True
-                    else:
-                        self.debug(f"Trying to update unique value {key}. Skipping.")
-                        continue
+                    if self._apply(data[0], data[1]):
+                        keys.append(data[0])
                 except queue.Empty:
                     break
                 except Exception as e:
                     self.error(f"Unknown exception in Config.update : {e}")
                     return False
 
+            updated = len(keys) > 0
+            if len(self._subscribers) > 0:
+                self._notify(list(dict.fromkeys(keys)))
+
         return updated
 
+    def drain(self) -> None:
+        """Empty the wakeup pipe, call it when the pipe woke you up, before 'update'"""
+        if self._wakeup is not None:
+            self._shared.drain(self._wakeup)
+
+    def close(self) -> None:
+        """Close the wakeup pipe of a copy that follows a SharedConfigLog"""
+        if self._wakeup is not None:
+            os.close(self._wakeup)
+            self.__dict__["_wakeup"] = None
+
+    def waitable(self) -> Any:
+        """
+        Get something to wait on for updates of this config
+        :return: a file descriptor or Connection that becomes readable when an update is pending,
+                 None for a master config
+        """
+        if self._wakeup is not None:
+            return self._wakeup
+        return waitable(self._in_q)
+
     def __setattr__(self, name: str, value: Any) -> None:
-        if "_master" not in self.__dict__.keys():
+        if "_master" not in self.__dict__:
             self.__dict__[name] = value
             return
         elif self._master:
+            field = self.__dict__.get("_schema", {}).get(name)
+            if field is not None:
+                value = field.validate(name, value)
             self.__dict__[name] = value
             self.changelist.append([name, value])
+            # Attributes set in __init__ come before '_hold' and '_shared' exist
+            if self.__dict__.get("_hold", 0) == 0 and self.__dict__.get("_shared") is not None:
+                self.publish()
             return
 
         if "_initialized" in self.__dict__.keys():
@@ -132,10 +310,10 @@ class Config:
 
     def print(self, level: int, msg: str):
         try:
-            self._logging_q.put_nowait({level: [self._name, msg]})
+            self._logging_q.put_nowait({level: [self._name, msg, log_time()]})
         except Exception as e:
             timestr: str = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
-            print(f"!!!({timestr}) [LOG_QUEUE_ERROR@{self.name}] {e} while "
+            print(f"!!!({timestr}) [LOG_QUEUE_ERROR@{self._name}] {e} while "
                   f"sending msg : {msg}")
 
     def error(self, msg: str):
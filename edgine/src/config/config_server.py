@@ -1,21 +1,38 @@
 from multiprocessing import Queue, Process, Event
 from edgine.src.config.config import Config
+from edgine.src.config.shared_config import SharedConfigLog
+from edgine.src.config.file_watcher import FileWatcher
+from edgine.src.config.schema import ConfigField
 from edgine.src.logger.cte import ERROR, LOG, DEBUG, INFO
+from edgine.src.logger.clock import log_time
 import json
 from datetime import datetime
-from typing import List, Dict
+from typing import Any, List, Dict, Sequence
+import threading
+import tempfile
+import time
+import os
 
 
 class ConfigServer(Process):
     """
     This will hold the ground truth config and
-    send updates to the external copies
+    send updates to the external copies, through a log in shared memory
+
+    While it runs, it watches the config file and pushes the keys that were edited in it to all copies.
+    Only the process that created the server writes the file, it applies what the server process reloaded before.
+
+    Saving is debounced : the requests that come within save_delay of each other make one write,
+    which replaces the file at once, so it is never half written.
     """
     def __init__(self,
                  stop_event: Event = None,
                  config_file: str = None,
                  logging_q: Queue = None,
-                 name: str = "newConfigServer"):
+                 name: str = "newConfigServer",
+                 shared_size: int = 1 << 20,
+                 watch: bool = True,
+                 save_delay: float = 0.5):
         Process.__init__(self, name=name)
         if stop_event is not None:
             self._stop_event = stop_event
@@ -25,9 +42,17 @@ class ConfigServer(Process):
         self._logging_q: Queue = logging_q
         self._filepath: str = config_file
         self._name: str = name
-        self.config: Config = Config(in_q=None, name="master-config", master=True)
+        self.config: Config = Config(in_q=None, name="master-config", master=True, logging_q=logging_q)
         self.config._initialized = False
-        self._child_qs: List[Queue] = []
+        self._shared: SharedConfigLog = SharedConfigLog(size=shared_size)
+        self._copies: int = 0
+        self._watch: bool = watch
+        self._cursor = None
+        self._sync_lock = threading.Lock()
+        self._save_delay: float = save_delay
+        self._save_timer: threading.Timer = None
+        self._save_lock = threading.Lock()
+        self.config.publish_to(self._shared)
         self.load_config()
         self.save_config()
 
@@ -40,44 +65,213 @@ class ConfigServer(Process):
         """
         return self.config.create_if_unknown(key, value)
 
+    def declare(self,
+                key: str,
+                type: type,
+                default: Any,
+                min: Any = None,
+                max: Any = None,
+                choices: Sequence[Any] = None,
+                doc: str = "") -> bool:
+        """
+        Declare the type and allowed values of a key, values set in the master or read from the file are checked :
+
+        config_server.declare("min_score", float, 0.8, min=0.0, max=1.0)
+
+        :param key: key
+        :param type: type of the values
+        :param default: value the key gets if unknown, or if the value in the config file doesn't fit
+        :param min: smallest allowed value
+        :param max: largest allowed value
+        :param choices: allowed values
+        :param doc: what the key is for
+        :return: True if created
+        """
+        return self.config.declare(key, ConfigField(type, default, min=min, max=max, choices=choices, doc=doc))
+
+    def batch(self):
+        """
+        Publish all changes made in this block as one delta, copies apply them all at once :
+
+        with config_server.batch():
+            config_server.config.min_score = 0.6
+            config_server.config.top_k = 5
+        """
+        return self.config.batch()
+
     def get_clean_config_dict(self):
         config_dict = self.config.__dict__
         unique_names = config_dict['_unique_names']
         out_dict = {}
-        for k, v in config_dict.items():
+        # A copy of the items, services may add keys while a save is in progress
+        for k, v in list(config_dict.items()):
             if k not in unique_names:
                 out_dict[k] = v
 
         return out_dict
 
+    def start(self) -> None:
+        # The file must be up to date before we start watching it
+        self.flush_config()
+        # Our copy of the master catches up on later changes from this point of the log
+        self._cursor = self._shared.cursor()
+        Process.start(self)
+
     def run(self) -> None:
         self.info("starting ConfigServer")
+        watcher = None
+        if self._watch and self._filepath is not None:
+            watcher = FileWatcher(self._filepath)
+            self.info(f"Watching {self._filepath} ({'inotify' if watcher.inotify else 'polling'})")
+
         while not self._stop_event.is_set():
-            while len(self.config.changelist) > 0:
-                # print(f"Changelist found with len {len(self.config.changelist)}")
-                self.update_children(self.config.changelist.pop(0))
+            # Changes are published as soon as they are made, this only picks up what was left pending
+            self.config.publish()
 
-            self._stop_event.wait(timeout=1)
+            if watcher is None:
+                self._stop_event.wait(timeout=1)
+            elif watcher.changed(timeout=1):
+                self.reload_config()
 
+        if watcher is not None:
+            watcher.close()
+        self.close()
         self.info("Quitting")
 
+    def sync(self) -> None:
+        """
+        Apply the changes made to the master config in other processes since the server started :
+        the server process gets the ones made here, this process gets the ones the server reloaded from the file
+        """
+        with self._sync_lock:
+            if self._cursor is None:
+                return
+
+            _, generation, offset = self._cursor
+            changes = self._shared.read(generation, offset)
+            while changes is None:
+                time.sleep(0.001)
+                changes = self._shared.read(generation, offset)
+
+            deltas, version, generation, offset = changes
+            self._cursor = version, generation, offset
+            unique_names = self.config.__dict__["_unique_names"]
+            # A change held back by a batch is newer than anything in the log
+            pending = {k for k, _ in self.config.changelist}
+            for delta in deltas:
+                for k, v in delta.items():
+                    if k not in unique_names and k not in pending:
+                        self.config.__dict__[k] = v
+
+    @staticmethod
+    def _as_saved(value: Any) -> Any:
+        """How a value looks once it went through the config file, tuples become lists"""
+        try:
+            return json.loads(json.dumps(value))
+        except (TypeError, ValueError):
+            return value
+
+    def reload_config(self) -> List[str]:
+        """
+        Read the config file again and push the keys that differ from the master config, all at once
+        :return: the changed keys
+        """
+        self.sync()
+        try:
+            with open(self._filepath, 'r') as f:
+                config_dict: Dict = json.load(f)
+        except IOError as e:
+            self.error(f"File not accessible : {e}")
+            return []
+        except ValueError as e:
+            # Probably still being written, it'll change again
+            self.error(f"Invalid config file, keeping the current config : {e}")
+            return []
+
+        if not isinstance(config_dict, dict):
+            self.error("Invalid config file, keeping the current config : not a JSON object")
+            return []
+
+        unique_names = self.config.__dict__["_unique_names"]
+        changed = []
+        for k, v in config_dict.items():
+            if k in unique_names or (self.config.has_key(k) and self._as_saved(self.config.__dict__[k]) == v):
+                continue
+
+            field = self.config.field(k)
+            if field is not None:
+                try:
+                    config_dict[k] = field.validate(k, v)
+                except (TypeError, ValueError) as e:
+                    self.error(f"Invalid value in {self._filepath}, keeping the current one : {e}")
+                    continue
+
+                # Only a change of representation, like a list for a tuple
+                if config_dict[k] == self.config.__dict__.get(k):
+                    continue
+
+            changed.append(k)
+
+        with self.config.batch():
+            for k in changed:
+                self.config.__setattr__(k, config_dict[k])
+
+        if len(changed) > 0:
+            self.info(f"Reloaded {self._filepath}, changed : {changed}")
+        return changed
+
     def save_config(self) -> bool:
         """
-        Save current config to file
-        :return: False if no file or exception, True else
+        Ask for the current config to be saved to file, the write happens save_delay after the last request
+        :return: False if no file, True else
         """
-        self.info("Saving config")
-        if self._filepath is not None:
-            try:
-                config = self.get_clean_config_dict()
-                with open(self._filepath, 'w+') as f:
-                    json.dump(config, f, sort_keys=True, indent=4)
-            except Exception as e:
-                self.error(f"Exception during save_config method : {e}")
+        if self._filepath is None:
+            return False
+
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+            # Not a daemon, a pending save still happens when the program ends
+            self._save_timer = threading.Timer(self._save_delay, self.flush_config)
+            self._save_timer.start()
+
+        return True
+
+    def flush_config(self) -> bool:
+        """
+        Do the pending save now
+        :return: False if nothing was pending or the write failed, True else
+        """
+        with self._save_lock:
+            if self._save_timer is None:
                 return False
-            finally:
-                return True
-        else:
+            self._save_timer.cancel()
+            self._save_timer = None
+
+            return self._write_config()
+
+    def _write_config(self) -> bool:
+        self.info("Saving config")
+        tmp_path = None
+        try:
+            # Or we would write back the values the server process reloaded from the file
+            self.sync()
+            config = self.get_clean_config_dict()
+            directory = os.path.dirname(os.path.abspath(self._filepath))
+            mode = os.stat(self._filepath).st_mode & 0o777 if os.path.exists(self._filepath) else 0o644
+            # In the same directory, so the rename can't cross file systems
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(self._filepath)}.", dir=directory)
+            os.fchmod(fd, mode)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(config, f, sort_keys=True, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._filepath)
+            return True
+        except Exception as e:
+            self.error(f"Exception during save_config method : {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
             return False
 
     def load_config(self) -> bool:
@@ -102,8 +296,8 @@ class ConfigServer(Process):
 
     def get_config_copy(self) -> Config:
 
-        # Create a new queue
-        new_q = Queue()
+        # Start from everything the server process reloaded so far
+        self.sync()
 
         # Create a new config
         new_config = Config(master=True, logging_q=self._logging_q)
@@ -115,27 +309,34 @@ class ConfigServer(Process):
             new_config.__dict__[k] = v
 
         # Change the new config's unique's
-        new_config._in_q = new_q
-        new_config._name = f"C-{len(self._child_qs)+1}"
+        self._copies += 1
+        new_config._name = f"C-{self._copies}"
 
         new_config._initialized = True
         new_config._master = False
 
-        # Add Q to the list
-        self._child_qs.append(new_q)
+        # It only needs the changes that come after this
+        new_config.follow(self._shared, self._cursor)
 
         return new_config
 
     def update_children(self, kv: List):
-        for q in self._child_qs:
-            q.put_nowait(kv)
+        """
+        Publish changes to all copies
+        :param kv: [key, value], or a dict with key -> value to publish several changes at once
+        """
+        self._shared.append(kv if isinstance(kv, dict) else {kv[0]: kv[1]})
+
+    def close(self) -> None:
+        """Close the wakeup pipes of the copies, on our side"""
+        self._shared.close()
 
     def __str__(self):
         return f"- {self._name} - "
 
     def print(self, level: int, msg: str):
         try:
-            self._logging_q.put_nowait({level: [self._name, msg]})
+            self._logging_q.put_nowait({level: [self._name, msg, log_time()]})
         except Exception as e:
             timestr: str = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
             print(f"!!!({timestr}) [LOG_QUEUE_ERROR@{self.name}] {e} while "
@@ -0,0 +1,106 @@
+from typing import Optional, Tuple
+import ctypes
+import ctypes.util
+import select
+import struct
+import time
+import os
+
+# From <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+_EVENT = struct.Struct("iIII")
+
+
+def _load_inotify() -> Optional[ctypes.CDLL]:
+    """
+    :return: the C library if it has inotify, None else
+    """
+    name = ctypes.util.find_library("c")
+    if name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FileWatcher:
+    """
+    Tells when a file changed on disk
+
+    With inotify (Linux) the directory of the file is watched, so editors that save by replacing the file are seen too.
+    Anywhere else the modification time and size of the file are polled.
+    """
+
+    def __init__(self, path: str, poll_period: float = 1.0):
+        self._path: str = os.path.abspath(path)
+        self._name: bytes = os.fsencode(os.path.basename(self._path))
+        self._poll_period: float = poll_period
+        self._fd: int = -1
+        self._stat: Tuple = self._file_stat()
+
+        libc = _load_inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd >= 0:
+                directory = os.fsencode(os.path.dirname(self._path))
+                if libc.inotify_add_watch(fd, directory, _IN_CLOSE_WRITE | _IN_MOVED_TO) >= 0:
+                    self._fd = fd
+                else:
+                    os.close(fd)
+
+    @property
+    def inotify(self) -> bool:
+        return self._fd >= 0
+
+    def _file_stat(self) -> Tuple:
+        try:
+            st = os.stat(self._path)
+            return st.st_mtime_ns, st.st_size, st.st_ino
+        except OSError:
+            return ()
+
+    def _read_events(self) -> bool:
+        changed = False
+        while True:
+            try:
+                buf = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return changed
+            if len(buf) == 0:
+                return changed
+
+            offset = 0
+            while offset + _EVENT.size <= len(buf):
+                _, _, _, length = _EVENT.unpack_from(buf, offset)
+                name = buf[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+                changed = changed or name == self._name
+                offset += _EVENT.size + length
+
+    def changed(self, timeout: float) -> bool:
+        """
+        Wait for the file to change
+        :param timeout: max time to wait, in seconds
+        :return: True if the file changed since the last call
+        """
+        if self._fd >= 0:
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+            return len(ready) > 0 and self._read_events()
+
+        time.sleep(min(timeout, self._poll_period))
+        stat = self._file_stat()
+        if stat != self._stat:
+            self._stat = stat
+            return True
+        return False
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
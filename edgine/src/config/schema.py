@@ -0,0 +1,55 @@
+from typing import Any, Sequence
+
+
+class ConfigField:
+    """
+    Declaration of a config key : its type, default value and allowed values
+
+    A value that went through the JSON config file comes back as a list where a tuple is declared,
+    and as an int where a float is declared, both are converted back.
+    """
+    __slots__ = ["type", "default", "min", "max", "choices", "doc"]
+
+    def __init__(self,
+                 type: type,
+                 default: Any,
+                 min: Any = None,
+                 max: Any = None,
+                 choices: Sequence[Any] = None,
+                 doc: str = ""):
+        self.type: type = type
+        self.min: Any = min
+        self.max: Any = max
+        self.choices: Sequence[Any] = choices
+        self.doc: str = doc
+        self.default: Any = self.validate("default", default)
+
+    def validate(self, key: str, value: Any) -> Any:
+        """
+        Check a value against this declaration
+        :param key: name of the key, for the error message
+        :param value: value to check
+        :return: the value, converted to the declared type if needed
+        :raise TypeError: if the value doesn't have the declared type
+        :raise ValueError: if the value is out of range, or not one of the choices
+        """
+        if self.type is tuple and isinstance(value, list):
+            value = tuple(value)
+        elif self.type is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+
+        # bool is an int, but an int key set to True is most likely a mistake
+        if not isinstance(value, self.type) or (isinstance(value, bool) and self.type is not bool):
+            raise TypeError(f"Config key {key} must be a {self.type.__name__}, got {type(value).__name__} {value!r}")
+
+        if self.min is not None and value < self.min:
+            raise ValueError(f"Config key {key} must be >= {self.min}, got {value!r}")
+        if self.max is not None and value > self.max:
+            raise ValueError(f"Config key {key} must be <= {self.max}, got {value!r}")
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(f"Config key {key} must be one of {list(self.choices)}, got {value!r}")
+
+        return value
+
+    def __repr__(self):
+        return f"ConfigField({self.type.__name__}, default={self.default!r})"
@@ -0,0 +1,149 @@
+from multiprocessing import RawArray, Lock
+from ctypes import c_uint64, c_char
+from typing import Any, Dict, List, Optional, Tuple
+import struct
+import pickle
+import os
+
+_VERSION = 0
+_GENERATION = 1
+_USED = 2
+
+_LENGTH = struct.Struct("Q")
+
+
+class SharedConfigLog:
+    """
+    Config changes in shared memory, as an append-only log of pickled deltas with a global version counter
+
+    Readers keep the version they have seen and their offset in the log,
+    as long as the version doesn't move there is nothing to read.
+    Writes are guarded by a seqlock : the version is odd while a write is in progress.
+    When the log is full it is compacted into one snapshot of all keys, and the generation goes up,
+    a reader of an older generation reads that snapshot from the start.
+    The memory is anonymous and shared with the processes that are forked after it was created.
+
+    Readers that want to block until something changes subscribe to get their own wakeup pipe,
+    every append writes a byte to each of them once it is complete.
+    A reader drains its pipe when it wakes up, and before it reads the changes, so a wakeup is never lost.
+    At worst a byte for a change it already read wakes it up once more.
+    """
+
+    def __init__(self, size: int = 1 << 20):
+        self._size: int = size
+        self._header = RawArray(c_uint64, 3)
+        self._body = RawArray(c_char, size)
+        self._lock = Lock()
+        self._wakeups: List[int] = []
+
+    @property
+    def version(self) -> int:
+        return self._header[_VERSION]
+
+    def cursor(self) -> Tuple[int, int, int]:
+        """
+        :return: (version, generation, offset) of the end of the log, for a reader that already has everything
+        """
+        with self._lock:
+            return self._header[_VERSION], self._header[_GENERATION], self._header[_USED]
+
+    @staticmethod
+    def _parse(raw: bytes) -> List[Dict[str, Any]]:
+        out = []
+        pos = 0
+        while pos < len(raw):
+            length = _LENGTH.unpack_from(raw, pos)[0]
+            out.append(pickle.loads(raw[pos + _LENGTH.size:pos + _LENGTH.size + length]))
+            pos += _LENGTH.size + length
+        return out
+
+    def subscribe(self) -> int:
+        """
+        Get a wakeup pipe, it becomes readable after every append, until it is drained.
+        Subscribe before forking the processes that write to the log, they only notify what they know of.
+        :return: file descriptor of the read end, to wait on and to pass to 'drain'
+        """
+        reader, writer = os.pipe()
+        os.set_blocking(reader, False)
+        os.set_blocking(writer, False)
+        self._wakeups.append(writer)
+        return reader
+
+    @staticmethod
+    def drain(reader: int) -> None:
+        """Empty a wakeup pipe"""
+        try:
+            while os.read(reader, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self) -> None:
+        """Close the write ends of the wakeup pipes"""
+        for writer in self._wakeups:
+            os.close(writer)
+        self._wakeups = []
+
+    def _notify(self) -> None:
+        for writer in self._wakeups:
+            try:
+                os.write(writer, b"\0")
+            except (BlockingIOError, OSError):
+                # Full : that reader has a wakeup pending anyway
+                pass
+
+    def append(self, changes: Dict[str, Any]) -> int:
+        """
+        Publish a set of changes, readers see them all at once
+        :param changes: dict with key -> new value
+        :return: the new version, raises ValueError if the whole config doesn't fit in the log
+        """
+        raw = pickle.dumps(changes, protocol=pickle.HIGHEST_PROTOCOL)
+        record = _LENGTH.pack(len(raw)) + raw
+        with self._lock:
+            version = self._header[_VERSION]
+            used = self._header[_USED]
+            generation = self._header[_GENERATION]
+
+            if used + len(record) > self._size:
+                # Compact everything into one snapshot
+                snapshot = {}
+                for delta in self._parse(self._body[0:used]):
+                    snapshot.update(delta)
+                snapshot.update(changes)
+                raw = pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+                record = _LENGTH.pack(len(raw)) + raw
+                if len(record) > self._size:
+                    raise ValueError(f"The config needs {len(record)} bytes, the shared log only has {self._size}")
+                used = 0
+                generation += 1
+
+            self._header[_VERSION] = version + 1
+            self._body[used:used + len(record)] = record
+            self._header[_USED] = used + len(record)
+            self._header[_GENERATION] = generation
+            self._header[_VERSION] = version + 2
+            # Only once the write is complete, a reader woken up now always finds it
+            self._notify()
+
+        return version + 2
+
+    def read(self, generation: int, offset: int) -> Optional[Tuple[List[Dict[str, Any]], int, int, int]]:
+        """
+        Read the changes after a position in the log
+        :param generation: generation of the log the reader is in
+        :param offset: offset in the log the reader got to
+        :return: (list of deltas, version, generation, offset) to continue from, None if a write was in progress
+        """
+        version = self._header[_VERSION]
+        if version % 2:
+            return None
+
+        new_generation = self._header[_GENERATION]
+        used = self._header[_USED]
+        start = offset if new_generation == generation else 0
+        raw = self._body[start:used]
+        if self._header[_VERSION] != version:
+            return None
+
+        return self._parse(raw), version, new_generation, used
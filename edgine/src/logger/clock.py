@@ -0,0 +1,12 @@
+import time
+
+# Offset between the monotonic clock and the wall clock, taken once when the process imports this.
+# Timestamps stay in order even if the wall clock is adjusted while running.
+_WALL_OFFSET: float = time.time() - time.monotonic()
+
+
+def log_time() -> float:
+    """
+    :return: timestamp of a log message, in seconds since the epoch, with the resolution of the monotonic clock
+    """
+    return time.monotonic() + _WALL_OFFSET
@@ -3,3 +3,17 @@ ERROR = 0
 LOG = 1
 INFO = 2
 DEBUG = 3
+
+# Not a logging level, messages of this type carry a list of trace events for the trace buffer
+TRACE = 100
+
+# Services send their log messages in batches : when this many are waiting, after this many seconds,
+# and right away for an error
+LOG_BATCH_SIZE = 64
+LOG_FLUSH_PERIOD = 0.005
+
+# Log sinks : what binary log files start with, the most records a sink writes at once,
+# and the most records waiting for a sink before it drops the new ones
+BINARY_LOG_MAGIC = b"EDGLOG1\n"
+SINK_BATCH = 256
+SINK_QUEUE_SIZE = 10000
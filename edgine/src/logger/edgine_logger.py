@@ -1,29 +1,57 @@
-from multiprocessing import Process, Queue, Event
-from typing import Dict, List
+from multiprocessing import Process, Queue, Event, Array
+from ctypes import c_uint64
+from typing import Any, List
 from datetime import datetime
 import queue
 import time
-from edgine.src.logger.cte import ERROR, INFO, DEBUG, LOG, LOGGING_LEVELS
+from edgine.src.logger.cte import ERROR, INFO, DEBUG, LOG, TRACE, LOGGING_LEVELS
+from edgine.src.logger.clock import log_time
+from edgine.src.logger.sinks import LogSink
+from edgine.src.tracing.trace_buffer import TraceBuffer
 from edgine.src.config.config_server import ConfigServer
 
 
+def effective_level(levels: List[int], rejections: List[List[str]], sender: str) -> int:
+    """
+    Highest level any output prints for a sender, the sender can drop its messages above it without sending them
+    :param levels: logging level of each output (log_logging_lvl)
+    :param rejections: senders rejected by each output (log_rejection_list)
+    :param sender: name of the sender
+    :return: the level, -1 if no output takes messages from this sender
+    """
+    level = -1
+    for i in range(len(levels)):
+        if i >= len(rejections) or sender not in rejections[i]:
+            level = max(level, levels[i])
+    return level
+
+
 class EdgineLogger(Process):
     """
     A asynchroneous logger with rate limiting
+
+    Messages come in as {level: [sender, msg, time logged]}, or as a list of those from the services
+    that send them in batches.
+
+    The outputs are the screen (index 0), then out_qs, then the log sinks (files, see edgine.src.logger.sinks),
+    every one with its own level, rejection list and rate limit in the config.
+    Sinks write from their own thread, so a slow disk doesn't hold back the logger.
     """
 
     def __init__(self,
                  stop_event: Event,
                  config_server: ConfigServer,
                  in_q: Queue,
-                 out_qs: List[Queue] = None):
+                 out_qs: List[Queue] = None,
+                 sinks: List[LogSink] = None):
 
         Process.__init__(self, name="LOG")
 
         if out_qs is None:
-            self._out_qs: List = [None]
-        else:
-            self._out_qs: List[Queue] = [None, *out_qs]
+            out_qs = []
+        if sinks is None:
+            sinks = []
+        self._out_qs: List = [None, *out_qs, *sinks]
 
         # Check if the right config fields already exist, if not, create them
         if not config_server.config.has_key("log_rate_limiting_list"):
@@ -53,10 +81,21 @@ class EdgineLogger(Process):
         if not config_server.config.has_key("log_print_to_screen"):
             config_server.config.log_print_to_screen = True
 
+        # Tracing : fraction of the source items that get traced, and where the traces are dumped
+        if not config_server.config.has_key("trace_sample_rate"):
+            config_server.config.trace_sample_rate = 0.0
+
+        if not config_server.config.has_key("trace_file"):
+            config_server.config.trace_file = "trace.json"
+
+        if not config_server.config.has_key("trace_buffer_size"):
+            config_server.config.trace_buffer_size = 100000
+
         config_server.save_config()
 
         self._cfg = config_server.get_config_copy()
         self._in_q: Queue = in_q
+        self._traces: TraceBuffer = TraceBuffer(size=self._cfg.trace_buffer_size)
 
         self._stop_event: Event = stop_event
 
@@ -66,9 +105,21 @@ class EdgineLogger(Process):
         self._log_dropped_msg_count: List[int] = []
         self._log_last_limit_print: List[float] = []
 
+        # Total of the messages dropped by each rate limiter, readable from any process
+        self._log_dropped_total = Array(c_uint64, len(self._out_qs))
+
+        # The date and time part of the lines only changes once per second
+        self._prefix_second: int = -1
+        self._prefix: str = ""
+
         for i in range(len(self._out_qs)):
             self.init_rate_limiter(i)
 
+    @property
+    def dropped_counts(self) -> List[int]:
+        """Number of messages each output dropped because of rate limiting, since the start"""
+        return list(self._log_dropped_total)
+
     def init_rate_limiter(self, index: int):
         """
         Initialises the rate limiter for output at index
@@ -95,17 +146,28 @@ class EdgineLogger(Process):
 
                 raise IndexError(e)
 
-    def create_output_line(self, level: int, sender: str, msg: str) -> str:
+    def time_prefix(self, ts: float) -> str:
+        """
+        :param ts: timestamp, in seconds since the epoch
+        :return: date and time of the timestamp, as it goes in an output line
+        """
+        second = int(ts)
+        if second != self._prefix_second:
+            self._prefix = datetime.fromtimestamp(second).strftime("%m/%d/%Y %H:%M:%S")
+            self._prefix_second = second
+        return self._prefix
+
+    def create_output_line(self, level: int, sender: str, msg: str, ts: float = None) -> str:
         """
         Create an output line
-        TODO: Change to static function
         :param level: Logging level of msg
         :param sender: Sender of msg
         :param msg: Message
+        :param ts: time the sender logged the message, now if None
         :return: Output line as str
         """
         try:
-            timestr: str = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
+            timestr: str = self.time_prefix(log_time() if ts is None else ts)
             out = f"{LOGGING_LEVELS[level]}:({timestr}) [{sender}] {msg}"
         except Exception as e:
             print(f"[ERR] %m/%d/%Y %H:%M:%S : "
@@ -138,6 +200,15 @@ class EdgineLogger(Process):
         :param msg: Message to send
         :return: Nothing
         """
+        if self.allow(index):
+            self.emit(index, msg)
+
+    def allow(self, index: int) -> bool:
+        """
+        Ask the rate limiter of an output for room for one more message, a refused message counts as dropped
+        :param index: index of the output
+        :return: True if the message can go out
+        """
 
         now = time.time()
         time_passed = now - self._log_last_msg[index]
@@ -154,20 +225,38 @@ class EdgineLogger(Process):
             self._log_allowance[index] = self._cfg.log_rate_limiting_list[index]
 
         if self._log_allowance[index] >= 1.0:
-            if index == 0:
-                print(msg)
-            else:
-                self._out_qs[index].put_nowait(msg)
             self._log_allowance[index] -= 1.0
+            return True
         else:
             self._log_dropped_msg_count[index] += 1
+            self._log_dropped_total[index] += 1
+            return False
 
-    def output(self, lvl: int, sender: str, msg: str):
-        out_str = self.create_output_line(lvl, sender, msg)
+    def emit(self, index: int, line: str) -> None:
+        if index == 0:
+            print(line)
+        else:
+            self._out_qs[index].put_nowait(line)
 
+    def output(self, lvl: int, sender: str, msg: str, ts: float = None):
+        # The line is only made if an output takes it, and only once for all of them
+        out_str = None
         for i in range(len(self._out_qs)):
-            if sender not in self._cfg.log_rejection_list[i] and self._cfg.log_logging_lvl[i] >= lvl:
-                self.sent_out(i, out_str)
+            if sender not in self._cfg.log_rejection_list[i] and self._cfg.log_logging_lvl[i] >= lvl \
+                    and self.allow(i):
+                out = self._out_qs[i]
+                if isinstance(out, LogSink):
+                    # Sinks format in their own thread
+                    out.write(lvl, sender, msg, log_time() if ts is None else ts)
+                    continue
+                if out_str is None:
+                    out_str = self.create_output_line(lvl, sender, msg, ts)
+                self.emit(i, out_str)
+
+    def close_sinks(self) -> None:
+        for out in self._out_qs:
+            if isinstance(out, LogSink):
+                out.close()
 
     def run(self) -> None:
         self.output(INFO, self.name, f"Hello")
@@ -179,17 +268,35 @@ class EdgineLogger(Process):
             self._cfg.update()
 
             try:
-                incoming_data: Dict = self._in_q.get(timeout=0.005)
-
-                for level, [sender, msg] in incoming_data.items():
-                    self.output(level, sender, msg)
+                incoming_data: Any = self._in_q.get(timeout=0.005)
             except queue.Empty:
                 self._stop_event.wait(timeout=0.01)
                 if self._stop_event.is_set():
                     stop_loop = True
+                continue
             except Exception as e:
                 self.output(ERROR, self.name, f"Error in run : {str(e)}")
+                continue
+
+            if not isinstance(incoming_data, list):
+                incoming_data = [incoming_data]
+
+            for record in incoming_data:
+                # One bad record doesn't cost the rest of its batch
+                try:
+                    # [sender, msg, time logged], the time is missing in messages of older senders
+                    for level, [sender, msg, *ts] in record.items():
+                        if level == TRACE:
+                            self._traces.add(sender, msg)
+                        else:
+                            self.output(level, sender, msg, ts[0] if ts else None)
+                except Exception as e:
+                    self.output(ERROR, self.name, f"Error in run : {str(e)}")
+
+        if self._traces.dump(self._cfg.trace_file):
+            self.output(INFO, self.name, f"Dumped {len(self._traces)} trace events to {self._cfg.trace_file}")
 
         self.output(INFO,
                     self.name,
                     "Quitting")
+        self.close_sinks()
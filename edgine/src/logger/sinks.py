@@ -0,0 +1,283 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, Tuple
+from datetime import datetime
+import threading
+import queue
+import struct
+import gzip
+import shutil
+import time
+import os
+from edgine.src.logger.cte import LOGGING_LEVELS, BINARY_LOG_MAGIC, SINK_BATCH, SINK_QUEUE_SIZE
+
+# level, sender id, timestamp, length of the message
+_RECORD = struct.Struct("<BHdI")
+# sender id, length of the name
+_SENDER = struct.Struct("<HH")
+# Level of the records that give the name of a sender ID
+_SENDER_RECORD = 255
+
+
+class LogSink(ABC):
+    """
+    Writes log records to a file from its own thread, the logger only hands them over
+
+    The file is rotated once it is max_bytes long, or max_age seconds old :
+    path becomes path.1 (path.1.gz with compress), path.1 becomes path.2 and so on, only 'backups' of them are kept.
+    The thread starts with the first record, so a sink made in one process can write from another.
+
+    When max_queued records are waiting, because the disk is slow or stalled, new records are dropped and counted.
+    A sink that fails to write (disk full, file removed with its directory...) reports it once,
+    then drops everything it gets.
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_bytes: int = 10 * 1024 * 1024,
+                 max_age: float = None,
+                 backups: int = 5,
+                 compress: bool = False,
+                 max_queued: int = SINK_QUEUE_SIZE):
+        self._path: str = path
+        self._max_bytes: int = max_bytes
+        self._max_age: float = max_age
+        self._backups: int = backups
+        self._compress: bool = compress
+        self._max_queued: int = max_queued
+        self._q: queue.SimpleQueue = None
+        self._thread: threading.Thread = None
+        self._file = None
+        self._size: int = 0
+        self._opened: float = 0.0
+        self._failed: bool = False
+        self._drops: int = 0
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def failed(self) -> bool:
+        return self._failed
+
+    @property
+    def drops(self) -> int:
+        """Number of records that were dropped, because too many were waiting or the sink failed"""
+        return self._drops
+
+    def write(self, level: int, sender: str, msg: str, ts: float) -> None:
+        """
+        Hand a record over to the writer thread, this never blocks, the record is dropped if the sink can't keep up
+        :param level: logging level
+        :param sender: name of the sender
+        :param msg: message
+        :param ts: time the sender logged it
+        :return: None
+        """
+        if self._failed:
+            self._drops += 1
+            return
+        if self._thread is None:
+            self._q = queue.SimpleQueue()
+            self._thread = threading.Thread(target=self._run, name=f"sink-{os.path.basename(self._path)}", daemon=True)
+            self._thread.start()
+        # Only the logger puts records, so the size can't grow past the check
+        if self._q.qsize() >= self._max_queued:
+            self._drops += 1
+            return
+        self._q.put((level, sender, msg, ts))
+
+    def close(self) -> None:
+        """Write what is left and close the file"""
+        if self._thread is not None:
+            self._q.put(None)
+            self._thread.join()
+            self._thread = None
+            # What a failed sink left waiting is lost too
+            while not self._q.empty():
+                if self._q.get_nowait() is not None:
+                    self._drops += 1
+            if self._drops > 0:
+                self._report(f"dropped {self._drops} records")
+
+    def _report(self, msg: str) -> None:
+        # The sink may be what prints the log, so this goes straight to the screen
+        timestr: str = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
+        print(f"!!!({timestr}) [LOG_SINK_ERROR@{self._path}] {msg}")
+
+    @abstractmethod
+    def _encode(self, level: int, sender: str, msg: str, ts: float) -> bytes:
+        """
+        Turn a record into what is written to the file
+        :param level: logging level
+        :param sender: name of the sender
+        :param msg: message
+        :param ts: time the sender logged it
+        :return: the bytes to write
+        """
+        return b""
+
+    def _start_file(self) -> bytes:
+        """:return: what goes at the start of every file"""
+        return b""
+
+    def _open(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self._path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(self._path, 'ab')
+        self._size = self._file.tell()
+        self._opened = time.time()
+        if self._size == 0:
+            header = self._start_file()
+            self._file.write(header)
+            self._size += len(header)
+
+    def _backup_path(self, index: int) -> str:
+        return f"{self._path}.{index}{'.gz' if self._compress else ''}"
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self._file = None
+
+        if self._backups > 0:
+            for i in range(self._backups - 1, 0, -1):
+                if os.path.exists(self._backup_path(i)):
+                    os.replace(self._backup_path(i), self._backup_path(i + 1))
+
+            if self._compress:
+                with open(self._path, 'rb') as f_in, gzip.open(self._backup_path(1), 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+                os.remove(self._path)
+            else:
+                os.replace(self._path, self._backup_path(1))
+        else:
+            os.remove(self._path)
+
+        self._open()
+
+    def _run(self) -> None:
+        try:
+            self._write_all()
+        except OSError as e:
+            self._failed = True
+            self._report(f"{e}, dropping all records from now on")
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except OSError:
+                    pass
+                self._file = None
+
+    def _write_all(self) -> None:
+        self._open()
+        running = True
+        while running:
+            records = [self._q.get()]
+            # Everything that came in meanwhile goes in one write
+            while len(records) < SINK_BATCH:
+                try:
+                    records.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in records:
+                running = False
+                records = records[:records.index(None)]
+
+            for record in records:
+                data = self._encode(*record)
+                self._file.write(data)
+                self._size += len(data)
+                if self._size >= self._max_bytes or \
+                        (self._max_age is not None and time.time() - self._opened >= self._max_age):
+                    self._rotate()
+            self._file.flush()
+
+        self._file.close()
+        self._file = None
+
+
+class FileSink(LogSink):
+    """Log sink that writes the lines the logger prints"""
+
+    def __init__(self, path: str, **kwargs):
+        LogSink.__init__(self, path, **kwargs)
+        self._prefix_second: int = -1
+        self._prefix: str = ""
+
+    def _encode(self, level: int, sender: str, msg: str, ts: float) -> bytes:
+        second = int(ts)
+        if second != self._prefix_second:
+            self._prefix = datetime.fromtimestamp(second).strftime("%m/%d/%Y %H:%M:%S")
+            self._prefix_second = second
+        return f"{LOGGING_LEVELS[level]}:({self._prefix}) [{sender}] {msg}\n".encode("utf-8", "replace")
+
+
+class BinarySink(LogSink):
+    """
+    Log sink that writes compact binary records, read them back with 'decode'
+
+    A file starts with BINARY_LOG_MAGIC, then every record is (level, sender ID, timestamp, length, message).
+    The first record of a sender in a file is preceded by one that gives its name,
+    so every file can be decoded on its own.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        LogSink.__init__(self, path, **kwargs)
+        self._senders: Dict[str, int] = {}
+
+    def _start_file(self) -> bytes:
+        self._senders = {}
+        return BINARY_LOG_MAGIC
+
+    def _encode(self, level: int, sender: str, msg: str, ts: float) -> bytes:
+        out = b""
+        sender_id = self._senders.get(sender)
+        if sender_id is None:
+            sender_id = len(self._senders)
+            self._senders[sender] = sender_id
+            name = sender.encode("utf-8", "replace")
+            out = _RECORD.pack(_SENDER_RECORD, sender_id, ts, _SENDER.size + len(name)) + \
+                _SENDER.pack(sender_id, len(name)) + name
+
+        raw = msg.encode("utf-8", "replace")
+        return out + _RECORD.pack(level, sender_id, ts, len(raw)) + raw
+
+
+def decode(path: str) -> Iterator[Tuple[int, str, float, str]]:
+    """
+    Read the records of a binary log file, compressed or not
+    :param path: path of the file
+    :return: iterator of (level, sender, timestamp, message)
+    :raise ValueError: if the file isn't a binary log
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, 'rb') as f:
+        if f.read(len(BINARY_LOG_MAGIC)) != BINARY_LOG_MAGIC:
+            raise ValueError(f"{path} is not a binary log file")
+
+        senders: Dict[int, str] = {}
+        while True:
+            head = f.read(_RECORD.size)
+            # A record cut short is the end of a file that was being written
+            if len(head) < _RECORD.size:
+                return
+            level, sender_id, ts, length = _RECORD.unpack(head)
+            body = f.read(length)
+            if len(body) < length:
+                return
+
+            if level == _SENDER_RECORD:
+                _, name_length = _SENDER.unpack_from(body)
+                senders[sender_id] = body[_SENDER.size:_SENDER.size + name_length].decode("utf-8", "replace")
+            else:
+                yield level, senders.get(sender_id, f"#{sender_id}"), ts, body.decode("utf-8", "replace")
+
+
+def format_record(level: int, sender: str, ts: float, msg: str) -> str:
+    """
+    :return: a decoded record as a line, like the logger prints it but with milliseconds
+    """
+    timestr = datetime.fromtimestamp(ts).strftime("%m/%d/%Y %H:%M:%S.%f")[:-3]
+    level_name = LOGGING_LEVELS[level] if 0 <= level < len(LOGGING_LEVELS) else str(level)
+    return f"{level_name}:({timestr}) [{sender}] {msg}"
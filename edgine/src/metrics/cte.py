@@ -0,0 +1,46 @@
+# Phases of a loop of a service, each one has its own latency histogram
+PHASES = ["get", "second_get", "blogic", "post"]
+GET = 0
+SECOND_GET = 1
+BLOGIC = 2
+POST = 3
+
+# Statistics of a latency histogram that are published, with the quantile they stand for (None for the max)
+STATS = [("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", None)]
+
+# Columns of a row in the metrics table, the latency sums and counts go on across the windows
+FIELDS = [*[f"{phase}_{stat}" for phase in PHASES for stat, q in STATS],
+          *[f"{phase}_{total}" for phase in PHASES for total in ["sum", "count"]],
+          "loop_rate",
+          "in_rate",
+          "out_rate",
+          "items_in",
+          "items_out",
+          "out_drops",
+          "stale_drops",
+          "in_qsize",
+          "updated"]
+
+# A service publishes its metrics at most this often, in seconds
+PUBLISH_PERIOD = 0.5
+
+# Default length in seconds of a latency histogram window, after that it starts over (config key metrics_window)
+HISTOGRAM_WINDOW = 10.0
+
+# Fields of the metrics table that are exported to Prometheus : field, metric name, type, help
+PROMETHEUS_FIELDS = [("items_in", "edgine_items_in_total", "counter", "Input items processed by the service"),
+                     ("items_out", "edgine_items_out_total", "counter", "Output items posted by the service"),
+                     ("stale_drops", "edgine_stale_dropped_total", "counter", "Input items dropped for being too old"),
+                     ("out_drops", "edgine_out_dropped_total", "counter", "Output items dropped by its connections"),
+                     ("loop_rate", "edgine_loop_rate", "gauge", "Loops per second"),
+                     ("in_rate", "edgine_in_rate", "gauge", "Input items per second"),
+                     ("out_rate", "edgine_out_rate", "gauge", "Output items per second"),
+                     ("in_qsize", "edgine_in_queue_items", "gauge", "Items waiting in the input connection"),
+                     ("updated", "edgine_metrics_updated_timestamp_seconds", "gauge",
+                      "Last time the service published its metrics")]
+
+# Latency histograms are exported as summaries : phase, metric name, help
+PROMETHEUS_LATENCIES = [("get", "edgine_get_seconds", "Time to get input"),
+                        ("second_get", "edgine_second_get_seconds", "Time to get secondary input"),
+                        ("blogic", "edgine_blogic_seconds", "Time spent in blogic"),
+                        ("post", "edgine_post_seconds", "Time to post output")]
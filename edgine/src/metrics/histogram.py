@@ -0,0 +1,84 @@
+from array import array
+from bisect import bisect_left
+from typing import List
+import math
+
+
+class LatencyHistogram:
+    """
+    A fixed size histogram of durations with logarithmic buckets
+
+    Every power of 2 between lowest and highest is split in sub_buckets buckets,
+    so a quantile is known within a factor 2**(1/sub_buckets) (about 9% with 8 sub buckets).
+    All memory is allocated up front, recording a sample is a bisect and an increment.
+    The sum and number of all samples since the creation are kept apart, reset doesn't clear them.
+    """
+
+    def __init__(self, lowest: float = 1e-6, highest: float = 100.0, sub_buckets: int = 8):
+        if lowest <= 0 or highest <= lowest or sub_buckets <= 0:
+            raise ValueError(f"Invalid histogram range : lowest={lowest}, highest={highest}, sub_buckets={sub_buckets}")
+
+        n = int(math.ceil(math.log2(highest / lowest) * sub_buckets))
+        self._bounds: List[float] = [lowest * 2.0 ** (i / sub_buckets) for i in range(n + 1)]
+        # The last bucket catches everything above highest
+        self._counts = array('q', [0] * (len(self._bounds) + 1))
+        self._count: int = 0
+        self._max: float = 0.0
+        self._total: float = 0.0
+        self._total_count: int = 0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def total(self) -> float:
+        """Sum of all samples, not only those of the current window"""
+        return self._total
+
+    @property
+    def total_count(self) -> int:
+        """Number of all samples, not only those of the current window"""
+        return self._total_count
+
+    @property
+    def max(self) -> float:
+        return self._max
+
+    def record(self, value: float) -> None:
+        """
+        Add a sample
+        :param value: duration in seconds
+        :return: None
+        """
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self._count += 1
+        self._total += value
+        self._total_count += 1
+        if value > self._max:
+            self._max = value
+
+    def quantile(self, q: float) -> float:
+        """
+        Get a quantile of the recorded samples
+        :param q: quantile between 0 and 1, e.g. 0.99
+        :return: upper bound of the bucket the quantile falls in (never more than the max), 0.0 without samples
+        """
+        if self._count == 0:
+            return 0.0
+
+        rank = max(1, int(math.ceil(q * self._count)))
+        seen = 0
+        for i, c in enumerate(self._counts):
+            seen += c
+            if seen >= rank:
+                return min(self._bounds[i], self._max) if i < len(self._bounds) else self._max
+
+        return self._max
+
+    def reset(self) -> None:
+        """Forget all samples, to start a new window"""
+        for i in range(len(self._counts)):
+            self._counts[i] = 0
+        self._count = 0
+        self._max = 0.0
@@ -0,0 +1,60 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from typing import Callable, Tuple
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] == "/metrics":
+            status, body = 200, self.server.collect()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path.split("?")[0] == "/health":
+            status, body = self.server.health()
+            content_type = "text/plain; charset=utf-8"
+        else:
+            status, body, content_type = 404, "not found\n", "text/plain; charset=utf-8"
+
+        raw = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args) -> None:
+        # Scrapes every few seconds would flood the console
+        return
+
+
+class MetricsServer(Thread):
+    """
+    A small HTTP server in a thread of the main process
+
+    /metrics : Prometheus text format, made by collect() at every scrape
+    /health  : 200 when health() says everything is fine, 503 otherwise
+
+    Everything is read from shared memory at scrape time, the services don't do anything for it.
+    """
+
+    def __init__(self,
+                 collect: Callable[[], str],
+                 health: Callable[[], Tuple[int, str]],
+                 host: str = "127.0.0.1",
+                 port: int = 9100):
+        Thread.__init__(self, name="metrics-server", daemon=True)
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.collect = collect
+        self._server.health = health
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def run(self) -> None:
+        self._server.serve_forever(poll_interval=0.5)
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
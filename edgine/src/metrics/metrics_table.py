@@ -0,0 +1,52 @@
+from multiprocessing import RawArray
+from typing import Dict, List
+from edgine.src.metrics.cte import FIELDS
+
+
+class MetricsTable:
+    """
+    A table of floats in shared memory, one row per service
+
+    Every service only writes its own row, without any lock : a reader can see a row that is half updated,
+    which is fine for metrics. The parent reads it directly, there is no IPC round-trip.
+    The table has to be created before the services are started, so they inherit it.
+    """
+
+    def __init__(self, rows: int):
+        self._rows: int = rows
+        self._data = RawArray('d', rows * len(FIELDS))
+        self._names: List[str] = [f"row[{i}]" for i in range(rows)]
+
+    @property
+    def rows(self) -> int:
+        return self._rows
+
+    def set_name(self, row: int, name: str) -> None:
+        """Name a row, names only live in the process that created the table"""
+        self._names[row] = name
+
+    def publish(self, row: int, values: List[float]) -> None:
+        """
+        Overwrite a row
+        :param row: index of the row
+        :param values: one value per field, in the order of FIELDS
+        :return: None
+        """
+        n = len(FIELDS)
+        self._data[row * n:(row + 1) * n] = values
+
+    def read(self, row: int) -> Dict[str, float]:
+        """
+        Read a row
+        :param row: index of the row
+        :return: dict with field name -> value
+        """
+        n = len(FIELDS)
+        return dict(zip(FIELDS, self._data[row * n:(row + 1) * n]))
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """
+        Read the whole table
+        :return: dict with row name -> (dict with field name -> value)
+        """
+        return {self._names[i]: self.read(i) for i in range(self._rows)}
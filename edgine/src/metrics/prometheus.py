@@ -0,0 +1,44 @@
+from typing import Dict, List, Tuple
+import math
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def _format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return f"{name}{{{label_str}}} {_format_value(value)}" if label_str else f"{name} {_format_value(value)}"
+
+
+def format_metric(name: str,
+                  metric_type: str,
+                  description: str,
+                  samples: List[Tuple[Dict[str, str], float]],
+                  suffixed: List[Tuple[str, Dict[str, str], float]] = None) -> str:
+    """
+    Format one metric family in the Prometheus text exposition format
+    :param name: metric name, e.g. edgine_items_in_total
+    :param metric_type: counter, gauge, histogram, summary or untyped
+    :param description: help text
+    :param samples: list of (labels, value)
+    :param suffixed: list of (suffix, labels, value) for the samples of the family with another name,
+                     like the _sum and _count of a summary
+    :return: the lines of this metric, ending with a newline
+    """
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(_format_sample(name, labels, value))
+    for suffix, labels, value in suffixed if suffixed is not None else []:
+        lines.append(_format_sample(f"{name}{suffix}", labels, value))
+
+    return "\n".join(lines) + "\n"
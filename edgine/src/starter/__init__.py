@@ -1,24 +1,56 @@
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Any, Callable
 from edgine.src.config.config_server import ConfigServer
 from edgine.src.logger.edgine_logger import EdgineLogger
+from edgine.src.logger.sinks import LogSink
+from edgine.src.transport.shm_queue import SharedMemoryQueue, SharedMemoryRing, BroadcastQueue
+from edgine.src.transport.serializer import Serializer, SerializedQueue
+from edgine.src.transport.mailbox import SharedMemoryMailbox
+from edgine.src.transport.selectable_event import SelectableEvent
+from edgine.src.transport.connection import Connection
+from edgine.src.metrics.metrics_table import MetricsTable
+from edgine.src.metrics.metrics_server import MetricsServer
+from edgine.src.metrics.prometheus import format_metric
+from edgine.src.metrics.cte import PROMETHEUS_FIELDS, PROMETHEUS_LATENCIES, STATS, HISTOGRAM_WINDOW
+from edgine.src.transport.cte import QUEUE, SHM, MAILBOX, DROP_NEWEST, COALESCE
+from edgine.src.tracing.flight_recorder import FlightRecorder
+from edgine.src.logger.cte import DEBUG, ERROR, INFO
 from multiprocessing import Queue, Event
+from datetime import datetime
+import threading
+import signal
+import os
 
 
 class EdgineStarter:
 
-    def __init__(self, config_file: str = "cfg.json"):
+    def __init__(self, config_file: str = "cfg.json", log_sinks: List[LogSink] = None):
         print(ART)
         self.user_service_types: List = []
         self._user_services: List = []
         self._connections: List[tuple] = []
-        self._qs: List[Queue] = []
-        self._sink_qs: List[Queue] = []
+        self._qs: List[Connection] = []
+        self._all_connections: List[Connection] = []
+        self._sink_qs: List[Connection] = []
         self._sink_prod_ids: List[int] = []
         self.min_runtimes: List[float] = []
+        self._event_driven: List[bool] = []
+        self._replicas: List[int] = []
+        self._ordered: List[bool] = []
+        self._reorder_timeouts: List[float] = []
+        self._service_params: List[Dict[str, Any]] = []
+        self._metrics: MetricsTable = None
+        self._service_labels: List[str] = []
+        self._metrics_server: MetricsServer = None
+        self._recorder: FlightRecorder = None
+        self._watcher: threading.Thread = None
+        # Signal that asked for a dump, the watcher thread takes it
+        self._dump_signal: int = None
         self.secondary_connections: List[Tuple] = []
-        self.secondary_qs: List[Queue] = []
+        self.secondary_qs: List[Connection] = []
+        self._shm_qs: List = []
+        self._rings: Dict[int, SharedMemoryRing] = {}
         self.logging_q: Queue = Queue()
-        self.global_stop: Event = Event()
+        self.global_stop: SelectableEvent = SelectableEvent()
         self._log_stop: Event = Event()
         self.config_server = ConfigServer(stop_event=self.global_stop,
                                           config_file=config_file,
@@ -27,7 +59,211 @@ class EdgineStarter:
         self.logger = EdgineLogger(stop_event=self._log_stop,
                                    config_server=self.config_server,
                                    in_q=self.logging_q,
-                                   out_qs=[])
+                                   out_qs=[],
+                                   sinks=log_sinks)
+        self.config_server.create_if_unknown("metrics_window", HISTOGRAM_WINDOW)
+        # The flight recorder keeps the messages of the services up to this level, whatever the logger prints
+        self.config_server.declare("flight_recorder_level", int, INFO, min=ERROR, max=DEBUG)
+        self.config_server.declare("flight_recorder_dir", str, "flight_recorder")
+
+    def _is_producer(self, prod_id: int) -> bool:
+        return any(conn[0] == prod_id for conn in self._connections) or \
+               any(conn[0] == prod_id for conn in self.secondary_connections) or \
+               prod_id in self._sink_prod_ids
+
+    def _service_name(self, service_id: int) -> str:
+        return f"{self.user_service_types[service_id].__name__}[{service_id}]"
+
+    def _is_ordered_pool(self, service_id: int) -> bool:
+        # Without an input there is no order to keep, the replicas of a source make an unordered pool
+        return self._replicas[service_id] > 1 and self._ordered[service_id] and self._has_connection(service_id)
+
+    def _new_q(self, prod_id: int, serializer: Serializer = None, capacity: int = 2) -> Any:
+        """Create a new queue, on the ring of the producer if it broadcasts"""
+        if prod_id in self._rings:
+            if serializer is not None:
+                raise ValueError(f"Producer with ID {prod_id} broadcasts through shared memory, "
+                                 f"it can't use a serializer")
+            new_q = SharedMemoryQueue(ring=self._rings[prod_id], maxsize=capacity)
+            self._shm_qs.append(new_q)
+        elif serializer is not None:
+            new_q = SerializedQueue(maxsize=capacity, serializer=serializer)
+        else:
+            new_q = Queue(maxsize=capacity)
+
+        return new_q
+
+    def _new_connection(self,
+                        channel: Any,
+                        name: str,
+                        policy: str,
+                        capacity: int,
+                        block_timeout: float,
+                        coalesce: Callable[[Any, Any], Any],
+                        prod_id: int = None,
+                        cons_id: int = None) -> Connection:
+        """
+        Wrap a queue in a Connection with its backpressure policy,
+        items going into an ordered pool get numbered, items coming out of it are put back in that order
+        """
+        if policy == COALESCE and isinstance(channel, SharedMemoryQueue):
+            raise ValueError(f"Connection {name} can't coalesce through shared memory")
+
+        sequence = cons_id is not None and self._is_ordered_pool(cons_id)
+        reorder = prod_id is not None and self._is_ordered_pool(prod_id) and not isinstance(channel, SharedMemoryMailbox)
+        if sequence and reorder:
+            raise ValueError(f"Connection {name} links two ordered replicated services, "
+                             f"register one of them with ordered=False")
+
+        if reorder and policy == COALESCE:
+            raise ValueError(f"Connection {name} can't coalesce the output of an ordered replicated service")
+
+        conn = Connection(channel,
+                          name=name,
+                          policy=policy,
+                          capacity=capacity,
+                          block_timeout=block_timeout,
+                          coalesce=coalesce,
+                          sequence=sequence,
+                          reorder=reorder,
+                          reorder_window=self._replicas[prod_id] * (capacity + 2) if reorder else 16,
+                          reorder_timeout=self._reorder_timeouts[prod_id] if reorder else 0.1)
+        self._all_connections.append(conn)
+        return conn
+
+    def drop_counts(self) -> Dict[str, int]:
+        """
+        Get the number of items each connection has dropped so far
+        :return: dict with connection name -> dropped item count
+        """
+        return {conn.name: conn.drops for conn in self._all_connections}
+
+    def stale_drop_counts(self) -> Dict[str, int]:
+        """
+        Get the number of items each service has dropped because they were older than its max_age
+        :return: dict with service (e.g. Detect[2]) -> dropped item count
+        """
+        return {label: service.stale_drops for label, service in zip(self._service_labels, self._user_services)}
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Get the latest metrics of every service, straight from shared memory
+        :return: dict with service (e.g. Detect[2]) -> (dict with metric name -> value),
+                 see edgine.src.metrics.cte.FIELDS
+        """
+        return self._metrics.snapshot() if self._metrics is not None else {}
+
+    def dump_flight_recorder(self, reason: str = "requested") -> str:
+        """
+        Write the last log records and loop timings of every service to <flight_recorder_dir>/flight_<time>.json
+        :param reason: why, it goes in the file
+        :return: path of the file, None before init_services
+        """
+        if self._recorder is None:
+            return None
+
+        services = {label: {"pid": service.pid, "alive": service.is_alive(), "exitcode": service.exitcode}
+                    for label, service in zip(self._service_labels, self._user_services)}
+        self.config_server.sync()
+        path = os.path.join(self.config_server.config.flight_recorder_dir,
+                            f"flight_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.json")
+        self._recorder.dump(path, reason=reason, extra={"state": services})
+        print(f"Flight recorder dumped to {path} ({reason})")
+        return path
+
+    def _watch_services(self) -> None:
+        """Dump the flight recorder when a service exits before we stop it, or when a signal asked for it"""
+        reported = set()
+        while not self.global_stop.wait(timeout=0.1):
+            signum, self._dump_signal = self._dump_signal, None
+            if signum is not None:
+                self.dump_flight_recorder(f"signal {signal.Signals(signum).name}")
+
+            for label, service in zip(self._service_labels, self._user_services):
+                if label not in reported and service.exitcode is not None and not self.global_stop.is_set():
+                    reported.add(label)
+                    self.dump_flight_recorder(f"{label} exited with code {service.exitcode}")
+
+    def _on_dump_signal(self, signum, frame) -> None:
+        # The signal can come while this thread holds a lock the dump needs, the watcher thread does the dump
+        self._dump_signal = signum
+
+    def start_metrics_server(self, host: str = "127.0.0.1", port: int = 9100) -> int:
+        """
+        Serve the metrics in the Prometheus text format on http://host:port/metrics, and liveness on /health.
+        The server runs in a thread of this process and only reads shared memory, call this after init_services.
+        :param host: address to listen on, keep it on localhost unless the device is behind a firewall
+        :param port: port to listen on, 0 to pick a free one
+        :return: the port the server listens on
+        """
+        self._metrics_server = MetricsServer(collect=self.prometheus_metrics, health=self.health, host=host, port=port)
+        self._metrics_server.start()
+        return self._metrics_server.port
+
+    def health(self) -> Tuple[int, str]:
+        """
+        Check if every service is still running
+        :return: HTTP status (200 or 503) and a line per service
+        """
+        lines = [f"{label} {'alive' if service.is_alive() else 'dead'}"
+                 for label, service in zip(self._service_labels, self._user_services)]
+        ok = len(self._user_services) > 0 and all(service.is_alive() for service in self._user_services)
+        return (200 if ok else 503), "\n".join(["ok" if ok else "failing", *lines]) + "\n"
+
+    def prometheus_metrics(self) -> str:
+        """
+        Collect all metrics in the Prometheus text format
+        :return: the text of a scrape
+        """
+        metrics = self.metrics()
+        services = [{"service": name} for name in metrics.keys()]
+        rows = list(metrics.values())
+        out = []
+        for field, name, metric_type, description in PROMETHEUS_FIELDS:
+            out.append(format_metric(name, metric_type, description,
+                                     [(labels, row[field]) for labels, row in zip(services, rows)]))
+
+        for phase, name, description in PROMETHEUS_LATENCIES:
+            samples = []
+            for labels, row in zip(services, rows):
+                samples += [({**labels, "quantile": str(q)}, row[f"{phase}_{stat}"]) for stat, q in STATS if q is not None]
+            totals = [(suffix, labels, row[f"{phase}{suffix}"])
+                      for labels, row in zip(services, rows) for suffix in ["_sum", "_count"]]
+            out.append(format_metric(name, "summary", f"{description}, quantiles over the current metrics window",
+                                     samples, suffixed=totals))
+            out.append(format_metric(f"{name}_max", "gauge", f"{description}, max over the current metrics window",
+                                     [(labels, row[f"{phase}_max"]) for labels, row in zip(services, rows)]))
+
+        out.append(format_metric("edgine_service_up", "gauge", "1 if the process of the service is alive",
+                                 [({"service": label}, service.is_alive())
+                                  for label, service in zip(self._service_labels, self._user_services)]))
+
+        conns = [({"connection": conn.name, "policy": conn.policy}, conn) for conn in self._all_connections]
+        out.append(format_metric("edgine_connection_dropped_total", "counter", "Items dropped by the connection",
+                                 [(labels, conn.drops) for labels, conn in conns]))
+        out.append(format_metric("edgine_connection_capacity", "gauge", "Items that can wait in the connection",
+                                 [(labels, conn.capacity) for labels, conn in conns]))
+        out.append(format_metric("edgine_connection_items", "gauge", "Items waiting in the connection",
+                                 [(labels, self._qsize(conn)) for labels, conn in conns]))
+
+        out.append(format_metric("edgine_log_dropped_total", "counter", "Log messages dropped by the rate limiter",
+                                 [({"output": str(i)}, count) for i, count in enumerate(self.logger.dropped_counts)]))
+
+        return "".join(out)
+
+    @staticmethod
+    def _qsize(conn: Connection) -> int:
+        try:
+            return conn.qsize()
+        except NotImplementedError:
+            return -1
+
+    def service_pids(self) -> Dict[str, int]:
+        """
+        Get the process ID of every service, once they are started
+        :return: dict with service (e.g. Detect[2]) -> pid, None if it isn't started
+        """
+        return {label: service.pid for label, service in zip(self._service_labels, self._user_services)}
 
     def _has_connection(self, cons_id: int):
         out = False
@@ -37,36 +273,196 @@ class EdgineStarter:
 
         return out
 
-    def reg_service(self, service_type, min_runtime: float = 0.001) -> int:
-        """ Registers a new service """
-        new_q = Queue(maxsize=2)
-        self._qs.append(new_q)
+    def reg_service(self,
+                    service_type,
+                    min_runtime: float = 0.001,
+                    event_driven: bool = False,
+                    replicas: int = 1,
+                    ordered: bool = True,
+                    reorder_timeout: float = 0.1,
+                    batching: bool = False,
+                    batch_size: int = 8,
+                    batch_wait_ms: float = 10.0,
+                    max_age: float = None) -> int:
+        """
+        Registers a new service
+        :param service_type: class of the service, a subclass of EdgineBase
+        :param min_runtime: minimal duration of one loop of the service
+        :param event_driven: block until something happens instead of polling the input
+        :param replicas: number of processes that share the input of this service and process it in parallel
+        :param ordered: hand out the results of the replicas in the order of their inputs,
+                        set to False to get them as soon as they are ready.
+                        Only for a service with a primary input, register it before the outputs of the service
+        :param reorder_timeout: max time to wait for a missing result before skipping it, only used when ordered
+        :param batching: collect the input in batches and hand them to 'blogic_batch'
+        :param batch_size: default max number of items in a batch, then read from the config
+        :param batch_wait_ms: default max time to wait for a full batch, then read from the config
+        :param max_age: drop input items that were captured more than max_age seconds ago, None to keep everything
+        :return: ID of the service
+        """
+        if replicas < 1:
+            raise ValueError(f"A service needs at least 1 replica, got {replicas}")
+
+        self._qs.append(None)
         self.min_runtimes.append(min_runtime)
+        self._event_driven.append(event_driven)
+        self._replicas.append(replicas)
+        self._ordered.append(ordered)
+        self._reorder_timeouts.append(reorder_timeout)
+        self._service_params.append({"batching": batching,
+                                     "batch_size": batch_size,
+                                     "batch_wait_ms": batch_wait_ms,
+                                     "max_age": max_age})
         self.user_service_types.append(service_type)
         return len(self.user_service_types) - 1
 
-    def reg_connection(self, prod_id: int, cons_id: int):
+    def reg_connection(self,
+                       prod_id: int,
+                       cons_id: int,
+                       transport: str = QUEUE,
+                       slot_size: int = 0,
+                       slots: int = 4,
+                       serializer: Serializer = None,
+                       policy: str = DROP_NEWEST,
+                       capacity: int = 2,
+                       block_timeout: float = 0.1,
+                       coalesce: Callable[[Any, Any], Any] = None):
+        """
+        Creates a primary data connection
+        :param prod_id: ID of the producing service
+        :param cons_id: ID of the consuming service
+        :param transport: QUEUE to pickle everything through a Queue,
+                          SHM to move numpy arrays through a shared memory ring
+        :param slot_size: max size in bytes of one array, only used for SHM
+        :param slots: number of preallocated slots in the ring, only used for SHM
+        :param serializer: serializer for the payloads (e.g. OutOfBandSerializer), only used for QUEUE
+        :param policy: what to do when the consumer can't keep up : DROP_NEWEST, DROP_OLDEST, BLOCK or COALESCE
+        :param capacity: number of items that can wait in the connection
+        :param block_timeout: max time to wait for room, only used for BLOCK
+        :param coalesce: function(old, new) -> merged, only used for COALESCE, defaults to coalesce_default
+        """
         if self._has_connection(cons_id):
             raise ValueError(f"Consumer with ID {cons_id} [{type(self.user_service_types[cons_id])}] already has a primary connection")
 
+        if self._replicas[cons_id] > 1 and self._ordered[cons_id] and self._is_producer(cons_id):
+            raise ValueError(f"Consumer with ID {cons_id} [{self.user_service_types[cons_id]}] is an ordered replicated "
+                             f"service, register its input before its outputs")
+
+        if transport == SHM and prod_id not in self._rings:
+            if serializer is not None:
+                raise ValueError(f"A serializer can only be used with the {QUEUE} transport")
+            new_q = SharedMemoryQueue(slot_size=slot_size, slots=slots, maxsize=capacity)
+            self._shm_qs.append(new_q)
+        elif transport in [QUEUE, SHM]:
+            new_q = self._new_q(prod_id, serializer=serializer, capacity=capacity)
+        else:
+            raise ValueError(f"Unknown transport {transport}")
+
+        self._qs[cons_id] = self._new_connection(new_q,
+                                                 name=f"{self._service_name(prod_id)}->{self._service_name(cons_id)}",
+                                                 policy=policy,
+                                                 capacity=capacity,
+                                                 block_timeout=block_timeout,
+                                                 coalesce=coalesce,
+                                                 prod_id=prod_id,
+                                                 cons_id=cons_id)
         self._connections.append((prod_id, cons_id))
 
-    def reg_secondary_connection(self, prod_id: int, cons_id: int):
-        """ Creates a secondary data connection """
+    def reg_secondary_connection(self,
+                                 prod_id: int,
+                                 cons_id: int,
+                                 serializer: Serializer = None,
+                                 transport: str = QUEUE,
+                                 mailbox_size: int = 65536,
+                                 policy: str = DROP_NEWEST,
+                                 capacity: int = 2,
+                                 block_timeout: float = 0.1,
+                                 coalesce: Callable[[Any, Any], Any] = None):
+        """
+        Creates a secondary data connection
+        :param prod_id: ID of the producing service
+        :param cons_id: ID of the consuming service
+        :param serializer: serializer for the payloads, only used for QUEUE
+        :param transport: QUEUE to pass every item through a Queue,
+                          MAILBOX to keep only the latest value in a shared memory slot that is overwritten in place
+        :param mailbox_size: max size in bytes of the pickled value, only used for MAILBOX
+        :param policy: what to do when the consumer can't keep up, see reg_connection
+        :param capacity: number of items that can wait in the connection
+        :param block_timeout: max time to wait for room, only used for BLOCK
+        :param coalesce: function(old, new) -> merged, only used for COALESCE
+
+        Every replica of a replicated consumer needs the secondary data, use MAILBOX for those:
+        through a QUEUE, each item only reaches one of the replicas.
+        """
+        if transport == MAILBOX:
+            new_q = SharedMemoryMailbox(size=mailbox_size)
+            self._shm_qs.append(new_q)
+        elif transport == QUEUE:
+            new_q = self._new_q(prod_id, serializer=serializer, capacity=capacity)
+        else:
+            raise ValueError(f"Unknown transport {transport} for a secondary connection")
+
+        new_conn = self._new_connection(new_q,
+                                        name=f"{self._service_name(prod_id)}~>{self._service_name(cons_id)}",
+                                        policy=policy,
+                                        capacity=capacity,
+                                        block_timeout=block_timeout,
+                                        coalesce=coalesce,
+                                        prod_id=prod_id)
         self.secondary_connections.append((prod_id, cons_id))
-        new_q = Queue(maxsize=2)
-        self.secondary_qs.append(new_q)
+        self.secondary_qs.append(new_conn)
 
-    def reg_sink(self, prod_id: int) -> Queue:
-        new_q = Queue(maxsize=2)
-        self._sink_qs.append(new_q)
+    def reg_sink(self,
+                 prod_id: int,
+                 policy: str = DROP_NEWEST,
+                 capacity: int = 2,
+                 block_timeout: float = 0.1,
+                 coalesce: Callable[[Any, Any], Any] = None) -> Connection:
+        """
+        Creates a connection from a service to the main process
+        :param prod_id: ID of the producing service
+        :param policy: what to do when the main process can't keep up, see reg_connection
+        :param capacity: number of items that can wait in the connection
+        :param block_timeout: max time to wait for room, only used for BLOCK
+        :param coalesce: function(old, new) -> merged, only used for COALESCE
+        :return: the connection to get the data from
+        """
+        new_conn = self._new_connection(self._new_q(prod_id, capacity=capacity),
+                                        name=f"{self._service_name(prod_id)}->sink[{len(self._sink_qs)}]",
+                                        policy=policy,
+                                        capacity=capacity,
+                                        block_timeout=block_timeout,
+                                        coalesce=coalesce,
+                                        prod_id=prod_id)
+        self._sink_qs.append(new_conn)
         self._sink_prod_ids.append(prod_id)
-        return new_q
+        return new_conn
+
+    def reg_broadcast(self, prod_id: int, slot_size: int, slots: int = 4):
+        """
+        Makes a producer publish every array once into a shared memory ring,
+        all its consumers (primary, secondary and sinks) read from that same slot.
+        Call this before registering any connection from this producer.
+        :param prod_id: ID of the producing service
+        :param slot_size: max size in bytes of one array
+        :param slots: number of preallocated slots in the ring
+        """
+        if self._is_producer(prod_id):
+            raise ValueError(f"Producer with ID {prod_id} [{self.user_service_types[prod_id]}] already has connections, "
+                             f"register the broadcast first")
+
+        if self._replicas[prod_id] > 1:
+            raise ValueError(f"Producer with ID {prod_id} [{self.user_service_types[prod_id]}] is replicated, "
+                             f"it can't broadcast")
+
+        self._rings[prod_id] = SharedMemoryRing(slot_size=slot_size, slots=slots)
 
     def init_services(self):
 
         self.logger.start()
-        self.config_server.start()
+
+        self._metrics = MetricsTable(rows=sum(self._replicas))
+        self._recorder = FlightRecorder(rows=sum(self._replicas))
 
         for i in range(len(self.user_service_types)):
             in_q = self._qs[i] if self._has_connection(i) else None
@@ -86,15 +482,37 @@ class EdgineStarter:
                 elif self.secondary_connections[j][0] == i:
                     out_qs.append(self.secondary_qs[j])
 
-            service = self.user_service_types[i](stop_event=self.global_stop,
-                                                 logging_q=self.logging_q,
-                                                 config_server=self.config_server,
-                                                 data_in=in_q,
-                                                 data_out_list=out_qs,
-                                                 secondary_data_in_list=tmp_second_q,
-                                                 min_runtime=self.min_runtimes[i])
+            shm_out_qs = [q for q in out_qs if isinstance(q.channel, SharedMemoryQueue)]
+            if i in self._rings and len(shm_out_qs) > 0:
+                out_qs = [BroadcastQueue(shm_out_qs), *[q for q in out_qs if q not in shm_out_qs]]
 
-            self._user_services.append(service)
+            # The replicas of a service share its input and outputs
+            for r in range(self._replicas[i]):
+                service = self.user_service_types[i](stop_event=self.global_stop,
+                                                     logging_q=self.logging_q,
+                                                     config_server=self.config_server,
+                                                     data_in=in_q,
+                                                     data_out_list=out_qs,
+                                                     secondary_data_in_list=tmp_second_q,
+                                                     min_runtime=self.min_runtimes[i],
+                                                     event_driven=self._event_driven[i],
+                                                     ordered_replica=self._is_ordered_pool(i),
+                                                     metrics=self._metrics,
+                                                     metrics_row=len(self._user_services),
+                                                     flight_recorder=self._recorder,
+                                                     **self._service_params[i])
+                if self._replicas[i] > 1:
+                    service.name = f"{service.name}#{r}"
+                # Services of the same class share a name, metrics are reported under the ID of the service
+                label = f"{self._service_name(i)}#{r}" if self._replicas[i] > 1 else self._service_name(i)
+                self._metrics.set_name(len(self._user_services), label)
+                self._recorder.set_name(len(self._user_services), label)
+                self._service_labels.append(label)
+
+                self._user_services.append(service)
+
+        # After the services made their config copies, so the changes it publishes wake all of them
+        self.config_server.start()
 
     def start(self):
         print(f"Starting {len(self._user_services)} services:")
@@ -103,7 +521,21 @@ class EdgineStarter:
             print(f" | - {service.name}")
             service.start()
 
+        # A dead service, or SIGUSR1, dumps the flight recorder.
+        # The handler is set after the services are started, so they don't inherit it
+        self._watcher = threading.Thread(target=self._watch_services, name="flight-recorder-watch", daemon=True)
+        self._watcher.start()
+        if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, self._on_dump_signal)
+
     def stop(self):
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+
+        if self._watcher is not None and hasattr(signal, "SIGUSR1") \
+                and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+
         self.global_stop.set()
         for service in reversed(self._user_services):
             service.join(timeout=2)
@@ -111,12 +543,26 @@ class EdgineStarter:
                 print(f"Service {service.name} did not exit properly. Terminating...")
                 service.terminate()
 
+        if self.config_server.pid is not None:
+            self.config_server.join(timeout=2)
+            if self.config_server.exitcode is None:
+                print(f"Config server {self.config_server.name} did not exit properly. Terminating...")
+                self.config_server.terminate()
+        self.config_server.close()
+
         self._log_stop.set()
         self.logger.join(timeout=2)
         if self.logger.exitcode is None:
             print(f"Logger {self.logger.name} did not exit properly. Terminating...")
             self.logger.terminate()
 
+        for q in self._shm_qs:
+            q.close()
+            q.unlink()
+
+        for ring in self._rings.values():
+            ring.unlink()
+
 
 ART = """      &%%%%%%%%%%%%%%&                    /%&*                     &%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
       &%%%&                               /%%%&                  %%%%%.
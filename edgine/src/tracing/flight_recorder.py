@@ -0,0 +1,123 @@
+from multiprocessing import RawArray
+from ctypes import Structure, c_double, c_uint8, c_uint16, c_uint64, c_char
+from typing import Any, Dict, List
+import json
+import os
+from edgine.src.logger.cte import LOGGING_LEVELS
+from edgine.src.metrics.cte import PHASES
+
+# Longest message a log record keeps, the rest is cut off
+RECORD_MSG_SIZE = 160
+
+
+class _LogRecord(Structure):
+    _fields_ = [("ts", c_double), ("level", c_uint8), ("length", c_uint16), ("msg", c_char * RECORD_MSG_SIZE)]
+
+
+class _TimingSample(Structure):
+    _fields_ = [("ts", c_double), ("latencies", c_double * len(PHASES))]
+
+
+class FlightRecorder:
+    """
+    The last log records and loop timings of every service, in shared memory, to dump when something goes wrong
+
+    One row per service, with a ring of log records and a ring of timing samples.
+    Every service only writes its own row, without any lock.
+    Recording a message still means formatting and encoding it, even when no logger output wants it,
+    that is why services only record up to INFO unless flight_recorder_level says otherwise.
+    A dump taken while a service writes can show that one record half updated.
+    The recorder has to be created before the services are started, so they inherit it.
+    """
+
+    def __init__(self, rows: int, log_slots: int = 256, timing_slots: int = 256):
+        self._rows: int = rows
+        self._log_slots: int = log_slots
+        self._timing_slots: int = timing_slots
+        self._logs = RawArray(_LogRecord, rows * log_slots)
+        self._timings = RawArray(_TimingSample, rows * timing_slots)
+        # Number of log records and timing samples written in each row, so far
+        self._heads = RawArray(c_uint64, rows * 2)
+        self._names: List[str] = [f"row[{i}]" for i in range(rows)]
+
+    @property
+    def rows(self) -> int:
+        return self._rows
+
+    def set_name(self, row: int, name: str) -> None:
+        """Name a row, names only live in the process that created the recorder"""
+        self._names[row] = name
+
+    def record_log(self, row: int, level: int, msg: str, ts: float) -> None:
+        """
+        Keep a log record, overwriting the oldest one of the row
+        :param row: row of the service
+        :param level: logging level
+        :param msg: message, cut to RECORD_MSG_SIZE bytes
+        :param ts: time it was logged
+        :return: None
+        """
+        head = self._heads[row * 2]
+        record = self._logs[row * self._log_slots + head % self._log_slots]
+        raw = msg.encode("utf-8", "replace")[:RECORD_MSG_SIZE]
+        record.ts = ts
+        record.level = level
+        record.length = len(raw)
+        record.msg = raw
+        self._heads[row * 2] = head + 1
+
+    def record_timing(self, row: int, ts: float, latencies: List[float]) -> None:
+        """
+        Keep the latencies of one loop, overwriting the oldest sample of the row
+        :param row: row of the service
+        :param ts: end time of the loop
+        :param latencies: one latency per phase, in the order of PHASES
+        :return: None
+        """
+        head = self._heads[row * 2 + 1]
+        sample = self._timings[row * self._timing_slots + head % self._timing_slots]
+        sample.ts = ts
+        sample.latencies[:] = latencies
+        self._heads[row * 2 + 1] = head + 1
+
+    def read(self, row: int) -> Dict[str, Any]:
+        """
+        Read the rings of a row, oldest first
+        :param row: row of the service
+        :return: dict with the logs and timings
+        """
+        logs = []
+        head = self._heads[row * 2]
+        for i in range(max(0, head - self._log_slots), head):
+            record = self._logs[row * self._log_slots + i % self._log_slots]
+            logs.append({"ts": record.ts,
+                         "level": LOGGING_LEVELS[record.level] if record.level < len(LOGGING_LEVELS) else record.level,
+                         "msg": record.msg[:record.length].decode("utf-8", "replace")})
+
+        timings = []
+        head = self._heads[row * 2 + 1]
+        for i in range(max(0, head - self._timing_slots), head):
+            sample = self._timings[row * self._timing_slots + i % self._timing_slots]
+            timings.append({"ts": sample.ts, **dict(zip(PHASES, sample.latencies[:]))})
+
+        return {"logs": logs, "timings": timings}
+
+    def dump(self, path: str, reason: str = "", extra: Dict[str, Any] = None) -> str:
+        """
+        Write all rows to a JSON file
+        :param path: file to write
+        :param reason: why the dump was taken
+        :param extra: more to put in the file, like the state of the services
+        :return: the path
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        out = {"reason": reason,
+               **(extra if extra is not None else {}),
+               "services": {self._names[i]: self.read(i) for i in range(self._rows)}}
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(out, f, indent=1)
+        os.replace(tmp_path, path)
+        return path
@@ -0,0 +1,83 @@
+from collections import deque
+from typing import Any, Dict, List
+import json
+import os
+
+
+def complete_event(name: str, trace_id: int, start: float, end: float, service: str, pid: int) -> Dict[str, Any]:
+    """
+    Create a Chrome trace event for something that took time
+    :param name: name of the event, e.g. "wait" or "blogic"
+    :param trace_id: trace ID of the item
+    :param start: start time (time.time())
+    :param end: end time (time.time())
+    :param service: name of the service
+    :param pid: process ID of the service
+    :return: trace event dict
+    """
+    return {"name": name, "cat": service, "ph": "X", "ts": start * 1e6, "dur": max(0.0, end - start) * 1e6,
+            "pid": pid, "tid": service, "args": {"trace_id": trace_id}}
+
+
+def flow_event(trace_id: int, t: float, service: str, pid: int, start: bool) -> Dict[str, Any]:
+    """
+    Create a Chrome trace flow event, these draw the arrows between the hops of one item
+    :param trace_id: trace ID of the item
+    :param t: time of the event (time.time())
+    :param service: name of the service
+    :param pid: process ID of the service
+    :param start: True where the item leaves a service, False where it arrives
+    :return: trace event dict
+    """
+    event = {"name": "hop", "cat": "trace", "ph": "s" if start else "f", "id": trace_id, "ts": t * 1e6,
+             "pid": pid, "tid": service}
+    if not start:
+        event["bp"] = "e"
+    return event
+
+
+class TraceBuffer:
+    """
+    In-memory buffer of trace events, when it is full the oldest events are dropped
+
+    The dump is a Chrome trace event file, open it in chrome://tracing or https://ui.perfetto.dev
+    """
+
+    def __init__(self, size: int = 100000):
+        self._events: deque = deque(maxlen=size)
+        self._names: Dict[int, str] = {}
+
+    def add(self, sender: str, events: List[Dict[str, Any]]) -> None:
+        """
+        Add events to the buffer
+        :param sender: name of the service that recorded them
+        :param events: list of trace events
+        :return: None
+        """
+        for event in events:
+            self._names[event["pid"]] = sender
+        self._events.extend(events)
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def dump(self, filepath: str) -> bool:
+        """
+        Write all buffered events to a Chrome trace event JSON file
+        :param filepath: path of the file
+        :return: False if there was nothing to write or the write failed
+        """
+        if len(self._events) == 0 or filepath is None:
+            return False
+
+        names = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}}
+                 for pid, name in self._names.items()]
+        tmp = f"{filepath}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({"traceEvents": [*names, *self._events], "displayTimeUnit": "ms"}, f)
+            os.replace(tmp, filepath)
+        except OSError:
+            return False
+
+        return True
@@ -0,0 +1,312 @@
+from multiprocessing import Value
+from ctypes import c_uint64
+from functools import reduce
+from typing import Any, Callable, Dict, Tuple
+from edgine.src.transport.selectable_event import waitable
+from edgine.src.transport.envelope import Envelope, payload, rewrap
+from edgine.src.transport.shm_queue import SharedMemoryQueue
+from edgine.src.transport.cte import DROP_NEWEST, DROP_OLDEST, BLOCK, COALESCE, POLICIES
+import queue
+import time
+import copy
+
+# A queue can look full while its last items are still on their way through the pipe
+_DISCARD_TIMEOUT = 0.005
+
+
+def coalesce_default(old: Any, new: Any) -> Any:
+    """
+    Merge two pending items : dicts are updated, lists are concatenated, anything else keeps the newest
+    :param old: the item that was waiting
+    :param new: the item that comes after it
+    :return: merged item
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        return {**old, **new}
+    elif isinstance(old, list) and isinstance(new, list):
+        return old + new
+    else:
+        return new
+
+
+class Connection:
+    """
+    A queue-like channel with a backpressure policy
+
+    DROP_NEWEST : the new item is dropped when the channel is full
+    DROP_OLDEST : the oldest waiting item is thrown away to make room, the consumer always sees the latest
+    BLOCK       : wait up to block_timeout for room, only drop when that runs out
+    COALESCE    : merge everything that is waiting with the new item into one
+
+    Every lost item is counted in a shared counter, readable from any process.
+
+    A sequencing connection (the input of a replicated stage) numbers every item it posts,
+    in one sequence for all the processes that post to it.
+    A reordering connection (the output of an ordered replicated stage) hands out items in that order,
+    it skips a missing item once it has waited reorder_timeout for it, or when reorder_window items are waiting.
+    Items come out without their envelope, the envelope of the last item we got stays available as last_envelope.
+    """
+
+    def __init__(self,
+                 channel: Any,
+                 name: str = "connection",
+                 policy: str = DROP_NEWEST,
+                 capacity: int = 2,
+                 block_timeout: float = 0.1,
+                 coalesce: Callable[[Any, Any], Any] = None,
+                 sequence: bool = False,
+                 reorder: bool = False,
+                 reorder_window: int = 16,
+                 reorder_timeout: float = 0.1):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy}, use one of {POLICIES}")
+
+        self._channel: Any = channel
+        self._name: str = name
+        self._policy: str = policy
+        self._capacity: int = capacity
+        self._block_timeout: float = block_timeout
+        self._coalesce: Callable[[Any, Any], Any] = coalesce if coalesce is not None else coalesce_default
+        self._drops = Value(c_uint64, 0)
+        self._sequence: bool = sequence
+        # Shared, so the replicas of a replicated producer number their items in one sequence
+        self._seq = Value(c_uint64, 0)
+        self._reorder: bool = reorder
+        self._reorder_window: int = reorder_window
+        self._reorder_timeout: float = reorder_timeout
+        self._pending: Dict[int, Tuple[float, Envelope]] = {}
+        self._next_seq: int = 0
+        self.last_envelope: Envelope = None
+
+    @property
+    def channel(self) -> Any:
+        return self._channel
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def policy(self) -> str:
+        return self._policy
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def block_timeout(self) -> float:
+        return self._block_timeout
+
+    @property
+    def drops(self) -> int:
+        return self._drops.value
+
+    @property
+    def sequence(self) -> bool:
+        return self._sequence
+
+    @property
+    def reorder(self) -> bool:
+        return self._reorder
+
+    @property
+    def reorder_timeout(self) -> float:
+        return self._reorder_timeout
+
+    @property
+    def pending(self) -> int:
+        """Number of items that arrived out of order and wait for the ones before them"""
+        return len(self._pending)
+
+    def add_drop(self, count: int = 1) -> None:
+        with self._drops.get_lock():
+            self._drops.value += count
+
+    def _try_put(self, data: Any) -> bool:
+        try:
+            self._channel.put_nowait(data)
+            return True
+        except queue.Full:
+            return False
+
+    def _waiting(self) -> int:
+        """Items still in the channel, including the ones on their way through the pipe"""
+        try:
+            return self._channel.qsize()
+        except NotImplementedError:
+            return 0
+
+    def _discard(self, timeout: float = _DISCARD_TIMEOUT) -> None:
+        if hasattr(self._channel, "discard"):
+            self._channel.discard(timeout)
+        else:
+            self._channel.get(True, timeout)
+
+    def put_nowait(self, data: Any) -> bool:
+        """
+        Post data according to the backpressure policy, this never raises queue.Full
+        :param data: data to post
+        :return: True if the data was posted
+        """
+        if not self._sequence:
+            return self._put(data)
+
+        # The lock is held through the put, so a number is never given twice, nor skipped when the item is dropped
+        with self._seq.get_lock():
+            seq = self._seq.value
+            if isinstance(data, Envelope):
+                data = rewrap(data, data.data)
+                data.seq = seq
+            else:
+                data = Envelope(seq, data)
+
+            # Only count what went through, so a dropped item doesn't leave a gap
+            posted = self._put(data)
+            if posted:
+                self._seq.value = seq + 1
+        return posted
+
+    def _put(self, data: Any) -> bool:
+        if self._policy == BLOCK:
+            try:
+                self._channel.put(data, True, self._block_timeout)
+                return True
+            except queue.Full:
+                self.add_drop()
+                return False
+
+        if self._try_put(data):
+            return True
+
+        if self._policy == DROP_OLDEST:
+            for i in range(self._capacity):
+                try:
+                    self._discard()
+                except queue.Empty:
+                    break
+                self.add_drop()
+                if self._try_put(data):
+                    return True
+
+        elif self._policy == COALESCE:
+            pending = []
+            while True:
+                try:
+                    wait = _DISCARD_TIMEOUT if len(pending) == 0 or self._waiting() > 0 else 0.0
+                    pending.append(self._channel.get(True, wait))
+                except queue.Empty:
+                    break
+
+            # Merge the payloads, the result keeps the envelope of the newest item
+            if self._try_put(rewrap(data, reduce(self._coalesce, [payload(p) for p in [*pending, data]]))):
+                return True
+
+        self.add_drop()
+        return False
+
+    def put(self, data: Any, block: bool = True, timeout: float = None) -> bool:
+        return self.put_nowait(data)
+
+    def discard(self, timeout: float = _DISCARD_TIMEOUT) -> None:
+        """Throw away the oldest item, this counts as a drop"""
+        self._discard(timeout)
+        self.add_drop()
+
+    def _unwrap(self, item: Any) -> Any:
+        self.last_envelope = item if isinstance(item, Envelope) else None
+        return payload(item)
+
+    def _pop_next(self) -> Tuple[bool, Any]:
+        """Hand out the next item in order if we have it, skipping ahead when waiting makes no sense anymore"""
+        while len(self._pending) > 0:
+            if self._next_seq not in self._pending:
+                oldest = min(self._pending.values(), key=lambda p: p[0])[0]
+                if len(self._pending) < self._reorder_window and time.time() - oldest < self._reorder_timeout:
+                    return False, None
+                self._next_seq = min(self._pending.keys())
+
+            env = self._pending.pop(self._next_seq)[1]
+            self._next_seq += 1
+
+            # An empty envelope is a replica telling us this item didn't produce anything
+            if env.data is not None:
+                return True, self._unwrap(env)
+
+        return False, None
+
+    def _get_ordered(self, block: bool, timeout: float) -> Any:
+        if not block:
+            timeout = 0.0
+
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            ready, item = self._pop_next()
+            if ready:
+                return item
+
+            # Don't sleep past the moment we would give up on a missing item
+            wait = self._reorder_timeout
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - time.time()))
+
+            try:
+                env = self._channel.get(True, wait)
+            except queue.Empty:
+                if deadline is not None and time.time() >= deadline:
+                    ready, item = self._pop_next()
+                    if ready:
+                        return item
+                    raise
+                continue
+
+            if not isinstance(env, Envelope):
+                return env
+
+            if env.seq < self._next_seq:
+                # Too late, we already skipped it
+                self.add_drop()
+                continue
+
+            # A view on a shared memory slot is only valid until the next get, keep a copy if it has to wait
+            if env.seq != self._next_seq and isinstance(self._channel, SharedMemoryQueue):
+                env = rewrap(env, copy.deepcopy(env.data))
+
+            self._pending[env.seq] = (time.time(), env)
+
+    def get(self, block: bool = True, timeout: float = None) -> Any:
+        if self._reorder:
+            return self._get_ordered(block, timeout)
+        return self._unwrap(self._channel.get(block, timeout))
+
+    def get_nowait(self) -> Any:
+        return self.get(False)
+
+    def hold(self, keep: bool = True) -> None:
+        """Keep the views on shared memory of the items we get valid, see SharedMemoryQueue.hold"""
+        if hasattr(self._channel, "hold"):
+            self._channel.hold(keep)
+
+    def empty(self) -> bool:
+        if self._reorder and self._next_seq in self._pending:
+            return False
+        return self._channel.empty()
+
+    def full(self) -> bool:
+        return self._channel.full()
+
+    def qsize(self) -> int:
+        return self._channel.qsize()
+
+    def waitable(self) -> Any:
+        return waitable(self._channel)
+
+    def close(self) -> None:
+        self._channel.close()
+
+    def unlink(self) -> None:
+        if hasattr(self._channel, "unlink"):
+            self._channel.unlink()
+
+    def __str__(self):
+        return f"{self._name} ({self._policy}, {self.drops} dropped)"
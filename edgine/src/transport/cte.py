@@ -0,0 +1,9 @@
+QUEUE = "queue"
+SHM = "shm"
+MAILBOX = "mailbox"
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+COALESCE = "coalesce"
+POLICIES = [DROP_NEWEST, DROP_OLDEST, BLOCK, COALESCE]
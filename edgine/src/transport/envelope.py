@@ -0,0 +1,51 @@
+from typing import Any
+import time
+
+
+class Envelope:
+    """
+    Metadata that travels with an item between services
+
+    seq : sequence number of the item, at the input of a replicated stage it is used to put the results back in order
+    data : the payload, None means the item was consumed without producing output
+    ts : capture timestamp (time.time()) of the input this item was made from, it is kept along the whole pipeline
+    trace : trace ID of a sampled item, None if it isn't traced
+    sent : time the item was posted, only set for traced items
+    """
+    __slots__ = ["seq", "data", "ts", "trace", "sent"]
+
+    def __init__(self, seq: int, data: Any, ts: float = None, trace: int = None, sent: float = None):
+        self.seq: int = seq
+        self.data: Any = data
+        self.ts: float = time.time() if ts is None else ts
+        self.trace: int = trace
+        self.sent: float = sent
+
+    @property
+    def age(self) -> float:
+        """Time since capture, in seconds"""
+        return time.time() - self.ts
+
+    def __reduce__(self):
+        return Envelope, (self.seq, self.data, self.ts, self.trace, self.sent)
+
+    def __repr__(self):
+        return f"Envelope(seq={self.seq}, data={type(self.data).__name__}, ts={self.ts:.6f})"
+
+
+def payload(item: Any) -> Any:
+    """
+    :param item: an item as it goes through a queue
+    :return: the payload of the item, without its envelope
+    """
+    return item.data if isinstance(item, Envelope) else item
+
+
+def rewrap(item: Any, data: Any) -> Any:
+    """
+    Put another payload in the envelope of an item
+    :param item: the original item, with or without envelope
+    :param data: the new payload
+    :return: the new payload, in a copy of the envelope if the item had one
+    """
+    return Envelope(item.seq, data, item.ts, item.trace, item.sent) if isinstance(item, Envelope) else data
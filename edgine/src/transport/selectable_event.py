@@ -0,0 +1,62 @@
+from multiprocessing import Event, Pipe
+from multiprocessing.connection import Connection
+from typing import Any, List
+import multiprocessing.connection
+
+
+class SelectableEvent:
+    """
+    A multiprocessing Event that can also be waited on together with queues
+
+    Setting it writes one byte into a pipe that nobody reads,
+    so the read end stays readable in every process until the event is cleared.
+    """
+
+    def __init__(self):
+        self._event = Event()
+        self._reader, self._writer = Pipe(duplex=False)
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def set(self) -> None:
+        if not self._event.is_set():
+            self._event.set()
+            self._writer.send_bytes(b"1")
+
+    def clear(self) -> None:
+        self._event.clear()
+        while self._reader.poll():
+            self._reader.recv_bytes()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._event.wait(timeout)
+
+    def waitable(self) -> Connection:
+        return self._reader
+
+
+def waitable(obj: Any) -> Any:
+    """
+    Get the object to pass to multiprocessing.connection.wait for a queue, config or event
+    :param obj: object to wait on
+    :return: a Connection (or anything with a fileno), None if obj can't be waited on
+    """
+    if obj is None:
+        return None
+
+    if hasattr(obj, "waitable"):
+        return obj.waitable()
+
+    # Plain multiprocessing Queues become readable on their pipe
+    return getattr(obj, "_reader", None)
+
+
+def wait_any(objs: List[Any], timeout: float = None) -> List[Any]:
+    """
+    Block until at least one of the waitables is ready
+    :param objs: list of waitables, see 'waitable'
+    :param timeout: max time to block, None to block forever
+    :return: list of ready waitables
+    """
+    return multiprocessing.connection.wait(objs, timeout=timeout)
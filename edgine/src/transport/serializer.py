@@ -0,0 +1,260 @@
+from multiprocessing import Pipe, Lock, BoundedSemaphore
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, List
+import threading
+import pickle
+import struct
+import queue
+import time
+import os
+
+_COUNT = struct.Struct("!I")
+_LENGTH = struct.Struct("!Q")
+_SMALL_FRAME = 65536
+_SENTINEL = object()
+
+
+class Serializer(ABC):
+    """
+    Turns a payload into a list of frames and back
+
+    The first frame is the header, any other frames are buffers that can be written out as they are.
+    """
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> List[Any]:
+        """
+        Serialize an object
+        :param obj: object to serialize
+        :return: list of bytes-like frames
+        """
+        return []
+
+    @abstractmethod
+    def loads(self, frames: List[Any]) -> Any:
+        """
+        Deserialize an object
+        :param frames: the frames created by dumps
+        :return: the object
+        """
+        return None
+
+
+class PickleSerializer(Serializer):
+    """Plain in-band pickle, every buffer is copied into one bytes object"""
+
+    def dumps(self, obj: Any) -> List[Any]:
+        return [pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)]
+
+    def loads(self, frames: List[Any]) -> Any:
+        return pickle.loads(frames[0])
+
+
+class OutOfBandSerializer(Serializer):
+    """
+    Pickle protocol 5 with out-of-band buffers
+
+    Large buffers (like numpy arrays, also when nested in lists, dicts or user objects) are not copied
+    into the pickle, they are passed on as zero-copy memoryviews next to a small header.
+    Falls back to in-band pickle if protocol 5 is not available.
+    """
+
+    def dumps(self, obj: Any) -> List[Any]:
+        if pickle.HIGHEST_PROTOCOL < 5:
+            return [pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)]
+
+        buffers = []
+        header = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        return [header, *[b.raw() for b in buffers]]
+
+    def loads(self, frames: List[Any]) -> Any:
+        if len(frames) == 1:
+            return pickle.loads(frames[0])
+
+        return pickle.loads(frames[0], buffers=frames[1:])
+
+
+def _write_all(fd: int, data: Any) -> None:
+    view = memoryview(data).cast("B")
+    while len(view) > 0:
+        n = os.write(fd, view)
+        view = view[n:]
+
+
+def _read_into(fd: int, buf: Any) -> None:
+    view = memoryview(buf)
+    while len(view) > 0:
+        n = os.readv(fd, [view])
+        if n == 0:
+            raise EOFError
+        view = view[n:]
+
+
+class SerializedQueue:
+    """
+    A queue with a pluggable serializer
+
+    Frames are written straight from the payload's memory into a pipe by a feeder thread,
+    and read straight into a fresh bytearray on the other side,
+    so with the OutOfBandSerializer a big array is never copied into an intermediate bytes object.
+    As with a normal Queue, don't modify a payload after posting it.
+    """
+
+    def __init__(self,
+                 maxsize: int = 2,
+                 serializer: Serializer = None):
+        self._serializer: Serializer = serializer if serializer is not None else OutOfBandSerializer()
+        self._maxsize: int = maxsize
+        self._reader, self._writer = Pipe(duplex=False)
+        self._rlock = Lock()
+        self._wlock = Lock()
+        self._sem = BoundedSemaphore(maxsize)
+        self._reset()
+
+    def _reset(self) -> None:
+        """Feeder state is local to the process that posts"""
+        self._pid: int = os.getpid()
+        self._buffer: deque = deque()
+        self._notempty = threading.Condition(threading.Lock())
+        self._thread: threading.Thread = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ["_pid", "_buffer", "_notempty", "_thread"]:
+            del state[k]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    @property
+    def serializer(self) -> Serializer:
+        return self._serializer
+
+    def _start_thread(self) -> None:
+        if self._pid != os.getpid():
+            self._reset()
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._feed, name="SerializedQueueFeeder", daemon=True)
+            self._thread.start()
+
+    def _feed(self) -> None:
+        fd = self._writer.fileno()
+        while True:
+            with self._notempty:
+                while len(self._buffer) == 0:
+                    self._notempty.wait()
+                frames = self._buffer.popleft()
+
+            if frames is _SENTINEL:
+                return
+
+            # Small frames are glued to the prefix, big ones are written from their own memory
+            pending = [_COUNT.pack(len(frames)), *[_LENGTH.pack(memoryview(f).nbytes) for f in frames]]
+            with self._wlock:
+                for f in frames:
+                    if memoryview(f).nbytes < _SMALL_FRAME:
+                        pending.append(f)
+                    else:
+                        _write_all(fd, b"".join(pending))
+                        pending = []
+                        _write_all(fd, f)
+
+                if len(pending) > 0:
+                    _write_all(fd, b"".join(pending))
+
+    def _recv(self) -> List[Any]:
+        fd = self._reader.fileno()
+        count = bytearray(_COUNT.size)
+        _read_into(fd, count)
+        count = _COUNT.unpack(count)[0]
+        lengths = bytearray(_LENGTH.size * count)
+        _read_into(fd, lengths)
+
+        frames = []
+        for i in range(count):
+            frame = bytearray(_LENGTH.unpack_from(lengths, i * _LENGTH.size)[0])
+            _read_into(fd, frame)
+            frames.append(frame)
+
+        return frames
+
+    def put(self, data: Any, block: bool = True, timeout: float = None) -> None:
+        """
+        Post data, serialization happens right away, writing in the feeder thread
+        :param data: data to post
+        :param block: block until there is room in the queue
+        :param timeout: max time to block
+        :return: None, raises queue.Full if the queue stays full
+        """
+        if not self._sem.acquire(block, timeout):
+            raise queue.Full
+
+        try:
+            frames = self._serializer.dumps(data)
+        except Exception:
+            self._sem.release()
+            raise
+
+        self._start_thread()
+        with self._notempty:
+            self._buffer.append(frames)
+            self._notempty.notify()
+
+    def put_nowait(self, data: Any) -> None:
+        self.put(data, False)
+
+    def get(self, block: bool = True, timeout: float = None) -> Any:
+        """
+        Get the next item
+        :param block: block until an item is available
+        :param timeout: max time to block
+        :return: the item
+        """
+        if not block:
+            timeout = 0.0
+
+        deadline = None if timeout is None else time.time() + timeout
+        if not self._rlock.acquire(True, timeout):
+            raise queue.Empty
+
+        try:
+            remaining = None if deadline is None else max(0.0, deadline - time.time())
+            if not self._reader.poll(remaining):
+                raise queue.Empty
+            frames = self._recv()
+        finally:
+            self._rlock.release()
+
+        self._sem.release()
+        return self._serializer.loads(frames)
+
+    def get_nowait(self) -> Any:
+        return self.get(False)
+
+    def empty(self) -> bool:
+        return not self._reader.poll()
+
+    def full(self) -> bool:
+        if self._sem.acquire(False):
+            self._sem.release()
+            return False
+        return True
+
+    def qsize(self) -> int:
+        return self._maxsize - self._sem.get_value()
+
+    def waitable(self) -> Any:
+        return self._reader
+
+    def close(self) -> None:
+        """Flush what is still pending and stop the feeder thread of this process"""
+        if self._thread is not None and self._pid == os.getpid():
+            with self._notempty:
+                self._buffer.append(_SENTINEL)
+                self._notempty.notify()
+            self._thread.join(timeout=1)
+            self._thread = None
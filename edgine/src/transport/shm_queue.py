@@ -0,0 +1,382 @@
+from multiprocessing import Queue, Array
+from ctypes import c_int32
+from collections import namedtuple
+from typing import Any, List
+from edgine.src.transport.selectable_event import waitable
+from edgine.src.transport.envelope import payload, rewrap
+from edgine.src.transport.cte import DROP_NEWEST, DROP_OLDEST, BLOCK
+import queue
+import time
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    SharedMemory = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# This is the only thing that goes through the control queue for an array payload
+SlotDescriptor = namedtuple("SlotDescriptor", ["slot", "shape", "dtype"])
+
+
+class SharedMemoryRing:
+    """
+    A ring of preallocated shared memory slots
+
+    Every slot can hold one numpy array of at most slot_size bytes.
+    A refcount per slot keeps track of the readers that still need it,
+    a slot is only reused once that count is back to 0.
+    """
+
+    def __init__(self,
+                 slot_size: int,
+                 slots: int = 4):
+        if SharedMemory is None or np is None:
+            raise RuntimeError("SharedMemoryRing needs python >= 3.8 and numpy")
+
+        if slot_size <= 0 or slots <= 0:
+            raise ValueError(f"Invalid ring dimensions : slot_size={slot_size}, slots={slots}")
+
+        self._slot_size: int = slot_size
+        self._slots: int = slots
+        self._shm: SharedMemory = SharedMemory(create=True, size=slot_size * slots)
+        self._refs = Array(c_int32, slots)
+        self._next: int = 0
+
+    @property
+    def slot_size(self) -> int:
+        return self._slot_size
+
+    @property
+    def slots(self) -> int:
+        return self._slots
+
+    def fits(self, data: Any) -> bool:
+        """
+        Check if data can be stored in a slot of this ring
+        :param data: data to check
+        :return: True if data is a plain numpy array that fits in a slot
+        """
+        return isinstance(data, np.ndarray) and not data.dtype.hasobject and data.nbytes <= self._slot_size
+
+    def holds(self, data: Any) -> bool:
+        """
+        Check if data is a view on a slot of this ring, it is only valid as long as the slot isn't released
+        :param data: data to check
+        :return: True if data is a numpy array in the memory of this ring
+        """
+        if np is None or not isinstance(data, np.ndarray):
+            return False
+        start = np.frombuffer(self._shm.buf, dtype=np.uint8).ctypes.data
+        return start <= data.__array_interface__["data"][0] < start + self._slot_size * self._slots
+
+    def free_slots(self) -> int:
+        """
+        Count the slots that are not in use
+        :return: number of free slots
+        """
+        with self._refs.get_lock():
+            return sum(1 for r in self._refs if r == 0)
+
+    def write(self, data: Any, readers: int = 1) -> int:
+        """
+        Copy an array into the next free slot
+        :param data: numpy array to copy, check with 'fits' first
+        :param readers: number of readers that will release this slot
+        :return: the slot index, or -1 if no slot is free
+        """
+        with self._refs.get_lock():
+            for i in range(self._slots):
+                slot = (self._next + i) % self._slots
+                if self._refs[slot] == 0:
+                    self._refs[slot] = readers
+                    break
+            else:
+                return -1
+
+        self._next = (slot + 1) % self._slots
+        dst = np.ndarray(data.shape, dtype=data.dtype, buffer=self._shm.buf, offset=slot * self._slot_size)
+        np.copyto(dst, data, casting='no')
+        return slot
+
+    def view(self, desc: SlotDescriptor) -> Any:
+        """
+        Create a read-only array on top of a slot, without copying
+        :param desc: descriptor of the slot
+        :return: read-only numpy array
+        """
+        out = np.ndarray(desc.shape,
+                         dtype=np.dtype(desc.dtype),
+                         buffer=self._shm.buf,
+                         offset=desc.slot * self._slot_size)
+        out.flags.writeable = False
+        return out
+
+    def release(self, slot: int) -> None:
+        """
+        Release a slot for one reader
+        :param slot: slot index
+        :return: None
+        """
+        with self._refs.get_lock():
+            if self._refs[slot] > 0:
+                self._refs[slot] -= 1
+
+    def close(self) -> None:
+        """Close this process' mapping of the ring"""
+        try:
+            self._shm.close()
+        except BufferError:
+            # There are still views alive in this process, the mapping dies with them
+            pass
+
+    def unlink(self) -> None:
+        """Destroy the shared memory block, only the owner should call this"""
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedMemoryQueue:
+    """
+    A queue that moves numpy arrays through a ring of shared memory slots
+
+    Arrays that fit in a slot are copied once into shared memory,
+    only a small SlotDescriptor goes through the control queue.
+    The consumer gets a read-only view on the slot, which stays valid until its next get,
+    copy it if you need to keep it longer than that, or hold the slots while collecting several items.
+    Anything else just goes through the control queue like it would through a normal Queue.
+    """
+
+    def __init__(self,
+                 slot_size: int = 0,
+                 slots: int = 4,
+                 maxsize: int = 2,
+                 ring: SharedMemoryRing = None):
+        self._ring: SharedMemoryRing = ring if ring is not None else SharedMemoryRing(slot_size=slot_size,
+                                                                                        slots=slots)
+        self._q: Queue = Queue(maxsize=maxsize)
+        self._held: List[int] = []
+        self._holding: bool = False
+
+    @property
+    def ring(self) -> SharedMemoryRing:
+        return self._ring
+
+    def _release_held(self) -> None:
+        for slot in self._held:
+            self._ring.release(slot)
+        self._held = []
+
+    def hold(self, keep: bool = True) -> None:
+        """
+        Keep the views of several items valid, e.g. while collecting a batch
+        :param keep: while set, get doesn't release the slot of the previous items,
+                     once unset, the next get releases all of them
+        :return: None
+        """
+        self._holding = keep
+
+    def put_nowait(self, data: Any) -> None:
+        """
+        Post data without blocking
+        A SlotDescriptor is posted as it is, the caller already holds a claim on that slot for this reader
+        and keeps it if this raises queue.Full. Payloads in an Envelope keep their envelope.
+        :param data: data to post
+        :return: None, raises queue.Full if there is no room in the queue or the ring
+        """
+        arr = payload(data)
+        if isinstance(arr, SlotDescriptor):
+            self._q.put_nowait(data)
+            return
+
+        if self._q.full():
+            raise queue.Full
+
+        if self._ring.fits(arr):
+            slot = self._ring.write(arr)
+            if slot < 0:
+                raise queue.Full
+
+            try:
+                self._q.put_nowait(rewrap(data, SlotDescriptor(slot, arr.shape, arr.dtype.str)))
+            except queue.Full:
+                self._ring.release(slot)
+                raise
+        else:
+            self._q.put_nowait(data)
+
+    def put(self, data: Any, block: bool = True, timeout: float = None) -> None:
+        """
+        Post data, waiting for room in the queue and the ring
+        :param data: data to post
+        :param block: wait for room
+        :param timeout: max time to wait
+        :return: None, raises queue.Full if there is no room in time
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            try:
+                return self.put_nowait(data)
+            except queue.Full:
+                if not block or (deadline is not None and time.time() > deadline):
+                    raise
+                time.sleep(0.0005)
+
+    def discard(self, timeout: float = 0.0) -> None:
+        """
+        Throw away the oldest item, from the producer side
+        :param timeout: max time to wait for an item to arrive
+        :return: None, raises queue.Empty if there is nothing to throw away
+        """
+        desc = payload(self._q.get(True, timeout))
+        if isinstance(desc, SlotDescriptor):
+            self._ring.release(desc.slot)
+
+    def get(self, block: bool = True, timeout: float = None) -> Any:
+        """
+        Get the next item, this releases the slot of the previous item unless we hold them
+        :param block: block until an item is available
+        :param timeout: max time to block
+        :return: the item, arrays are returned as read-only views
+        """
+        if not self._holding:
+            self._release_held()
+        item = self._q.get(block, timeout)
+        desc = payload(item)
+
+        if isinstance(desc, SlotDescriptor):
+            self._held.append(desc.slot)
+            return rewrap(item, self._ring.view(desc))
+
+        return item
+
+    def get_nowait(self) -> Any:
+        return self.get(False)
+
+    def empty(self) -> bool:
+        return self._q.empty()
+
+    def full(self) -> bool:
+        return self._q.full() or self._ring.free_slots() == 0
+
+    def qsize(self) -> int:
+        return self._q.qsize()
+
+    def waitable(self) -> Any:
+        return waitable(self._q)
+
+    def close(self) -> None:
+        self._release_held()
+        self._q.close()
+        self._ring.close()
+
+    def unlink(self) -> None:
+        self._ring.unlink()
+
+
+class BroadcastQueue:
+    """
+    Producer side of a set of SharedMemoryQueues that share one ring
+
+    An array is written once into the ring with a refcount equal to the number of consumers it is posted to,
+    every consumer gets a descriptor of that same slot. The slot is recycled when the last one is done with it.
+    This is only meant to post, consumers keep reading from their own SharedMemoryQueue.
+    When the ring is full, a member with the BLOCK policy makes the producer wait up to its block_timeout for a slot.
+    """
+
+    def __init__(self, members: List[Any]):
+        if len(members) == 0:
+            raise ValueError("A BroadcastQueue needs at least one member")
+
+        # Members can be wrapped in a Connection, which gives them a backpressure policy
+        self._ring: SharedMemoryRing = getattr(members[0], "channel", members[0]).ring
+        for m in members:
+            if getattr(m, "channel", m).ring is not self._ring:
+                raise ValueError("All members of a BroadcastQueue must share the same ring")
+
+        self._members: List[Any] = members
+        # Longest wait for a free slot that a member asks for
+        self._block_timeout: float = max([m.block_timeout for m in members
+                                          if getattr(m, "policy", DROP_NEWEST) == BLOCK], default=0.0)
+
+    @property
+    def members(self) -> List[Any]:
+        return self._members
+
+    @property
+    def drops(self) -> int:
+        return sum(getattr(m, "drops", 0) for m in self._members)
+
+    def _drop_all(self) -> None:
+        for m in self._members:
+            if hasattr(m, "add_drop"):
+                m.add_drop()
+
+    def _make_room(self) -> bool:
+        """Let the members that prefer fresh data throw away their oldest item to free a slot"""
+        freed = False
+        for m in self._members:
+            if getattr(m, "policy", DROP_NEWEST) == DROP_OLDEST:
+                try:
+                    m.discard()
+                    freed = True
+                except queue.Empty:
+                    pass
+
+        return freed
+
+    @staticmethod
+    def _post(member: Any, data: Any) -> bool:
+        try:
+            return member.put_nowait(data) is not False
+        except queue.Full:
+            return False
+
+    def put_nowait(self, data: Any) -> None:
+        """
+        Post data to every member, what happens when a member is full depends on its policy,
+        a plain SharedMemoryQueue just misses this item.
+        :param data: data to post
+        :return: None, raises queue.Full if there is no free slot in the ring
+        """
+        # Don't bother copying if nobody will take it
+        if all(m.full() and getattr(m, "policy", DROP_NEWEST) == DROP_NEWEST for m in self._members):
+            self._drop_all()
+            raise queue.Full
+
+        arr = payload(data)
+        if self._ring.fits(arr):
+            slot = self._ring.write(arr, readers=len(self._members))
+            if slot < 0 and self._make_room():
+                slot = self._ring.write(arr, readers=len(self._members))
+
+            if slot < 0 and self._block_timeout > 0:
+                deadline = time.time() + self._block_timeout
+                while slot < 0 and time.time() < deadline:
+                    time.sleep(0.0005)
+                    slot = self._ring.write(arr, readers=len(self._members))
+
+            if slot < 0:
+                self._drop_all()
+                raise queue.Full
+
+            desc = rewrap(data, SlotDescriptor(slot, arr.shape, arr.dtype.str))
+            for m in self._members:
+                if not self._post(m, desc):
+                    self._ring.release(slot)
+        else:
+            for m in self._members:
+                self._post(m, data)
+
+    def full(self) -> bool:
+        return self._ring.free_slots() == 0 or all(m.full() for m in self._members)
+
+    def close(self) -> None:
+        for m in self._members:
+            m.close()
@@ -1,6 +1,7 @@
 from edgine.src.config.config_server import ConfigServer
 from edgine.src.base import EdgineBase
 from edgine.src.starter import EdgineStarter
+from edgine.src.transport.cte import BLOCK
 from typing import Any
 import pyaudio
 import numpy as np
@@ -238,7 +239,8 @@ if __name__ == "__main__":
     classifier_id = starter.reg_service(Classify, min_runtime=1)
     print_random_id = starter.reg_service(PrintRandom, min_runtime=10)
 
-    starter.reg_connection(getter_id, combiner_id)
+    # Every audio chunk counts, the microphone waits for the combiner instead of losing chunks
+    starter.reg_connection(getter_id, combiner_id, policy=BLOCK, capacity=8)
     starter.reg_connection(combiner_id, normaliser_id)
     starter.reg_connection(normaliser_id, feature_id)
     starter.reg_connection(feature_id, classifier_id)
@@ -1,6 +1,7 @@
 from edgine.src.config.config_server import ConfigServer
 from edgine.src.base import EdgineBase
 from edgine.src.starter import EdgineStarter
+from edgine.src.transport.cte import MAILBOX
 from typing import Any, List
 import cv2
 import numpy as np
@@ -281,8 +282,8 @@ if __name__ == "__main__":
     starter.reg_connection(drawer_id, video_exposer_id)
     starter.reg_connection(cropper_id, fail_exposer_id)
 
-    starter.reg_secondary_connection(detect_id, drawer_id)
-    starter.reg_secondary_connection(detect_id, cropper_id)
+    starter.reg_secondary_connection(detect_id, drawer_id, transport=MAILBOX)
+    starter.reg_secondary_connection(detect_id, cropper_id, transport=MAILBOX)
 
     # q3 = starter.reg_sink(drawer_id)
 
@@ -327,6 +328,9 @@ if __name__ == "__main__":
         # fps = 0.8 * fps + 0.2 * (1.0 / el)
         time.sleep(1)
 
+        # Per stage FPS, read straight from shared memory
+        print(" | ".join(f"{name}: {m['out_rate']:.1f}FPS" for name, m in starter.metrics().items()))
+
     cv2.destroyAllWindows()
 
     print("All done!")
@@ -4,12 +4,117 @@
 
 
 import unittest
-from multiprocessing import Queue, Event
+from multiprocessing import Queue, Event, Process
 # import multiprocessing
 from edgine.src.config.config import Config
 from edgine.src.config.config_server import ConfigServer
+from edgine.src.config.shared_config import SharedConfigLog
+from edgine.src.config.file_watcher import FileWatcher
+from edgine.src.config.schema import ConfigField
+from edgine.src.transport.shm_queue import SharedMemoryQueue, SharedMemoryRing, BroadcastQueue
+from edgine.src.transport.serializer import SerializedQueue, OutOfBandSerializer, PickleSerializer
+from edgine.src.transport.mailbox import SharedMemoryMailbox
+from edgine.src.transport.selectable_event import SelectableEvent, wait_any
+from edgine.src.transport.connection import Connection
+from edgine.src.transport.cte import DROP_NEWEST, DROP_OLDEST, BLOCK, COALESCE
+from edgine.src.transport.envelope import Envelope, payload
+from edgine.src.tracing.trace_buffer import TraceBuffer
+from edgine.src.tracing.flight_recorder import FlightRecorder, RECORD_MSG_SIZE
+from edgine.src.starter import EdgineStarter
+from edgine.src.logger.cte import TRACE, ERROR, INFO, DEBUG
+from edgine.src.logger.edgine_logger import EdgineLogger
+from edgine.src.logger.sinks import LogSink, FileSink, BinarySink, decode
+from edgine.src.metrics.metrics_table import MetricsTable
+from edgine.src.metrics.histogram import LatencyHistogram
+from edgine.src.benchmark.runner import run_benchmark
+from edgine.src.metrics.metrics_server import MetricsServer
+from edgine.src.metrics.prometheus import format_metric
+from edgine.src.base import EdgineBase
+import threading
+import signal
+import json
+import urllib.request
+import urllib.error
+import tempfile
+import pstats
 import time
 import os
+import queue
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Plus6(EdgineBase):
+    """Minimal service for the tests"""
+
+    def __init__(self, **kwargs):
+        EdgineBase.__init__(self, name="PLUS6", **kwargs)
+
+    def blogic(self, data_in=None):
+        return EdgineBase.blogic(self, data_in)
+
+
+class Chatty(EdgineBase):
+    """Source that logs a lot"""
+
+    def __init__(self, **kwargs):
+        EdgineBase.__init__(self, name="CHATTY", **kwargs)
+        self.count = 0
+
+    def blogic(self, data_in=None):
+        self.count += 1
+        for i in range(10):
+            self.debug("loop %d message %d", self.count, i)
+        return None
+
+
+class Crash(EdgineBase):
+    """Source that fails after a few loops"""
+
+    def __init__(self, **kwargs):
+        EdgineBase.__init__(self, name="CRASH", **kwargs)
+        self.count = 0
+
+    def blogic(self, data_in=None):
+        self.count += 1
+        self.debug("loop %d", self.count)
+        if self.count == 20:
+            raise RuntimeError("crash")
+        return None
+
+
+class Counter(EdgineBase):
+    """Source that counts its loops"""
+
+    def __init__(self, **kwargs):
+        EdgineBase.__init__(self, name="COUNTER", **kwargs)
+        self.count = 0
+
+    def blogic(self, data_in=None):
+        self.count += 1
+        return self.count
+
+
+class BatchSize(EdgineBase):
+    """Service that tells the size of the batch every item was in"""
+
+    def __init__(self, **kwargs):
+        EdgineBase.__init__(self, name="BATCH", **kwargs)
+
+    def blogic(self, data_in=None):
+        return data_in
+
+    def blogic_batch(self, batch):
+        return [(len(batch), d) for d in batch]
+
+
+def post_all(conn, items):
+    """Producer process for the tests"""
+    for item in items:
+        conn.put_nowait(item)
 
 
 class TestEdgine(unittest.TestCase):
@@ -68,5 +173,1116 @@ class TestEdgine(unittest.TestCase):
         cs = ConfigServer(stop_event=fake_stop, name="test-cs", config_file="config.json", logging_q=fake_log_q)
         cs.config.test_005 = "saveconfig"
         cs.save_config()
+        cs.flush_config()
         cs2 = ConfigServer(stop_event=fake_stop, name="test-cs2", config_file="config.json", logging_q=fake_log_q)
         assert(cs2.config.test_005 == cs.config.test_005)
+
+    @unittest.skipIf(np is None, "numpy not available")
+    def test_006_shm_queue_roundtrip(self):
+        """Test if arrays come out of the shared memory queue as equal read-only views"""
+        q = SharedMemoryQueue(slot_size=1024, slots=2, maxsize=2)
+        try:
+            arr = np.arange(100, dtype=np.int32)
+            q.put_nowait(arr)
+            out = q.get(timeout=1)
+            assert(np.array_equal(out, arr))
+            assert(not out.flags.writeable)
+            q.put_nowait("not an array")
+            assert(q.get(timeout=1) == "not an array")
+        finally:
+            q.close()
+            q.unlink()
+
+    @unittest.skipIf(np is None, "numpy not available")
+    def test_007_shm_queue_slot_reuse(self):
+        """Test if slots are only reused after the consumer is done with them"""
+        q = SharedMemoryQueue(slot_size=64, slots=1, maxsize=2)
+        try:
+            q.put_nowait(np.zeros(4))
+            self.assertRaises(queue.Full, q.put_nowait, np.ones(4))
+            first = q.get(timeout=1)
+            assert(first[0] == 0)
+            self.assertRaises(queue.Full, q.put_nowait, np.ones(4))
+            self.assertRaises(queue.Empty, q.get_nowait)
+            q.put_nowait(np.ones(4))
+            second = q.get(timeout=1)
+            assert(second[0] == 1)
+        finally:
+            q.close()
+            q.unlink()
+
+    @unittest.skipIf(np is None, "numpy not available")
+    def test_008_broadcast_single_copy(self):
+        """Test if a broadcast writes one slot and only recycles it after every reader is done"""
+        ring = SharedMemoryRing(slot_size=64, slots=1)
+        members = [SharedMemoryQueue(ring=ring, maxsize=2) for _ in range(3)]
+        bq = BroadcastQueue(members)
+        try:
+            bq.put_nowait(np.arange(4))
+            assert(ring.free_slots() == 0)
+            outs = [m.get(timeout=1) for m in members]
+            assert(all(np.array_equal(o, np.arange(4)) for o in outs))
+            self.assertRaises(queue.Empty, members[0].get_nowait)
+            self.assertRaises(queue.Empty, members[1].get_nowait)
+            assert(ring.free_slots() == 0)
+            self.assertRaises(queue.Empty, members[2].get_nowait)
+            assert(ring.free_slots() == 1)
+        finally:
+            bq.close()
+            ring.unlink()
+
+    @unittest.skipIf(np is None, "numpy not available")
+    def test_009_serialized_queue_out_of_band(self):
+        """Test if nested arrays survive the out-of-band serializer without being copied into the header"""
+        payload = {"frame": np.arange(100000, dtype=np.uint8), "heads": [np.ones((10, 10)), "hot"]}
+        frames = OutOfBandSerializer().dumps(payload)
+        assert(len(frames) == 3)
+        assert(len(frames[0]) < 1000)
+        assert(len(PickleSerializer().dumps(payload)[0]) > 100000)
+
+        q = SerializedQueue(maxsize=1)
+        q.put_nowait(payload)
+        self.assertRaises(queue.Full, q.put_nowait, payload)
+        out = q.get(timeout=1)
+        q.close()
+        assert(np.array_equal(out["frame"], payload["frame"]))
+        assert(np.array_equal(out["heads"][0], payload["heads"][0]))
+        assert(out["heads"][1] == "hot")
+        assert(out["frame"].flags.writeable)
+        assert(q.empty())
+
+    def test_010_mailbox_latest_value(self):
+        """Test if a mailbox only hands out the latest value, and only once"""
+        mb = SharedMemoryMailbox(size=1024)
+        try:
+            assert(mb.empty())
+            self.assertRaises(queue.Empty, mb.get_nowait)
+            for i in range(5):
+                mb.put_nowait([i, "bbox"])
+            assert(not mb.empty())
+            assert(mb.get_nowait() == [4, "bbox"])
+            assert(mb.empty())
+            self.assertRaises(queue.Empty, mb.get_nowait)
+            mb.put_nowait("newer")
+            assert(mb.get(timeout=1) == "newer")
+            self.assertRaises(ValueError, mb.put_nowait, "x" * 2048)
+        finally:
+            mb.close()
+            mb.unlink()
+
+    def test_011_event_driven_wakeup(self):
+        """Test if an event driven service wakes up on input and on stop, and not before"""
+        stop = SelectableEvent()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        in_q = Queue()
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, data_in=in_q,
+                        secondary_data_in_list=[], event_driven=True)
+        assert(service.wait_for_event(timeout=0.05) is False)
+        in_q.put(1)
+        assert(service.wait_for_event(timeout=1) is True)
+        assert(service.get_from_q(timeout=0) == 1)
+        s = time.time()
+        stop.set()
+        assert(service.wait_for_event(timeout=1) is False)
+        assert(time.time() - s < 0.5)
+
+    def test_012_backpressure_policies(self):
+        """Test if every backpressure policy handles a full connection the way it should, and counts the drops"""
+        def fill(policy, items, **kwargs):
+            conn = Connection(Queue(maxsize=2), policy=policy, capacity=2, **kwargs)
+            for item in items:
+                conn.put_nowait(item)
+            time.sleep(0.1)
+            out = []
+            while True:
+                try:
+                    out.append(conn.get(timeout=0.1))
+                except queue.Empty:
+                    return out, conn.drops
+
+        assert(fill(DROP_NEWEST, [1, 2, 3, 4]) == ([1, 2], 2))
+        assert(fill(DROP_OLDEST, [1, 2, 3, 4]) == ([3, 4], 2))
+        assert(fill(COALESCE, [[1], [2], [3]]) == ([[1, 2, 3]], 0))
+        s = time.time()
+        assert(fill(BLOCK, [1, 2, 3], block_timeout=0.2) == ([1, 2], 1))
+        assert(time.time() - s >= 0.2)
+
+    def test_013_ordered_replicas(self):
+        """Test if the results of replicas are handed out in input order, skipping the missing ones"""
+        seq_in = Connection(Queue(maxsize=8), capacity=8, sequence=True)
+        for item in ["a", "b", "c", "d", "e"]:
+            seq_in.put_nowait(item)
+        envs = []
+        for i in range(5):
+            assert(seq_in.get(timeout=1) == ["a", "b", "c", "d", "e"][i])
+            envs.append(seq_in.last_envelope)
+        assert([env.seq for env in envs] == [0, 1, 2, 3, 4])
+
+        # Replicas finish in any order, seq 2 produced nothing and seq 4 is lost
+        out = Connection(Queue(maxsize=8), capacity=8, reorder=True, reorder_window=8, reorder_timeout=0.2)
+        for seq, data in [(1, "B"), (2, None), (3, "D"), (0, "A")]:
+            out.put_nowait(Envelope(seq, data))
+        assert([out.get(timeout=1) for i in range(3)] == ["A", "B", "D"])
+        out.put_nowait(Envelope(5, "F"))
+        s = time.time()
+        assert(out.get(timeout=1) == "F")
+        assert(time.time() - s >= 0.15)
+        out.put_nowait(Envelope(4, "E"))
+        self.assertRaises(queue.Empty, out.get, True, 0.3)
+        assert(out.drops == 1)
+
+    def test_014_micro_batching(self):
+        """Test if batching mode collects batches up to the configured size and wait, and splits the results"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        in_q = Queue()
+        out_q = Connection(Queue())
+        service = BatchSize(stop_event=stop, config_server=cs, logging_q=fake_log_q, data_in=in_q,
+                            data_out_list=[out_q], secondary_data_in_list=[], min_runtime=0.0,
+                            batching=True, batch_size=4, batch_wait_ms=100)
+        for i in range(5):
+            in_q.put(i)
+        time.sleep(0.1)
+        t = threading.Thread(target=service.run)
+        t.start()
+        try:
+            assert([out_q.get(timeout=1) for i in range(5)] == [(4, 0), (4, 1), (4, 2), (4, 3), (1, 4)])
+
+            # Change the batch size on the fly
+            cs.update_children(["BATCH_batch_size", 2])
+            time.sleep(0.2)
+            for i in range(3):
+                in_q.put(i)
+            assert([out_q.get(timeout=1) for i in range(3)] == [(2, 0), (2, 1), (1, 2)])
+        finally:
+            stop.set()
+            t.join(timeout=2)
+
+    def test_015_max_age(self):
+        """Test if outputs keep the capture time of their input, and if items older than max_age are dropped"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        in_q = Connection(Queue())
+        out_q = Connection(Queue())
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, data_in=in_q,
+                        data_out_list=[out_q], secondary_data_in_list=[], max_age=0.1)
+        ts = time.time()
+        in_q.put_nowait(Envelope(0, 1, ts - 1.0))
+        in_q.put_nowait(Envelope(1, 2, ts))
+        time.sleep(0.05)
+        assert(service.get_from_q(timeout=1) == 2)
+        assert(service.stale_drops == 1)
+        service.post_to_qs(8)
+        assert(out_q.get(timeout=1) == 8)
+        assert(out_q.last_envelope.ts == ts)
+
+    def test_016_tracing(self):
+        """Test if a sampled item keeps its trace ID through a service, and if the hops end up in the trace file"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        cs.create_if_unknown("trace_sample_rate", 1.0)
+        conn = Connection(Queue())
+        out_q = Connection(Queue())
+        source = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, secondary_data_in_list=[],
+                       data_out_list=[conn])
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, data_in=conn,
+                        data_out_list=[out_q], secondary_data_in_list=[])
+        source.post_to_qs(1)
+        assert(service.get_from_q(timeout=1) == 1)
+        trace_id = conn.last_envelope.trace
+        assert(trace_id is not None)
+        s = time.time()
+        service.trace_blogic([conn.last_envelope], s, s + 0.01)
+        service.post_to_qs(7)
+        assert(out_q.get(timeout=1) == 7)
+        assert(out_q.last_envelope.trace == trace_id)
+
+        buffer = TraceBuffer()
+        for svc in [source, service]:
+            svc.flush_traces(force=True)
+        # The queue can look empty while the messages are still on their way through the pipe
+        while True:
+            try:
+                msg = fake_log_q.get(timeout=0.2)
+            except queue.Empty:
+                break
+            for level, [sender, msg, *ts] in msg.items():
+                if level == TRACE:
+                    buffer.add(sender, msg)
+        assert(buffer.dump("trace_test.json"))
+        with open("trace_test.json") as f:
+            events = json.load(f)["traceEvents"]
+        os.remove("trace_test.json")
+        assert(sorted(e["name"] for e in events if e.get("args", {}).get("trace_id") == trace_id) == ["blogic", "wait"])
+        assert(len([e for e in events if e["ph"] in ["s", "f"] and e["id"] == trace_id]) == 3)
+
+    def test_017_metrics_table(self):
+        """Test if a running service publishes its metrics to a shared memory table the parent can read"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        table = MetricsTable(rows=2)
+        table.set_name(1, "PLUS6")
+        in_q = Connection(Queue(maxsize=100), capacity=100)
+        out_q = Connection(Queue(maxsize=100), capacity=100)
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, data_in=in_q,
+                        data_out_list=[out_q], secondary_data_in_list=[], metrics=table, metrics_row=1)
+        service.start()
+        try:
+            for i in range(10):
+                in_q.put_nowait(i)
+            assert([out_q.get(timeout=1) for i in range(10)] == list(range(6, 16)))
+            time.sleep(0.6)
+            m = table.snapshot()["PLUS6"]
+            assert(m["items_in"] == 10 and m["items_out"] == 10)
+            assert(m["loop_rate"] > 0 and m["blogic_p99"] > 0 and m["updated"] > 0)
+            assert(table.read(0)["updated"] == 0)
+        finally:
+            stop.set()
+            service.join(timeout=2)
+
+    def test_018_metrics_server(self):
+        """Test if the metrics server serves Prometheus text on /metrics and the liveness on /health"""
+        text = format_metric("edgine_items_in_total", "counter", "Input items", [({"service": "DET"}, 12)])
+        assert(text == "# HELP edgine_items_in_total Input items\n"
+                       "# TYPE edgine_items_in_total counter\n"
+                       "edgine_items_in_total{service=\"DET\"} 12.0\n")
+        alive = [True]
+        server = MetricsServer(collect=lambda: text,
+                               health=lambda: (200, "ok\n") if alive[0] else (503, "failing\n"),
+                               port=0)
+        server.start()
+        try:
+            url = f"http://127.0.0.1:{server.port}"
+            with urllib.request.urlopen(f"{url}/metrics", timeout=2) as r:
+                assert(r.read().decode() == text)
+            with urllib.request.urlopen(f"{url}/health", timeout=2) as r:
+                assert(r.status == 200)
+            alive[0] = False
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                urllib.request.urlopen(f"{url}/health", timeout=2)
+            assert(cm.exception.code == 503)
+        finally:
+            server.stop()
+
+    def test_019_latency_histogram(self):
+        """Test if the latency histogram finds the quantiles within its bucket precision, and starts over"""
+        h = LatencyHistogram()
+        for i in range(980):
+            h.record(0.020)
+        for i in range(20):
+            h.record(0.400)
+        assert(h.count == 1000 and h.max == 0.400)
+        assert(0.020 <= h.quantile(0.5) <= 0.020 * 2 ** (1 / 8))
+        assert(0.020 <= h.quantile(0.95) <= 0.020 * 2 ** (1 / 8))
+        assert(h.quantile(0.99) == 0.400)
+        h.record(1000.0)
+        assert(h.quantile(1.0) == 1000.0)
+        h.reset()
+        assert(h.count == 0 and h.quantile(0.99) == 0.0)
+
+    def test_020_benchmark(self):
+        """Test if a short benchmark run moves items through a synthetic pipeline and reports on it"""
+        result = run_benchmark(topology="chain", payload="scalar", stages=1, duration=1.0)
+        assert(result["items"] > 0 and result["items_per_s"] > 0)
+        assert(0 < result["latency_ms"]["p50"] <= result["latency_ms"]["p99"] <= result["latency_ms"]["max"])
+        assert(set(result["cpu_s"].keys()) == {"BenchSource[0]", "BenchRelay[1]"})
+        assert(result["bytes_copied"] > 0)
+        json.dumps(result)
+
+    def test_021_profiling_toggle(self):
+        """Test if setting profile_<name> in the config profiles a service for that long, then writes the profile"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        in_q = Queue()
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, data_in=in_q,
+                        data_out_list=[], secondary_data_in_list=[], min_runtime=0.01)
+        assert(cs.config.has_key("profile_PLUS6"))
+        with tempfile.TemporaryDirectory() as profile_dir:
+            t = threading.Thread(target=service.run)
+            t.start()
+            try:
+                time.sleep(0.1)
+                assert(service._profiler is None)
+                cs.update_children(["profile_dir", profile_dir])
+                cs.update_children(["profile_PLUS6", 0.3])
+                time.sleep(0.1)
+                assert(service._profiler is not None)
+                time.sleep(0.5)
+                assert(service._profiler is None)
+                files = os.listdir(profile_dir)
+                assert(len(files) == 1 and files[0].startswith("PLUS6_"))
+                pstats.Stats(os.path.join(profile_dir, files[0]))
+            finally:
+                stop.set()
+                t.join(timeout=2)
+
+    def test_022_shared_config_log(self):
+        """Test if config copies follow the shared log, also across a compaction of the log"""
+        fake_log_q = Queue()
+        cs = ConfigServer(name="test-cs", logging_q=fake_log_q, shared_size=512)
+        cs.config.test_022 = "before"
+        config = cs.get_config_copy()
+        assert(config.update() is False)
+        cs.update_children({"test_022": "after", "other": 1})
+        assert(config.update() is True)
+        assert(config.test_022 == "after" and config.other == 1)
+        assert(config.update() is False)
+
+        # Fill the log until it gets compacted, a copy that lags behind still gets the latest values
+        for i in range(100):
+            cs.update_children(["counter", i])
+        assert(config.update() is True)
+        assert(config.counter == 99 and config.test_022 == "after")
+
+        log = SharedConfigLog(size=64)
+        self.assertRaises(ValueError, log.append, {"big": "x" * 100})
+
+    def test_023_immediate_config_propagation(self):
+        """Test if master config changes reach the copies right away, a batch as one update"""
+        fake_log_q = Queue()
+        cs = ConfigServer(name="test-cs", logging_q=fake_log_q)
+        config = cs.get_config_copy()
+        assert(wait_any([config.waitable()], timeout=0.0) == [])
+
+        # No server tick needed, setting a key on the master is enough
+        cs.config.test_023 = 1
+        assert(wait_any([config.waitable()], timeout=0.1) == [config.waitable()])
+        assert(config.update() is True and config.test_023 == 1)
+        assert(wait_any([config.waitable()], timeout=0.0) == [])
+
+        # A copy never sees half of a batch
+        version = config._shared_version
+        with cs.batch():
+            cs.config.test_023 = 2
+            cs.config.other_023 = 2
+            assert(config.update() is False)
+        assert(config.update() is True)
+        assert(config.test_023 == 2 and config.other_023 == 2)
+        assert(config._shared_version == version + 2)
+        assert(wait_any([config.waitable()], timeout=0.0) == [])
+
+        # A wakeup for a change we already read only wakes us up until it is drained
+        cs.config.test_023 = 3
+        assert(config.update() is True and config.test_023 == 3)
+        os.write(cs._shared._wakeups[-1], b"\0")
+        assert(config.update() is False)
+        assert(wait_any([config.waitable()], timeout=0.0) == [config.waitable()])
+        config.drain()
+        assert(wait_any([config.waitable()], timeout=0.0) == [])
+
+        wakeup = config.waitable()
+        config.close()
+        cs.close()
+        assert(config.waitable() is None)
+        self.assertRaises(OSError, os.fstat, wakeup)
+
+    def test_024_config_hot_reload(self):
+        """Test if edits of the config file reach the copies while the server runs, and only the changed keys"""
+        fake_log_q = Queue()
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "cfg.json")
+            cs = ConfigServer(name="test-cs", logging_q=fake_log_q, config_file=path)
+            cs.config.resize_target = (320, 320)
+            cs.config.top_k = 10
+            cs.save_config()
+            cs.flush_config()
+            config = cs.get_config_copy()
+
+            watcher = FileWatcher(path, poll_period=0.05)
+            assert(watcher.changed(timeout=0.05) is False)
+
+            # Editors often save by replacing the file
+            with open(path, 'r') as f:
+                on_disk = json.load(f)
+            on_disk["top_k"] = 5
+            with open(path + ".new", 'w') as f:
+                json.dump(on_disk, f)
+            os.replace(path + ".new", path)
+            assert(watcher.changed(timeout=1.0) is True)
+            watcher.close()
+
+            # The tuple comes back as a list, that isn't a change
+            assert(cs.reload_config() == ["top_k"])
+            assert(cs.config.resize_target == (320, 320))
+            assert(config.update() is True and config.top_k == 5)
+
+            # Through the running server
+            cs.start()
+            try:
+                time.sleep(0.2)
+                on_disk["top_k"] = 3
+                with open(path, 'w') as f:
+                    json.dump(on_disk, f)
+                # The wakeup can come while the write is still in progress
+                deadline = time.time() + 2.0
+                while not config.update() and time.time() < deadline:
+                    wait_any([config.waitable()], timeout=0.1)
+                assert(config.top_k == 3)
+            finally:
+                cs._stop_event.set()
+                cs.join(timeout=3)
+
+    def test_025_debounced_save(self):
+        """Test if save requests in a burst make one write, that replaces the config file at once"""
+        fake_log_q = Queue()
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "cfg.json")
+            cs = ConfigServer(name="test-cs", logging_q=fake_log_q, config_file=path, save_delay=0.2)
+            cs.flush_config()
+            inode = os.stat(path).st_ino
+            for i in range(20):
+                cs.create_if_unknown(f"key_{i}", i)
+                assert(cs.save_config() is True)
+            assert(not os.path.exists(path) or "key_0" not in open(path).read())
+
+            time.sleep(0.5)
+            with open(path, 'r') as f:
+                on_disk = json.load(f)
+            assert(on_disk["key_19"] == 19)
+            assert(os.stat(path).st_ino != inode)
+            assert(os.listdir(d) == ["cfg.json"])
+            assert(cs.flush_config() is False)
+
+            saves = 0
+            while True:
+                try:
+                    saves += list(fake_log_q.get(timeout=0.2).values())[0][1] == "Saving config"
+                except queue.Empty:
+                    break
+            assert(saves == 2)
+
+    def test_026_config_schema(self):
+        """Test if declared keys are checked on the master and if copies call the subscribers of changed keys"""
+        fake_log_q = Queue()
+        cs = ConfigServer(name="test-cs", logging_q=fake_log_q)
+        cs.config.top_k = "ten"
+        cs.config.resize_target = [320, 320]
+        assert(cs.declare("top_k", int, 10, min=1, max=100) is False)
+        assert(cs.declare("resize_target", tuple, (300, 300)) is False)
+        assert(cs.declare("min_score", float, 0.8, min=0.0, max=1.0) is True)
+        assert(cs.config.top_k == 10 and cs.config.resize_target == (320, 320) and cs.config.min_score == 0.8)
+
+        self.assertRaises(ValueError, setattr, cs.config, "top_k", 0)
+        self.assertRaises(TypeError, setattr, cs.config, "min_score", "high")
+        self.assertRaises(ValueError, ConfigField, str, "x", choices=["a", "b"])
+        cs.config.min_score = 1
+        assert(isinstance(cs.config.min_score, float))
+
+        config = cs.get_config_copy()
+        seen = []
+        config.subscribe("top_k", lambda k, v: seen.append((k, v, config.min_score)))
+        with cs.batch():
+            cs.config.top_k = 5
+            cs.config.min_score = 0.5
+            cs.config.top_k = 6
+        cs.config.other_026 = 1
+        assert(config.update() is True)
+        assert(seen == [("top_k", 6, 0.5)])
+
+    def test_027_log_level_filter(self):
+        """Test if a service only formats and sends the messages some logger output would print"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        cs.create_if_unknown("log_logging_lvl", [INFO, ERROR])
+        cs.create_if_unknown("log_rejection_list", [[], []])
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, secondary_data_in_list=[])
+        service.update_log_level()
+
+        formatted = []
+
+        class Lazy:
+            def __str__(self):
+                formatted.append(1)
+                return "lazy"
+
+        def sent():
+            out = []
+            while True:
+                try:
+                    msg = fake_log_q.get(timeout=0.1)
+                except queue.Empty:
+                    return out
+                # The config copy logs its updates too, leave out the time
+                for level, [sender, text, ts] in msg.items():
+                    if sender == service.name:
+                        out.append({level: [sender, text]})
+
+        sent()
+        service.debug("Not sent : %s", Lazy())
+        service.info("Sent : %s %d", Lazy(), 3)
+        assert(sent() == [{INFO: [service.name, "Sent : lazy 3"]}])
+        assert(formatted == [1])
+
+        # The level follows the config
+        cs.config.log_logging_lvl = [INFO, DEBUG]
+        service.cfg.update()
+        service.debug("Sent : %s", Lazy())
+        assert(sent()[-1] == {DEBUG: [service.name, "Sent : lazy"]})
+
+        # An output that rejects the service doesn't count
+        cs.config.log_rejection_list = [[], [service.name]]
+        service.cfg.update()
+        service.debug("Not sent")
+        assert(sent() == [])
+
+    def test_028_batched_log_transport(self):
+        """Test if a running service sends its log messages in batches, without losing any"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        service = Chatty(stop_event=stop, config_server=cs, logging_q=fake_log_q, secondary_data_in_list=[],
+                         min_runtime=0.0001)
+        service.start()
+        time.sleep(0.3)
+        stop.set()
+
+        # Read while it quits, it can't exit with messages stuck in the pipe
+        puts, records = 0, []
+        while True:
+            try:
+                item = fake_log_q.get(timeout=0.2)
+            except queue.Empty:
+                break
+            if isinstance(item, list):
+                puts += 1
+                records.extend(list(r.values())[0][1] for r in item)
+        service.join(timeout=3)
+
+        debug = [r for r in records if r.startswith("loop ")]
+        assert(len(debug) > 100 and len(debug) % 10 == 0)
+        assert(records[0] == "Hello" and records[-1] == "Quitting")
+        assert(puts * 10 < len(records))
+
+    def test_029_logger_output_line(self):
+        """Test if the logger stamps lines with the sender's time, and only makes the lines an output takes"""
+        stop = Event()
+        fake_log_q = Queue()
+        out_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        logger = EdgineLogger(stop_event=stop, config_server=cs, in_q=fake_log_q, out_qs=[out_q])
+        cs.config.log_logging_lvl = [ERROR, DEBUG]
+        cs.config.log_rejection_list = [[], ["MUTED"]]
+        logger._cfg.update()
+
+        made = []
+        create_output_line = logger.create_output_line
+        logger.create_output_line = lambda *args: made.append(args) or create_output_line(*args)
+
+        ts = time.mktime((2024, 5, 17, 10, 30, 15, 0, 0, -1)) + 0.25
+        logger.output(DEBUG, "SVC", "first", ts)
+        assert(out_q.get(timeout=1) == "DEB:(05/17/2024 10:30:15) [SVC] first")
+        logger.output(DEBUG, "MUTED", "rejected", ts)
+        logger.output(DEBUG + 1, "SVC", "too verbose", ts)
+        assert(len(made) == 1)
+
+        # Same second, the prefix is reused
+        logger.output(INFO, "SVC", "second", ts + 0.5)
+        assert(out_q.get(timeout=1) == "INF:(05/17/2024 10:30:15) [SVC] second")
+        logger.output(INFO, "SVC", "third", ts + 1.0)
+        assert(out_q.get(timeout=1) == "INF:(05/17/2024 10:30:16) [SVC] third")
+
+    def test_030_log_sinks(self):
+        """Test if log sinks write and rotate their files, and if binary logs decode back to the records"""
+        stop = Event()
+        fake_log_q = Queue()
+        with tempfile.TemporaryDirectory() as d:
+            text = FileSink(os.path.join(d, "edgine.log"), max_bytes=1000, backups=2)
+            binary = BinarySink(os.path.join(d, "edgine.bin"), max_bytes=300, backups=3, compress=True)
+            cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+            logger = EdgineLogger(stop_event=stop, config_server=cs, in_q=fake_log_q, sinks=[text, binary])
+            cs.config.log_logging_lvl = [ERROR, DEBUG, INFO]
+            cs.config.log_rate_limiting_list = [1000, 100000, 100000]
+            logger._cfg.update()
+            logger.init_rate_limiter(1)
+            logger.init_rate_limiter(2)
+
+            ts = time.time()
+            for i in range(100):
+                logger.output(DEBUG if i % 2 else INFO, f"SVC{i % 3}", f"message {i}", ts + i)
+            logger.close_sinks()
+
+            assert(sorted(os.listdir(d)) == ["edgine.bin", "edgine.bin.1.gz", "edgine.bin.2.gz", "edgine.bin.3.gz",
+                                             "edgine.log", "edgine.log.1", "edgine.log.2"])
+            with open(os.path.join(d, "edgine.log")) as f:
+                assert(f.read().splitlines()[-1].endswith("[SVC0] message 99"))
+
+            # Only INFO and up went to the binary sink, every file decodes on its own
+            records = []
+            for name in ["edgine.bin.3.gz", "edgine.bin.2.gz", "edgine.bin.1.gz", "edgine.bin"]:
+                records.extend(decode(os.path.join(d, name)))
+            assert(records[-1] == (INFO, "SVC2", ts + 98, "message 98"))
+            assert(all(level == INFO for level, _, _, _ in records))
+            assert([int(m.split()[1]) for _, _, _, m in records] == list(range(100 - 2 * len(records), 100, 2)))
+            self.assertRaises(ValueError, list, decode(os.path.join(d, "edgine.log")))
+
+    def test_031_flight_recorder(self):
+        """Test if the flight recorder keeps the last records of every service, and is dumped when one dies"""
+        recorder = FlightRecorder(rows=2, log_slots=4, timing_slots=2)
+        for i in range(10):
+            recorder.record_log(1, DEBUG, f"message {i}", float(i))
+            recorder.record_timing(1, float(i), [i, 0.0, 0.0, 0.0])
+        recorder.record_log(0, ERROR, "x" * 1000, 1.0)
+        row = recorder.read(1)
+        assert([r["msg"] for r in row["logs"]] == ["message 6", "message 7", "message 8", "message 9"])
+        assert([t["get"] for t in row["timings"]] == [8.0, 9.0] and row["logs"][0]["level"] == "DEB")
+        assert(recorder.read(0)["logs"][0]["msg"] == "x" * RECORD_MSG_SIZE)
+
+        with tempfile.TemporaryDirectory() as d:
+            starter = EdgineStarter(config_file=os.path.join(d, "cfg.json"))
+            starter.config_server.config.flight_recorder_dir = os.path.join(d, "dumps")
+            starter.config_server.config.flight_recorder_level = DEBUG
+            starter.reg_service(Crash, min_runtime=0.001)
+            starter.init_services()
+            starter.start()
+            try:
+                deadline = time.time() + 5.0
+                while time.time() < deadline and not os.path.exists(os.path.join(d, "dumps")):
+                    time.sleep(0.1)
+                time.sleep(0.2)
+            finally:
+                starter.stop()
+
+            dumps = os.listdir(os.path.join(d, "dumps"))
+            assert(len(dumps) == 1)
+            with open(os.path.join(d, "dumps", dumps[0])) as f:
+                dump = json.load(f)
+
+        # The debug messages never went to the logger, the recorder still has them
+        assert(dump["reason"] == "Crash[0] exited with code 1")
+        assert(dump["state"]["Crash[0]"]["alive"] is False)
+        service = dump["services"]["Crash[0]"]
+        assert(service["logs"][-1]["msg"] == "loop 20")
+        assert(len(service["timings"]) == 19)
+
+    @unittest.skipIf(np is None, "numpy not available")
+    def test_032_batch_over_shared_memory(self):
+        """Test if a batch of shared memory views stays intact while the producer keeps posting"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        shm_q = SharedMemoryQueue(slot_size=64, slots=2, maxsize=4)
+        conn = Connection(shm_q)
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, data_in=conn,
+                        secondary_data_in_list=[], batching=True, batch_size=3, batch_wait_ms=300)
+        try:
+            shm_q.put_nowait(np.array([1] * 4))
+            shm_q.put_nowait(np.array([2] * 4))
+
+            # The producer posts as soon as a slot is free
+            producer = threading.Thread(target=shm_q.put, args=(np.array([3] * 4), True, 2.0))
+            first = service.get_from_q(timeout=1)
+            producer.start()
+            batch, envelopes = service.get_batch(first)
+            assert([b.tolist() for b in batch] == [[1] * 4, [2] * 4])
+
+            # Once the batch is done, its slots are free again
+            assert(service.get_from_q(timeout=1).tolist() == [3] * 4)
+            producer.join(timeout=2)
+        finally:
+            shm_q.close()
+            shm_q.unlink()
+
+    def test_033_replicated_producer_sequence(self):
+        """Test if the replicas of a producer number the items of an ordered pool in one sequence"""
+        seq_in = Connection(Queue(maxsize=64), capacity=64, sequence=True)
+        producers = [Process(target=post_all, args=(seq_in, [(p, i) for i in range(20)])) for p in range(2)]
+        for producer in producers:
+            producer.start()
+        items = []
+        seqs = []
+        for i in range(40):
+            items.append(seq_in.get(timeout=2))
+            seqs.append(seq_in.last_envelope.seq)
+        for producer in producers:
+            producer.join(timeout=2)
+        # No number is given twice, the order is left to the reordering connection
+        assert(sorted(seqs) == list(range(40)))
+        assert(sorted(items) == [(p, i) for p in range(2) for i in range(20)])
+
+    def test_034_reload_survives_save(self):
+        """Test if a value reloaded by the running server is kept when the parent saves the config"""
+        fake_log_q = Queue()
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "cfg.json")
+            cs = ConfigServer(name="test-cs", logging_q=fake_log_q, config_file=path, save_delay=0.05)
+            cs.config.top_k = 10
+            cs.config.min_score = 0.8
+            cs.start()
+            try:
+                config = cs.get_config_copy()
+                time.sleep(0.2)
+                with open(path, 'r') as f:
+                    on_disk = json.load(f)
+                on_disk["top_k"] = 3
+                with open(path, 'w') as f:
+                    json.dump(on_disk, f)
+                deadline = time.time() + 2.0
+                while not config.update() and time.time() < deadline:
+                    wait_any([config.waitable()], timeout=0.1)
+                assert(config.top_k == 3)
+
+                # A change made here is saved along with the reloaded one
+                cs.config.min_score = 0.6
+                cs.save_config()
+                cs.flush_config()
+                with open(path, 'r') as f:
+                    on_disk = json.load(f)
+                assert(on_disk["top_k"] == 3 and on_disk["min_score"] == 0.6)
+                assert(cs.config.top_k == 3)
+                assert(cs.get_config_copy().top_k == 3)
+            finally:
+                cs._stop_event.set()
+                cs.join(timeout=3)
+
+    def test_035_flight_recorder_level(self):
+        """Test if, with the default config, the flight recorder doesn't make a service format its debug messages"""
+        with tempfile.TemporaryDirectory() as d:
+            starter = EdgineStarter(config_file=os.path.join(d, "cfg.json"))
+            recorder = FlightRecorder(rows=1)
+            service = Plus6(stop_event=starter.global_stop, config_server=starter.config_server,
+                            logging_q=Queue(), secondary_data_in_list=[], flight_recorder=recorder)
+            service.update_log_level()
+
+            formatted = []
+
+            class Lazy:
+                def __str__(self):
+                    formatted.append(1)
+                    return "lazy"
+
+            service.debug("Not formatted : %s", Lazy())
+            assert(formatted == [] and recorder.read(0)["logs"] == [])
+            service.info("Recorded : %s", Lazy())
+            assert(formatted == [1] and recorder.read(0)["logs"][-1]["msg"] == "Recorded : lazy")
+
+    def test_036_log_sink_failures(self):
+        """Test if a stalled log sink drops records instead of queueing them, and a failed one stops taking them"""
+        self.assertRaises(TypeError, LogSink, "edgine.log")
+        stalled = threading.Event()
+
+        class StalledSink(FileSink):
+            def _start_file(self):
+                stalled.wait(timeout=5)
+                return b""
+
+        with tempfile.TemporaryDirectory() as d:
+            sink = StalledSink(os.path.join(d, "edgine.log"), max_queued=5)
+            for i in range(20):
+                sink.write(INFO, "SVC", f"message {i}", time.time())
+            # The file isn't even open, 5 records are waiting
+            assert(sink.drops == 15)
+            stalled.set()
+            sink.close()
+            with open(os.path.join(d, "edgine.log")) as f:
+                assert(len(f.read().splitlines()) == 20 - sink.drops)
+
+            # The directory of the log is a file
+            with open(os.path.join(d, "not_a_dir"), 'w') as f:
+                f.write("")
+            sink = FileSink(os.path.join(d, "not_a_dir", "edgine.log"))
+            sink.write(ERROR, "SVC", "lost", time.time())
+            deadline = time.time() + 2.0
+            while not sink.failed and time.time() < deadline:
+                time.sleep(0.01)
+            assert(sink.failed)
+            sink.write(ERROR, "SVC", "lost too", time.time())
+            sink.close()
+            assert(sink.drops == 2)
+
+    def test_037_log_delivery_on_errors(self):
+        """Test if a bad record doesn't cost the rest of its batch, and a crashing service still sends its messages"""
+        stop = Event()
+        fake_log_q = Queue()
+        out_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        logger = EdgineLogger(stop_event=stop, config_server=cs, in_q=fake_log_q, out_qs=[out_q])
+        cs.config.log_logging_lvl = [ERROR, INFO]
+        logger._cfg.update()
+
+        ts = time.time()
+        fake_log_q.put([{INFO: ["SVC", "first", ts]}, "not a record", {INFO: ["SVC", "second", ts]}])
+        time.sleep(0.1)
+        stop.set()
+        logger.run()
+        lines = []
+        while not out_q.empty():
+            lines.append(out_q.get(timeout=1))
+        assert([line.split("] ", 1)[1] for line in lines if "[SVC]" in line] == ["first", "second"])
+        assert(any("Error in run" in line for line in lines))
+
+        # The last messages of a service that crashes are still in its buffer
+        stop = Event()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        service = Crash(stop_event=stop, config_server=cs, logging_q=fake_log_q, secondary_data_in_list=[],
+                        min_runtime=0.0001)
+        self.assertRaises(RuntimeError, service.run)
+        records = []
+        while True:
+            try:
+                item = fake_log_q.get(timeout=0.2)
+            except queue.Empty:
+                break
+            if isinstance(item, list):
+                records.extend(list(r.values())[0][1] for r in item)
+        assert(records[-1] == "loop 20")
+
+    @unittest.skipIf(np is None, "numpy not available")
+    def test_038_broadcast_block(self):
+        """Test if a broadcast waits for a slow consumer with the BLOCK policy, up to its block_timeout"""
+        ring = SharedMemoryRing(slot_size=64, slots=1)
+        slow = Connection(SharedMemoryQueue(ring=ring, maxsize=2), policy=BLOCK, block_timeout=0.3)
+        plain = SharedMemoryQueue(ring=ring, maxsize=2)
+        bq = BroadcastQueue([slow, plain])
+        received = {0: [], 1: []}
+
+        def consume(index, member):
+            time.sleep(0.1)
+            # The second get releases the slot of the first item
+            for i in range(2):
+                received[index].append(member.get(timeout=1).tolist())
+
+        try:
+            bq.put_nowait(np.arange(4))
+            consumers = [threading.Thread(target=consume, args=(i, m)) for i, m in enumerate([slow, plain])]
+            for t in consumers:
+                t.start()
+            s = time.time()
+            bq.put_nowait(np.arange(4) + 1)
+            assert(time.time() - s >= 0.05)
+            for t in consumers:
+                t.join(timeout=2)
+            assert(received[0] == received[1] == [list(range(4)), list(range(1, 5))])
+            assert(slow.drops == 0)
+
+            # Nobody reads anymore, the wait runs out
+            s = time.time()
+            self.assertRaises(queue.Full, bq.put_nowait, np.arange(4))
+            assert(time.time() - s >= 0.25)
+            assert(slow.drops == 1)
+        finally:
+            bq.close()
+            ring.unlink()
+
+    def test_039_post_to_qs_errors(self):
+        """Test if an output that can't take the data doesn't keep it from the other outputs"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        mailbox = SharedMemoryMailbox(size=256)
+        small = Connection(mailbox, name="small")
+        out_q = Connection(Queue())
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, secondary_data_in_list=[],
+                        data_out_list=[small, out_q])
+        try:
+            assert(service.post_to_qs(list(range(1000))) is False)
+            assert(out_q.get(timeout=1) == list(range(1000)))
+            assert(service.post_to_qs([1]) is True)
+            assert(small.get(timeout=1) == [1] and out_q.get(timeout=1) == [1])
+
+            errors = []
+            while True:
+                try:
+                    msg = fake_log_q.get(timeout=0.2)
+                except queue.Empty:
+                    break
+                errors.extend(text for level, [sender, text, *ts] in msg.items()
+                              if level == ERROR and sender == service.name)
+            assert(len(errors) == 1 and "small" in errors[0] and "256 bytes" in errors[0])
+        finally:
+            mailbox.close()
+            mailbox.unlink()
+
+    def test_040_replicated_source(self):
+        """Test if the replicas of a source are an unordered pool, that doesn't drop their outputs"""
+        with tempfile.TemporaryDirectory() as d:
+            starter = EdgineStarter(config_file=os.path.join(d, "cfg.json"))
+            source = starter.reg_service(Counter, min_runtime=0.01, replicas=2)
+            sink = starter.reg_sink(source, capacity=16)
+            assert(not sink.reorder)
+
+            # The input of an ordered pool decides how its outputs are made
+            pool = starter.reg_service(Plus6, replicas=2)
+            starter.reg_sink(pool)
+            self.assertRaises(ValueError, starter.reg_connection, source, pool)
+
+            starter.init_services()
+            starter.start()
+            items = []
+            try:
+                deadline = time.time() + 0.5
+                while time.time() < deadline:
+                    try:
+                        items.append(sink.get(timeout=0.1))
+                    except queue.Empty:
+                        pass
+            finally:
+                starter.stop()
+
+        assert(len(items) > 20 and sink.drops == 0)
+        # Both replicas count from 1
+        assert(items.count(1) == 2)
+
+    @unittest.skipIf(np is None, "numpy not available")
+    def test_041_forward_shared_memory_view(self):
+        """Test if a view on a shared memory input stays intact when it is forwarded to a plain queue"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        shm_q = SharedMemoryQueue(slot_size=64, slots=1, maxsize=2)
+        # Keeps the object it gets, like a Queue whose feeder thread didn't pickle it yet
+        out_q = queue.Queue()
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, data_in=Connection(shm_q),
+                        data_out_list=[out_q], secondary_data_in_list=[])
+        try:
+            shm_q.put_nowait(np.zeros(4))
+            service.post_to_qs(service.get_from_q(timeout=1))
+            # The next get releases the slot, the producer reuses it
+            assert(service.get_from_q(timeout=0.1) is None)
+            shm_q.put_nowait(np.ones(4))
+            assert(payload(out_q.get(timeout=1)).tolist() == [0.0] * 4)
+        finally:
+            shm_q.close()
+            shm_q.unlink()
+
+    def test_042_shutdown_drain_race(self):
+        """Test if a service quits cleanly when another replica takes the last input item while it drains"""
+
+        class Racy(queue.Queue):
+            # Another replica takes the item between empty() and get_nowait()
+            def empty(self):
+                return False
+
+            def close(self):
+                pass
+
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, data_in=Racy(),
+                        secondary_data_in_list=[])
+        stop.set()
+        service.run()
+
+        quitting = False
+        while True:
+            try:
+                msg = fake_log_q.get(timeout=0.2)
+            except queue.Empty:
+                break
+            for record in msg if isinstance(msg, list) else [msg]:
+                quitting = quitting or list(record.values())[0][1] == "Quitting"
+        assert(quitting)
+
+    def test_043_config_wakeup_drain(self):
+        """Test if checking the config doesn't touch the wakeup pipe, and waiting drains a stale wakeup"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, data_in=Queue(),
+                        secondary_data_in_list=[], event_driven=True)
+        drains = []
+        drain = cs._shared.drain
+        service.cfg._shared.drain = lambda reader: drains.append(reader) or drain(reader)
+        try:
+            assert(service.cfg.update() is False and drains == [])
+
+            cs.config.test_043 = 1
+            assert(service.cfg.update() is True and len(drains) == 1)
+
+            # A byte for a change we already read wakes the service up once
+            os.write(cs._shared._wakeups[-1], b"\0")
+            assert(service.cfg.update() is False and len(drains) == 1)
+            assert(service.wait_for_event(timeout=0.0) is False and len(drains) == 2)
+            assert(wait_any([service.cfg.waitable()], timeout=0.0) == [])
+        finally:
+            del service.cfg._shared.drain
+
+    def test_044_plain_queues(self):
+        """Test if services linked by plain queues exchange the bare data, the envelopes stay in Connections"""
+        stop = Event()
+        fake_log_q = Queue()
+        cs = ConfigServer(stop_event=stop, name="test-cs", logging_q=fake_log_q)
+        second_q = Queue()
+        out_q = Queue()
+        source = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, secondary_data_in_list=[],
+                       data_out_list=[second_q, out_q])
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, secondary_data_in_list=[second_q])
+        source.post_to_qs({"threshold": 3})
+        assert(out_q.get(timeout=1) == {"threshold": 3})
+        deadline = time.time() + 1.0
+        while service.secondary_data[0] is None and time.time() < deadline:
+            service.update_secondary_data()
+        assert(service.secondary_data[0] == {"threshold": 3})
+
+        # Through a Connection, the secondary data is unwrapped too
+        conn = Connection(Queue())
+        source = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, secondary_data_in_list=[],
+                       data_out_list=[conn])
+        service = Plus6(stop_event=stop, config_server=cs, logging_q=fake_log_q, secondary_data_in_list=[conn])
+        source.post_to_qs([1, 2])
+        while service.secondary_data[0] is None and time.time() < deadline + 1.0:
+            service.update_secondary_data()
+        assert(service.secondary_data[0] == [1, 2])
+
+    @unittest.skipIf(not hasattr(signal, "SIGUSR1"), "no SIGUSR1 on this platform")
+    def test_045_dump_signal(self):
+        """Test if SIGUSR1 dumps the flight recorder outside of the signal handler, even while the config is busy"""
+        with tempfile.TemporaryDirectory() as d:
+            starter = EdgineStarter(config_file=os.path.join(d, "cfg.json"))
+            starter.config_server.config.flight_recorder_dir = os.path.join(d, "dumps")
+            starter.reg_service(Plus6)
+            starter.init_services()
+            starter.start()
+            try:
+                # The handler would deadlock if it synced the config itself
+                with starter.config_server._sync_lock:
+                    os.kill(os.getpid(), signal.SIGUSR1)
+                    time.sleep(0.2)
+                    assert(not os.path.exists(os.path.join(d, "dumps")))
+                deadline = time.time() + 2.0
+                while time.time() < deadline and not os.path.exists(os.path.join(d, "dumps")):
+                    time.sleep(0.05)
+                time.sleep(0.1)
+            finally:
+                starter.stop()
+
+            dumps = os.listdir(os.path.join(d, "dumps"))
+            assert(len(dumps) == 1)
+            with open(os.path.join(d, "dumps", dumps[0])) as f:
+                assert(json.load(f)["reason"] == "signal SIGUSR1")
+
+    def test_046_prometheus_summaries(self):
+        """Test if the summaries have their _sum and _count series, and special floats are written as NaN and +Inf"""
+        text = format_metric("edgine_x", "gauge", "X", [({"v": "nan"}, float("nan")), ({"v": "inf"}, float("inf")),
+                                                       ({"v": "-inf"}, float("-inf"))])
+        assert(text.splitlines()[2:] == ['edgine_x{v="nan"} NaN', 'edgine_x{v="inf"} +Inf', 'edgine_x{v="-inf"} -Inf'])
+
+        h = LatencyHistogram()
+        h.record(0.5)
+        h.record(1.5)
+        h.reset()
+        h.record(1.0)
+        assert(h.count == 1 and h.total == 3.0 and h.total_count == 3)
+
+        with tempfile.TemporaryDirectory() as d:
+            starter = EdgineStarter(config_file=os.path.join(d, "cfg.json"))
+            starter.reg_service(Plus6)
+            starter.init_services()
+            starter.start()
+            try:
+                lines = starter.prometheus_metrics().splitlines()
+            finally:
+                starter.stop()
+        family = [line.split(" ")[0] for line in lines if line.startswith("edgine_blogic_seconds")]
+        assert('edgine_blogic_seconds{service="Plus6[0]",quantile="0.99"}' in family)
+        assert('edgine_blogic_seconds_sum{service="Plus6[0]"}' in family)
+        assert('edgine_blogic_seconds_count{service="Plus6[0]"}' in family)
+        types = [line for line in lines if line.startswith("# TYPE edgine_blogic_seconds")]
+        assert(types == ["# TYPE edgine_blogic_seconds summary", "# TYPE edgine_blogic_seconds_max gauge"])